@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import os
-import aiohttp
 
 HOME_HOST = os.getenv("HOME_HOST")
 HOME_PORT = os.getenv("HOME_PORT")
@@ -13,14 +12,14 @@ data = {"username": HOME_USERNAME, "password": HOME_PASSWORD}
 
 
 class Auth:
-    def __init__(self):
+    def __init__(self, session):
+        self.session = session
         self.token = None
 
     async def _get_token(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as resp:
-                parsed = await resp.json()
-                return parsed["token"]
+        async with self.session.post(url, json=data) as resp:
+            parsed = await resp.json()
+            return parsed["token"]
 
     async def get_token(self):
         if not self.token:
@@ -1,11 +1,46 @@
+import asyncio
 import json
+import logging
 import os
+import tempfile
+
+CACHE_FLUSH_INTERVAL_S = float(os.getenv("CACHE_FLUSH_INTERVAL_S", 5))
+CACHE_FLUSH_THRESHOLD = int(os.getenv("CACHE_FLUSH_THRESHOLD", 500))
+
+# Secondary indexes maintained per resource type; resource_type -> indexed fields
+DEFAULT_INDEXES = {
+    "devices": ["vendor_id", "location"],
+    "plugs": ["device"],
+    "lights": ["device"],
+    "environmentals": ["device"],
+    "systems": ["device"],
+}
+
+
+def is_indexable(value):
+    """Only scalar values are indexed; lists (e.g. many-to-many UUIDs) are skipped."""
+    return value is not None and isinstance(value, (str, int, float, bool))
 
 
 class Cache:
-    def __init__(self, file_path="cache_data.json"):
+    def __init__(
+        self,
+        file_path="cache_data.json",
+        flush_interval_s=CACHE_FLUSH_INTERVAL_S,
+        flush_threshold=CACHE_FLUSH_THRESHOLD,
+        indexes=DEFAULT_INDEXES,
+    ):
         self.cache = {}
+        # resource_type -> field -> value -> set of resource IDs
+        self.indexes = {
+            resource_type: {field: {} for field in fields}
+            for resource_type, fields in indexes.items()
+        }
         self.file_path = file_path
+        self.flush_interval_s = flush_interval_s
+        self.flush_threshold = flush_threshold
+        self.dirty_count = 0  # Number of mutations since the last save
+        self.flush_event = asyncio.Event()  # Set when the dirty threshold is reached
         self.load_cache()
 
     def load_cache(self):
@@ -15,11 +50,111 @@ class Cache:
                 self.cache = json.load(file)
         else:
             self.cache = {}
+        self.rebuild_indexes()
+
+    def add_index(self, resource_type, field):
+        """
+        Declare a secondary index on `field` for `resource_type` and build it from
+        current contents.
+        """
+        self.indexes.setdefault(resource_type, {})[field] = {}
+        self.rebuild_indexes(resource_type)
+
+    def rebuild_indexes(self, resource_type=None):
+        resource_types = [resource_type] if resource_type else list(self.indexes)
+        for rtype in resource_types:
+            fields = self.indexes.get(rtype, {})
+            for field in fields:
+                fields[field] = {}
+            for resource_id, resource in self.cache.get(rtype, {}).items():
+                self._index(rtype, resource_id, resource)
+
+    def _index(self, resource_type, resource_id, resource):
+        for field, index in self.indexes.get(resource_type, {}).items():
+            value = resource.get(field)
+            if is_indexable(value):
+                index.setdefault(value, set()).add(resource_id)
+
+    def _unindex(self, resource_type, resource_id, resource):
+        for field, index in self.indexes.get(resource_type, {}).items():
+            value = resource.get(field)
+            ids = index.get(value) if is_indexable(value) else None
+            if ids is not None:
+                ids.discard(resource_id)
+                if not ids:
+                    del index[value]
+
+    def snapshot(self):
+        """
+        Copy of the cache that stays consistent while it is serialized on another
+        thread. Only the per-type dicts are copied: resources are replaced on update,
+        never mutated, so they can be shared.
+        """
+        return {
+            resource_type: dict(resources)
+            for resource_type, resources in self.cache.items()
+        }
+
+    def write_file(self, data):
+        """Atomically write `data` to the JSON file (temp file, then rename)."""
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.file_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
 
     def save_cache(self):
-        """Save cache to a JSON file."""
-        with open(self.file_path, "w") as file:
-            json.dump(self.cache, file, indent=2)
+        """Save the cache synchronously (e.g. on shutdown)."""
+        self.write_file(self.cache)
+        self.dirty_count = 0
+
+    async def save_cache_async(self):
+        """Save a snapshot of the cache, serializing it off the event loop."""
+        data, pending = self.snapshot(), self.dirty_count
+        self.dirty_count = 0
+        try:
+            await asyncio.to_thread(self.write_file, data)
+        except Exception:
+            # Changes made since the snapshot are already counted
+            self.dirty_count += pending
+            raise
+
+    def mark_dirty(self):
+        """Record a mutation; persistence is deferred to the background flusher."""
+        self.dirty_count += 1
+        if self.dirty_count >= self.flush_threshold:
+            self.flush_event.set()
+
+    def flush(self):
+        """Persist pending changes immediately, if any (e.g. on shutdown)."""
+        if self.dirty_count:
+            logging.info(f"Flushing cache; {self.dirty_count} pending changes")
+            self.save_cache()
+
+    async def run_flusher(self):
+        """
+        Background task persisting the cache at most once per flush interval, or sooner
+        if the dirty threshold is reached.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.flush_event.wait(), timeout=self.flush_interval_s
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            if not self.dirty_count:
+                continue
+            logging.info(f"Flushing cache; {self.dirty_count} pending changes")
+            try:
+                await self.save_cache_async()
+            except Exception as e:
+                logging.error(f"Error flushing cache: {e}")
 
     def get(self, resource_type, resource_id=None):
         if resource_type not in self.cache:
@@ -28,26 +163,52 @@ class Cache:
             return self.cache[resource_type].get(resource_id)
         return list(self.cache[resource_type].values())
 
+    def find(self, resource_type, field, value):
+        """Returns all resources of `resource_type` whose indexed `field` equals `value`."""
+        index = self.indexes.get(resource_type, {}).get(field)
+        if index is None:
+            raise KeyError(f"No index declared for {resource_type}.{field}")
+        resources = self.cache.get(resource_type, {})
+        return [resources[resource_id] for resource_id in index.get(value, ())]
+
+    def find_one(self, resource_type, field, value):
+        """Like `find`, but returns the first match or None."""
+        matches = self.find(resource_type, field, value)
+        return matches[0] if matches else None
+
     def add(self, resource_type, resource):
         resource_id = resource.get("id") or resource.get("uuid")
         if resource_type not in self.cache:
             self.cache[resource_type] = {}
+        existing = self.cache[resource_type].get(resource_id)
+        if existing is not None:
+            self._unindex(resource_type, resource_id, existing)
         self.cache[resource_type][resource_id] = resource
-        self.save_cache()  # Persist changes
+        self._index(resource_type, resource_id, resource)
+        self.mark_dirty()
 
     def update(self, resource_type, resource_id, resource_data):
         if resource_type in self.cache and resource_id in self.cache[resource_type]:
-            self.cache[resource_type][resource_id].update(resource_data)
-            self.save_cache()  # Persist changes
+            existing = self.cache[resource_type][resource_id]
+            self._unindex(resource_type, resource_id, existing)
+            # Replaced rather than mutated, so a snapshot being saved stays consistent
+            resource = {**existing, **resource_data}
+            self.cache[resource_type][resource_id] = resource
+            self._index(resource_type, resource_id, resource)
+            self.mark_dirty()
 
     def delete(self, resource_type, resource_id):
         if resource_type in self.cache and resource_id in self.cache[resource_type]:
+            self._unindex(
+                resource_type, resource_id, self.cache[resource_type][resource_id]
+            )
             del self.cache[resource_type][resource_id]
-            self.save_cache()  # Persist changes
+            self.mark_dirty()
 
     def clear(self, resource_type=None):
         if resource_type:
             self.cache[resource_type] = {}
         else:
             self.cache.clear()
-        self.save_cache()  # Persist changes
+        self.rebuild_indexes(resource_type)
+        self.mark_dirty()
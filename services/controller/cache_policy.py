@@ -0,0 +1,112 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+CACHE_DEFAULT_TTL_S = float(os.getenv("CACHE_DEFAULT_TTL_S", 30))
+CACHE_STALE_TTL_S = float(os.getenv("CACHE_STALE_TTL_S", 300))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 5000))
+
+# Per resource type freshness; anything not listed uses CACHE_DEFAULT_TTL_S
+RESOURCE_TTLS_S = {
+    "device_types": 3600,
+    "locations": 3600,
+    "devices": 300,
+    "routines": 60,
+    "actions": 60,
+    "plugs": 30,
+    "lights": 30,
+    "environmentals": 30,
+    "systems": 30,
+}
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+class CachePolicy:
+    """
+    Tracks when each cached (resource_type, resource_id) was last fetched from the server.
+    Entries younger than their TTL are fresh, entries within a further stale window can be
+    served while revalidating in the background, and anything older (or evicted) is a miss.
+    A resource_id of None stands for the full listing of a resource type.
+
+    The LRU bound covers the cached data too: `on_evict(resource_type, resource_id)` is
+    called for every evicted resource so its owner can drop the data with the metadata.
+    """
+
+    def __init__(
+        self,
+        ttls=RESOURCE_TTLS_S,
+        default_ttl_s=CACHE_DEFAULT_TTL_S,
+        stale_ttl_s=CACHE_STALE_TTL_S,
+        max_entries=CACHE_MAX_ENTRIES,
+        on_evict=None,
+    ):
+        self.ttls = ttls
+        self.default_ttl_s = default_ttl_s
+        self.stale_ttl_s = stale_ttl_s
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        # (resource_type, resource_id) -> last fetch time, least recently used first
+        self.fetched_at = OrderedDict()
+        self.stats = {}
+
+    def get_ttl(self, resource_type):
+        return self.ttls.get(resource_type, self.default_ttl_s)
+
+    def get_stats(self, resource_type):
+        if resource_type not in self.stats:
+            self.stats[resource_type] = {
+                "hits": 0,
+                "stale_hits": 0,
+                "misses": 0,
+                "refreshes": 0,
+                "evictions": 0,
+            }
+        return self.stats[resource_type]
+
+    def lookup(self, resource_type, resource_id=None):
+        """Classifies the entry as FRESH, STALE or MISS and records the outcome."""
+        key = (resource_type, resource_id)
+        stats = self.get_stats(resource_type)
+        fetched_at = self.fetched_at.get(key)
+        if fetched_at is None:
+            stats["misses"] += 1
+            return MISS
+
+        self.fetched_at.move_to_end(key)
+        age = time.monotonic() - fetched_at
+        ttl = self.get_ttl(resource_type)
+        if age <= ttl:
+            stats["hits"] += 1
+            return FRESH
+        if age <= ttl + self.stale_ttl_s:
+            stats["stale_hits"] += 1
+            return STALE
+        stats["misses"] += 1
+        return MISS
+
+    def mark_fresh(self, resource_type, resource_id=None):
+        key = (resource_type, resource_id)
+        self.fetched_at[key] = time.monotonic()
+        self.fetched_at.move_to_end(key)
+        while len(self.fetched_at) > self.max_entries:
+            (evicted_type, evicted_id), _ = self.fetched_at.popitem(last=False)
+            self.get_stats(evicted_type)["evictions"] += 1
+            logging.debug(f"Evicted {evicted_type}/{evicted_id} from cache policy")
+            if evicted_id is None:
+                continue
+            # The listing no longer has all of its items, so it cannot be served either
+            self.fetched_at.pop((evicted_type, None), None)
+            if self.on_evict:
+                self.on_evict(evicted_type, evicted_id)
+
+    def mark_refresh(self, resource_type):
+        self.get_stats(resource_type)["refreshes"] += 1
+
+    def invalidate(self, resource_type, resource_id=None):
+        """Drops freshness for a resource and for the listing it belongs to."""
+        self.fetched_at.pop((resource_type, resource_id), None)
+        self.fetched_at.pop((resource_type, None), None)
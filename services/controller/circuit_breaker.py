@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+from collections import deque
+
+CIRCUIT_WINDOW_SIZE = int(os.getenv("CIRCUIT_WINDOW_SIZE", 20))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 10))
+CIRCUIT_FAILURE_RATIO = float(os.getenv("CIRCUIT_FAILURE_RATIO", 0.5))
+# Calls slower than this count as failures, so a degraded (not just down) server trips too
+CIRCUIT_SLOW_CALL_S = float(os.getenv("CIRCUIT_SLOW_CALL_S", 2))
+CIRCUIT_OPEN_S = float(os.getenv("CIRCUIT_OPEN_S", 10))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing or slow dependency and lets callers take a fallback instead.
+
+    Outcomes of the last `window_size` calls are kept; once at least `min_calls` are known
+    and the share of failed or slow ones reaches `failure_ratio`, the circuit opens for
+    `open_s`. After that a single probe call is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name,
+        window_size=CIRCUIT_WINDOW_SIZE,
+        min_calls=CIRCUIT_MIN_CALLS,
+        failure_ratio=CIRCUIT_FAILURE_RATIO,
+        slow_call_s=CIRCUIT_SLOW_CALL_S,
+        open_s=CIRCUIT_OPEN_S,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_s = slow_call_s
+        self.open_s = open_s
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window_size)  # True for a good call
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+        self.close_listeners = []
+
+    def add_close_listener(self, listener):
+        """Registers `listener()`, called when the circuit closes after being open."""
+        self.close_listeners.append(listener)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "state": self.state,
+            "window": len(self.outcomes),
+            "failures": self.outcomes.count(False),
+        }
+
+    def available(self):
+        """Whether a call would currently be let through; does not claim the probe."""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.open_s
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return True
+
+    def before_call(self):
+        """Claims permission for one call, or raises CircuitOpenError."""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_s:
+            logging.info(f"Circuit {self.name} half-open; probing")
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def release(self):
+        """Gives back permission for a call that ended without an outcome (e.g. cancelled)."""
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    def record(self, ok, elapsed_s):
+        good = ok and elapsed_s < self.slow_call_s
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if good:
+                logging.info(f"Circuit {self.name} closed")
+                self.state = CLOSED
+                self.outcomes.clear()
+                for listener in self.close_listeners:
+                    try:
+                        listener()
+                    except Exception as e:
+                        logging.error(f"Error notifying circuit close: {e}")
+            else:
+                self.open()
+            return
+
+        self.outcomes.append(good)
+        if self.state == CLOSED and len(self.outcomes) >= self.min_calls:
+            failures = self.outcomes.count(False)
+            if failures / len(self.outcomes) >= self.failure_ratio:
+                self.open()
+
+    def open(self):
+        logging.warning(f"Circuit {self.name} open for {self.open_s}s")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self.stats["opened"] += 1
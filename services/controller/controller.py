@@ -2,9 +2,8 @@
 
 import logging
 import asyncio
-import json
 import os
-from aiohttp import web, ClientSession
+from aiohttp import web, ClientTimeout
 from websocket_client import WebsocketClient
 from mqtt_client import AsyncMqttClient
 from websocket_transformer import (
@@ -18,6 +17,27 @@ from cache import Cache
 from resource_handler import ResourceHandler
 from local_server import LocalServer
 from message_handler import MessageHandler
+from http_session import create_session
+from outbox import Outbox
+from envelope import Envelope
+from device_resolver import DeviceResolver
+from write_coalescer import WriteCoalescer
+from pipeline import (
+    Pipeline,
+    OVERFLOW_BLOCK,
+    OVERFLOW_COALESCE,
+    OVERFLOW_DROP_OLDEST,
+)
+from liveness import LivenessMonitor, LIVENESS_PROBE_TIMEOUT_S
+from circuit_breaker import CLOSED
+from metrics import (
+    REGISTRY,
+    Registry,
+    CollectedCounter,
+    Gauge,
+    EventLoopLagMonitor,
+    MESSAGES_IN,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,36 +46,70 @@ HOME_PORT = os.getenv("HOME_PORT")
 DEVICE_ID = os.getenv("DEVICE_ID")
 
 HEALTH_CHECK_URL = f"http://{HOME_HOST}:{HOME_PORT}/status/"
-HEALTH_CHECK_INTERVAL_S = 60
+
+PIPELINE_HANDLER_WORKERS = int(os.getenv("PIPELINE_HANDLER_WORKERS", 4))
+
+# How often routines and actions are re-fetched from Django while online
+ROUTINE_SYNC_INTERVAL_S = float(os.getenv("ROUTINE_SYNC_INTERVAL_S", 60))
 
 
 def transform_index_response(items):
     return {item["uuid"]: item for item in items}
 
 
+def message_handler_key(envelope):
+    """Status reports coalesce per (action, src), as only a device's newest one matters."""
+    data = Envelope.wrap(envelope).data
+    if isinstance(data, dict) and data.get("src"):
+        action = data.get("action")
+        if isinstance(action, str) and action.endswith("__status"):
+            return (action, data["src"])
+    return object()  # Never coalesced
+
+
 class Controller:
     def __init__(self):
-        self.online = False
         self.token = None
+        self.mqtt_topics = set()
+
+        # One pooled HTTP session shared by every outbound request to Django
+        self.session = create_session()
 
-        self.auth = Auth()
+        self.auth = Auth(self.session)
+        # Online/offline state, fed by the probe, the Django WebSocket and real requests
+        self.liveness = LivenessMonitor(
+            self.check_server_availability, self.handle_liveness_change
+        )
         self.websocket_client = WebsocketClient(
-            self.handle_ws_client_msg, self.auth.get_token
+            self.handle_ws_client_msg,
+            self.auth.get_token,
+            self.handle_ws_connection_change,
         )
         self.mqtt_client = AsyncMqttClient(self.handle_message_mqtt)
-        self.routine_manager = RoutineManager(self.handle_routine_msg)
         self.cache = Cache()
+        self.routine_manager = RoutineManager(self.handle_routine_msg, self.cache.get)
+        self.outbox = Outbox()
         self.resource_handler = ResourceHandler(
             self.cache,
             f"http://{HOME_HOST}:{HOME_PORT}",
             self.get_is_online,
             self.auth.get_token,
+            self.session,
+            outbox=self.outbox,
+        )
+        self.device_resolver = DeviceResolver(self.resource_handler)
+        self.write_coalescer = WriteCoalescer(self.resource_handler)
+        self.message_handler = MessageHandler(
+            self.resource_handler, self.device_resolver, self.write_coalescer
         )
-        self.message_handler = MessageHandler(self.resource_handler)
+        # This controller's gauges; shared module-level metrics come from REGISTRY
+        self.metrics = Registry(parent=REGISTRY)
         self.local_server = LocalServer(
             self.handle_local_server_api_request,
             self.handle_ws_server_msg,
             self.handle_local_server_auth_request,
+            self.device_resolver.get_location,
+            metrics_registry=self.metrics,
         )
 
         self.websocket_transformer = WebsocketTransformerRegistry(self.resource_handler)
@@ -63,28 +117,68 @@ class Controller:
         self.mqtt_transformer = MqttTransformerRegistry(self.resource_handler)
         register_mqtt_transformers(self.mqtt_transformer)
 
+        self.setup_pipeline()
+        self.loop_lag_monitor = EventLoopLagMonitor()
+        self.setup_metrics()
+
+        # Keep MQTT subscriptions in line with the registered transformers
+        self.mqtt_transformer.add_change_listener(self.refresh_mqtt_subscriptions)
+        # Apply routine and action edits made through the controller
+        self.resource_handler.add_change_listener(self.handle_resource_change)
+        self.resource_handler.add_outcome_listener(self.handle_request_outcome)
+
     def get_is_online(self):
-        return self.online
+        return self.liveness.online
+
+    def handle_ws_connection_change(self, connected):
+        self.liveness.report_connection("websocket", connected)
+
+    def handle_request_outcome(self, ok):
+        if ok:
+            self.liveness.report_success("request")
+        else:
+            self.liveness.report_failure("request")
+
+    def get_mqtt_subscriptions(self):
+        """Topics the controller actually consumes, instead of subscribing to `#`."""
+        return self.mqtt_transformer.subscription_patterns()
+
+    def refresh_mqtt_subscriptions(self):
+        topics = self.get_mqtt_subscriptions()
+        if topics == self.mqtt_topics:
+            return
+        self.mqtt_topics = topics
+        asyncio.create_task(self.mqtt_client.update_subscriptions(topics))
+
+    def handle_resource_change(self, method, resource_type, resource_id, resource):
+        # Apply single routine/action edits without re-registering everything
+        if resource_type == "routines":
+            if method == "DELETE":
+                self.routine_manager.remove_routine(resource_id)
+            elif isinstance(resource, dict):
+                self.routine_manager.update_routine(resource)
+        elif resource_type == "actions":
+            if method == "DELETE":
+                self.routine_manager.remove_action(resource_id)
+            elif isinstance(resource, dict):
+                self.routine_manager.update_action(resource)
 
     async def handle_local_server_auth_request(self, request):
         logging.info("Handling local server auth request")
 
-        if self.online:
+        if self.get_is_online():
             try:
                 url = f"http://{HOME_HOST}:{HOME_PORT}{request.path}"
                 data = await request.json()
 
                 # Forward the request to the Django server
-                async with ClientSession() as session:
-                    async with session.post(url, json=data) as response:
-                        # Forward the response back to the client
-                        return web.Response(
-                            status=response.status,
-                            body=await response.read(),
-                            headers={
-                                key: value for key, value in response.headers.items()
-                            },
-                        )
+                async with self.session.post(url, json=data) as response:
+                    # Forward the response back to the client
+                    return web.Response(
+                        status=response.status,
+                        body=await response.read(),
+                        headers={key: value for key, value in response.headers.items()},
+                    )
             except Exception as e:
                 logging.error(f"Error proxying request to Django server: {e}")
                 return web.Response(status=500, text="Internal Server Error")
@@ -111,8 +205,204 @@ class Controller:
         except Exception as e:
             logging.error(f"Error handling local server api request: {e}")
 
-    def handle_routine_msg(self, routine, action, eval_data):
+    def setup_pipeline(self):
+        """One bounded queue per sink, so a slow or stalled sink cannot hold up the others."""
+        self.pipeline = Pipeline()
+        # Its workers write to Django, so it must never hold up the producers: status
+        # reports coalesce per device (and are handled in order, one at a time, by
+        # whichever worker takes them), and when full the oldest item is dropped
+        self.pipeline.add_sink(
+            "message_handler",
+            self.message_handler.handle,
+            overflow=OVERFLOW_COALESCE,
+            key=message_handler_key,
+            workers=PIPELINE_HANDLER_WORKERS,
+        )
+        self.pipeline.add_sink(
+            "routine_manager",
+            self.routine_manager.handle_message,
+            overflow=OVERFLOW_DROP_OLDEST,
+        )
+        self.pipeline.add_sink(
+            "local_broadcast",
+            self.local_server.broadcast_ws,
+            overflow=OVERFLOW_DROP_OLDEST,
+        )
+        self.pipeline.add_sink(
+            "django_ws", self.websocket_client.send, overflow=OVERFLOW_DROP_OLDEST
+        )
+        self.pipeline.add_sink(
+            "ws_transform", self.transform_ws_msg, overflow=OVERFLOW_BLOCK
+        )
+        self.pipeline.add_sink(
+            "mqtt_transform", self.transform_mqtt_msg, overflow=OVERFLOW_BLOCK
+        )
+        self.pipeline.add_sink(
+            "mqtt_publish", self.mqtt_client.publish, overflow=OVERFLOW_BLOCK
+        )
+
+    def setup_metrics(self):
+        """Gauges read from live state on each /metrics scrape."""
+        self.metrics.register(
+            Gauge(
+                "controller_local_ws_clients",
+                "Connected local WebSocket clients.",
+                lambda: len(self.local_server.clients),
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_cache_hit_ratio",
+                "Share of cached reads served locally (fresh or stale), by resource type.",
+                self.collect_cache_hit_ratios,
+                ["resource_type"],
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_event_loop_lag_seconds",
+                "How late the event loop last woke a sleeping task.",
+                lambda: self.loop_lag_monitor.lag_s,
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_pipeline_queue_depth",
+                "Items waiting in each pipeline sink.",
+                lambda: {
+                    (name,): stats["depth"]
+                    for name, stats in self.pipeline.get_stats().items()
+                },
+                ["sink"],
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_pipeline_dropped_total",
+                "Items dropped by each pipeline sink's overflow policy.",
+                lambda: self.collect_pipeline_stat("dropped"),
+                ["sink"],
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_pipeline_coalesced_total",
+                "Items that replaced a queued item with the same key, by sink.",
+                lambda: self.collect_pipeline_stat("coalesced"),
+                ["sink"],
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_online",
+                "1 while the Django server is considered reachable.",
+                lambda: int(self.get_is_online()),
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_local_ws_max_lag_seconds",
+                "Age of the oldest queued message across local WebSocket clients.",
+                lambda: max(
+                    [stats["lag_s"] for stats in self.local_server.get_client_stats()],
+                    default=0.0,
+                ),
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_local_ws_queued_messages",
+                "Messages waiting in local WebSocket client queues.",
+                lambda: sum(
+                    stats["depth"] for stats in self.local_server.get_client_stats()
+                ),
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_mqtt_filtered_at_broker_total",
+                "Publishes the broker received but did not deliver to this client.",
+                lambda: self.mqtt_client.get_stats().get("filtered_at_broker"),
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_server_fetches_total",
+                "GETs sent to the Django server, and calls that joined one in flight.",
+                lambda: {
+                    (result,): count
+                    for result, count in self.resource_handler.get_fetch_stats().items()
+                },
+                ["result"],
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_circuit_open",
+                "1 while the circuit breaker is open or half open.",
+                lambda: int(
+                    self.resource_handler.get_circuit_stats()["state"] != CLOSED
+                ),
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_circuit_opened_total",
+                "Times the circuit breaker opened.",
+                lambda: self.resource_handler.get_circuit_stats()["opened"],
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_circuit_rejected_total",
+                "Calls sent down the offline path by the open circuit breaker.",
+                lambda: self.resource_handler.get_circuit_stats()["rejected"],
+            )
+        )
+        self.metrics.register(
+            Gauge(
+                "controller_bulkhead_requests",
+                "Requests to the Django server holding or waiting for a bulkhead slot.",
+                self.collect_bulkhead_stats,
+                ["operation", "state"],
+            )
+        )
+        self.metrics.register(
+            CollectedCounter(
+                "controller_write_coalescer_writes_total",
+                "Status writes submitted to the write coalescer, and writes sent.",
+                lambda: {
+                    (stage,): count
+                    for stage, count in self.write_coalescer.stats.items()
+                },
+                ["stage"],
+            )
+        )
+
+    def collect_pipeline_stat(self, stat):
+        return {
+            (name,): stats[stat] for name, stats in self.pipeline.get_stats().items()
+        }
+
+    def collect_bulkhead_stats(self):
+        return {
+            (operation, state): count
+            for operation, stats in self.resource_handler.get_bulkhead_stats().items()
+            for state, count in stats.items()
+        }
+
+    def collect_cache_hit_ratios(self):
+        ratios = {}
+        for resource_type, stats in self.resource_handler.get_cache_stats().items():
+            hits = stats["hits"] + stats["stale_hits"]
+            total = hits + stats["misses"]
+            if total:
+                ratios[(resource_type,)] = hits / total
+        return ratios
+
+    async def handle_routine_msg(self, routine, action, eval_data):
         logging.info("Handle routine message")
+        MESSAGES_IN.inc("routine")
 
         try:
             outMsg = {
@@ -122,101 +412,115 @@ class Controller:
                 "action": action,
                 "body": eval_data.get("body"),
             }
-            outMsgStr = json.dumps(outMsg)
+            # Encoded at most once, shared by every consumer below
+            envelope = Envelope.from_data(outMsg)
 
-            # Handle message
-            asyncio.create_task(self.message_handler.handle(outMsgStr))
-
-            # Send to django server
-            asyncio.create_task(self.websocket_client.send(outMsgStr))
+            # Transform and send to mqtt broker first; commands must not wait on Django
+            await self.pipeline.put("ws_transform", envelope)
 
             # Send to local clients
-            asyncio.create_task(self.local_server.broadcast_ws(outMsgStr))
+            await self.pipeline.put("local_broadcast", envelope)
 
-            def handle_transformed_msg(msg, topic):
-                asyncio.create_task(self.mqtt_client.publish(topic, msg))
+            # Send to django server
+            await self.pipeline.put("django_ws", envelope)
 
-            # Transform and send to mqtt broker
-            asyncio.create_task(
-                self.websocket_transformer.transform(outMsgStr, handle_transformed_msg)
-            )
+            # Handle message
+            await self.pipeline.put("message_handler", envelope)
         except Exception as e:
             logging.error(f"Error handling routine message: {e}")
 
-    def handle_ws_server_msg(self, message):
+    async def handle_ws_server_msg(self, message):
         logging.info("Handle WebSocket server message: %s", message)
+        MESSAGES_IN.inc("local_ws")
 
         try:
-            # Handle message
-            asyncio.create_task(self.message_handler.handle(message))
+            # Parsed once by the local server; every consumer below shares the Envelope
+            envelope = Envelope.wrap(message)
 
-            # Trigger any related routines; no need to transform this msg
-            asyncio.create_task(self.routine_manager.handle_message(message))
+            # Transform and send to mqtt broker first; commands must not wait on Django
+            await self.pipeline.put("ws_transform", envelope)
 
             # Send back to local clients
-            asyncio.create_task(self.local_server.broadcast_ws(message))
+            await self.pipeline.put("local_broadcast", envelope)
 
-            # Send to django server
-            asyncio.create_task(self.websocket_client.send(message))
+            # Trigger any related routines; no need to transform this msg
+            await self.pipeline.put("routine_manager", envelope)
 
-            def handle_transformed_msg(msg, topic):
-                asyncio.create_task(self.mqtt_client.publish(topic, msg))
+            # Send to django server
+            await self.pipeline.put("django_ws", envelope)
 
-            # Transform and send to mqtt broker
-            asyncio.create_task(
-                self.websocket_transformer.transform(message, handle_transformed_msg)
-            )
+            # Handle message
+            await self.pipeline.put("message_handler", envelope)
         except Exception as e:
             logging.error(f"Error handling websocket message: {e}")
 
-    def handle_ws_client_msg(self, message):
+    async def handle_ws_client_msg(self, message):
         logging.info("Handle WebSocket client message: %s", message)
+        MESSAGES_IN.inc("django_ws")
 
         try:
-            # Handle message
-            asyncio.create_task(self.message_handler.handle(message))
+            # Parse once; every consumer below shares the Envelope
+            envelope = Envelope.from_text(message)
 
-            # Trigger any related routines; no need to transform this msg
-            asyncio.create_task(self.routine_manager.handle_message(message))
+            # Transform and send to mqtt broker first; commands must not wait on Django
+            await self.pipeline.put("ws_transform", envelope)
 
             # Send to local clients
-            asyncio.create_task(self.local_server.broadcast_ws(message))
+            await self.pipeline.put("local_broadcast", envelope)
 
-            # Do not need to send back to django server; it should have distributed this message to everyone that needs it
+            # Trigger any related routines; no need to transform this msg
+            await self.pipeline.put("routine_manager", envelope)
 
-            def handle_transformed_msg(msg, topic):
-                asyncio.create_task(self.mqtt_client.publish(topic, msg))
+            # Do not need to send back to django server; it should have distributed this message to everyone that needs it
 
-            # Transform and send to mqtt broker
-            asyncio.create_task(
-                self.websocket_transformer.transform(message, handle_transformed_msg)
-            )
+            # Handle message
+            await self.pipeline.put("message_handler", envelope)
         except Exception as e:
             logging.error(f"Error handling websocket message: {e}")
 
-    def handle_message_mqtt(self, topic, message):
+    async def handle_message_mqtt(self, topic, message):
         logging.info("Handle MQTT message: %s (topic: %s)", message, topic)
+        MESSAGES_IN.inc("mqtt")
 
         try:
-
-            def handle_transformed_msg(msg):
-                asyncio.create_task(self.message_handler.handle(message))
-                asyncio.create_task(self.websocket_client.send(msg))
-                asyncio.create_task(self.local_server.broadcast_ws(msg))
-                asyncio.create_task(self.routine_manager.handle_message(msg))
-
             # Transform and send to websocket server, websocket clients,and routine manager for triggering related routines, if any
-            asyncio.create_task(
-                self.mqtt_transformer.transform(message, topic, handle_transformed_msg)
-            )
+            await self.pipeline.put("mqtt_transform", topic, message)
         except Exception as e:
             logging.error(f"Error handling MQTT message: {e}")
 
-    async def initialize_routines(self):
+    async def transform_ws_msg(self, envelope):
+        # Transformers call back synchronously; collect, then hand off with backpressure
+        transformed = []
+
+        def handle_transformed_msg(msg, topic):
+            transformed.append((topic, msg))
+
+        await self.websocket_transformer.transform(envelope, handle_transformed_msg)
+        for topic, msg in transformed:
+            await self.pipeline.put("mqtt_publish", topic, msg)
+
+    async def transform_mqtt_msg(self, topic, message):
+        # The message handler gets the transformed envelope, like every other consumer.
+        # Vendor payloads (e.g. Shelly switch status) carry no action and were ignored
+        # when it got the raw message; translated to plug__status, they are written back.
+        transformed = []
+        await self.mqtt_transformer.transform(message, topic, transformed.append)
+        for envelope in transformed:
+            await self.pipeline.put("local_broadcast", envelope)
+            await self.pipeline.put("routine_manager", envelope)
+            await self.pipeline.put("django_ws", envelope)
+            await self.pipeline.put("message_handler", envelope)
+
+    async def initialize_routines(self, refresh=False):
+        """Fetches routines and actions and registers them as a diff; `refresh` bypasses the cache."""
+        if refresh:
+            fetch = self.resource_handler.fetch_online
+        else:
+            fetch = self.resource_handler.fetch
         try:
-            routines = await self.resource_handler.fetch("routines")
+            routines = await fetch("routines")
             transformed_routines = transform_index_response(routines)
-            actions = await self.resource_handler.fetch("actions")
+            actions = await fetch("actions")
             transformed_actions = transform_index_response(actions)
             await self.routine_manager.register_routines(
                 transformed_routines, transformed_actions
@@ -224,49 +528,45 @@ class Controller:
         except Exception as e:
             logging.error(f"Error initializing routines: {e}")
 
+    async def sync_routines(self):
+        """
+        Re-fetches routines and actions while online. Django does not broadcast edits, so
+        this is how changes made there reach the controller; the diff in register_routines
+        re-registers only the routines that actually changed.
+        """
+        while True:
+            await asyncio.sleep(ROUTINE_SYNC_INTERVAL_S)
+            if self.get_is_online():
+                await self.initialize_routines(refresh=True)
+
     async def check_server_availability(self):
         logging.info("Checking remote server availability")
 
         try:
-            async with ClientSession() as session:
-                async with session.get(HEALTH_CHECK_URL) as resp:
-                    self.online = resp.status == 200
-                    logging.info(f"Server online status: {self.online}")
+            async with self.session.get(
+                HEALTH_CHECK_URL, timeout=ClientTimeout(total=LIVENESS_PROBE_TIMEOUT_S)
+            ) as resp:
+                online = resp.status == 200
+                logging.info(f"Server online status: {online}")
+                return online
         except Exception as e:
             logging.error(f"Server check failed: {e}")
-            self.online = False
-        return self.online
+            return False
 
-    async def continuously_check_server_availability(self):
-        """Background task to check if the Django server is reachable."""
-        while True:
-            prev_online_status = self.online
-            await self.check_server_availability()
-
-            # offline -> online
-            if not prev_online_status and self.online:
-                try:
-                    await self.handle_back_online()
-                except Exception as e:
-                    logging.error(f"Error when handling reconnection: {e}")
-
-            # online -> offline
-            if prev_online_status and not self.online:
-                try:
-                    await self.handle_back_offline()
-                except Exception as e:
-                    logging.error(f"Error when handling disconnection: {e}")
-
-            # Wait for the next check interval
-            await asyncio.sleep(
-                HEALTH_CHECK_INTERVAL_S
-            )  # Check every HEALTH_CHECK_INTERVAL_S seconds
+    async def handle_liveness_change(self, online):
+        if online:
+            await self.handle_back_online()
+        else:
+            await self.handle_back_offline()
 
     async def handle_back_online(self):
         logging.info("Back online!")
         try:
             self.token = await self.auth.get_token()
+            # Push writes made while offline before pulling fresh state
+            await self.resource_handler.replay_outbox()
             await self.initialize_routines()
+            await self.device_resolver.warm()
         except Exception as e:
             logging.error(f"Error handling back online: {e}")
 
@@ -281,14 +581,31 @@ class Controller:
 
     async def handle_offline_startup(self):
         logging.info("Handling offline startup")
-        # Nothing to do here for now
+        # Resolve devices from the local cache until the server is reachable
+        await self.device_resolver.warm()
+        # Routines were restored from the local snapshot in start(); they run as usual
+        # and are reconciled with the server by initialize_routines once back online
+        if self.routine_manager.routines:
+            logging.info(
+                f"Running {len(self.routine_manager.routines)} routines from the local snapshot"
+            )
+        else:
+            logging.warning(
+                "No local routine snapshot; routines will run once the server is reachable"
+            )
 
     async def start(self):
-        # Perform a one-time initial check for server availability to set self.online
-        await self.check_server_availability()
+        # Restore the routine schedule from local storage before touching the network
+        try:
+            self.routine_manager.restore()
+        except Exception as e:
+            logging.error(f"Error restoring routine snapshot: {e}")
+
+        # Perform a one-time initial check for server availability to set the online state
+        self.liveness.online = await self.check_server_availability()
 
         # Attempt to authenticate only if online
-        if self.online:
+        if self.liveness.online:
             try:
                 await self.handle_online_startup()
             except Exception as e:
@@ -298,17 +615,44 @@ class Controller:
             await self.handle_offline_startup()
 
         # Start tasks, some of which depend on the server
+        self.mqtt_topics = self.get_mqtt_subscriptions()
         await asyncio.gather(
             self.local_server.start(),
-            self.mqtt_client.subscribe("#"),
+            self.mqtt_client.subscribe(*self.mqtt_topics),
             self.websocket_client.connect(),
-            self.continuously_check_server_availability(),  # Start ongoing availability check
+            self.liveness.run(),  # Ongoing, signal-driven availability check
+            self.cache.run_flusher(),  # Persist cache changes in the background
+            self.pipeline.run(),  # Per-sink queues and workers
+            self.resource_handler.run_outbox_drain(),  # Writes diverted while online
+            self.routine_manager.run(),  # Routine timers and snapshot flusher
+            self.sync_routines(),  # Pick up routine edits made in Django
+            self.loop_lag_monitor.run(),  # Event-loop lag for /metrics
         )
 
+    async def stop(self):
+        logging.info("Stopping controller")
+        try:
+            await self.write_coalescer.flush_all()
+        except Exception as e:
+            logging.error(f"Error flushing pending writes on shutdown: {e}")
+        try:
+            self.cache.flush()
+        except Exception as e:
+            logging.error(f"Error flushing cache on shutdown: {e}")
+        try:
+            self.routine_manager.snapshot.flush()
+        except Exception as e:
+            logging.error(f"Error saving routine snapshot on shutdown: {e}")
+        self.outbox.close()
+        await self.session.close()
+
 
 async def main():
     controller = Controller()
-    await controller.start()
+    try:
+        await controller.start()
+    finally:
+        await controller.stop()
 
 
 if __name__ == "__main__":
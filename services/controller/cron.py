@@ -0,0 +1,111 @@
+import bisect
+import datetime
+import re
+from zoneinfo import ZoneInfo
+
+"""
+Next-fire computation for structured cron triggers, as produced by the Django side
+(`routines/triggers.py`):
+
+{
+    "type": "cron",
+    "second": int,
+    "minute": [int], "hour": [int], "day": [int], "month": [int],
+    "weekday": [int],  // Python numbering, Monday is 0
+    "day_restricted": bool, "weekday_restricted": bool,
+    "tz": string or null  // IANA name; null means the controller's local time
+}
+"""
+
+DURATION_PATTERN = re.compile(
+    r"^(?:(?P<days>-?\d+) )?(?P<hours>\d+):(?P<minutes>\d\d):(?P<seconds>\d\d(?:\.\d+)?)$"
+)
+
+
+def parse_duration(value):
+    """Parses a serialized DurationField (`[D ]HH:MM:SS[.ffffff]`) into a timedelta."""
+    match = DURATION_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration '{value}'")
+    return datetime.timedelta(
+        days=int(match.group("days") or 0),
+        hours=int(match.group("hours")),
+        minutes=int(match.group("minutes")),
+        seconds=float(match.group("seconds")),
+    )
+
+
+def skip_missed(trigger_time, interval, now):
+    """The first `trigger_time + n * interval` (n >= 1) after `now`, computed directly."""
+    trigger_time += interval
+    if trigger_time <= now:
+        trigger_time += interval * ((now - trigger_time) // interval + 1)
+    return trigger_time
+
+
+def day_matches(spec, date):
+    day_ok = date.day in spec["day"]
+    weekday_ok = date.weekday() in spec["weekday"]
+    # As in cron: with both restricted either may match, otherwise the restricted one must
+    if spec["day_restricted"] and spec["weekday_restricted"]:
+        return day_ok or weekday_ok
+    return day_ok and weekday_ok
+
+
+def next_time_of_day(spec, start):
+    """First (hour, minute) at or after `start` (a time), or None if none is left today."""
+    hours, minutes, second = spec["hour"], spec["minute"], spec["second"]
+    index = bisect.bisect_left(hours, start.hour)
+    if index < len(hours) and hours[index] == start.hour:
+        minute_index = bisect.bisect_left(minutes, start.minute)
+        if minute_index < len(minutes):
+            minute = minutes[minute_index]
+            if minute > start.minute or second >= start.second:
+                return start.hour, minute
+            if minute_index + 1 < len(minutes):
+                return start.hour, minutes[minute_index + 1]
+        index += 1
+    if index < len(hours):
+        return hours[index], minutes[0]
+    return None
+
+
+def next_cron_fire(spec, after):
+    """
+    Next fire time strictly after `after`. Missed fires are jumped over directly: the search
+    steps through at most one month per allowed month and one day per day of that month,
+    so the cost does not depend on how far in the past `after`'s previous fire was.
+    Returns an aware datetime in the spec's zone, or a naive local datetime without one.
+    """
+    zone = ZoneInfo(spec["tz"]) if spec.get("tz") else None
+    if after.tzinfo is not None:
+        after = after.astimezone(zone).replace(tzinfo=None)
+    elif zone is not None:
+        after = after.astimezone().astimezone(zone).replace(tzinfo=None)
+
+    start = after.replace(microsecond=0) + datetime.timedelta(seconds=1)
+    date, start_time = start.date(), start.time()
+    months = spec["month"]
+    # Bounded so an impossible spec (e.g. 30 February) cannot loop forever
+    for _ in range(366 * 8):
+        if date.month not in months:
+            index = bisect.bisect_right(months, date.month)
+            year = date.year if index < len(months) else date.year + 1
+            date = datetime.date(year, months[index % len(months)], 1)
+            start_time = datetime.time()
+            continue
+        if not day_matches(spec, date):
+            date += datetime.timedelta(days=1)
+            start_time = datetime.time()
+            continue
+        time_of_day = next_time_of_day(spec, start_time)
+        if time_of_day is None:
+            date += datetime.timedelta(days=1)
+            start_time = datetime.time()
+            continue
+        hour, minute = time_of_day
+        fire = datetime.datetime.combine(
+            date, datetime.time(hour, minute, spec["second"])
+        )
+        return fire.replace(tzinfo=zone) if zone else fire
+    raise ValueError(f"Cron trigger never fires: {spec}")
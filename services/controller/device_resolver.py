@@ -0,0 +1,135 @@
+import logging
+import os
+import time
+
+DEVICE_RESOLVER_TTL_S = float(os.getenv("DEVICE_RESOLVER_TTL_S", 300))
+DEVICE_RESOLVER_NEGATIVE_TTL_S = float(os.getenv("DEVICE_RESOLVER_NEGATIVE_TTL_S", 60))
+
+# Capability children of a device, as named on the device resource
+CAPABILITIES = ("plug", "light", "environmental", "system", "dial")
+
+# Child resource type -> capability on the parent device
+CAPABILITY_RESOURCE_TYPES = {
+    "plugs": "plug",
+    "lights": "light",
+    "environmentals": "environmental",
+    "systems": "system",
+}
+
+
+class DeviceResolver:
+    """
+    In-memory map of device UUID -> capability child UUIDs (plug, light, environmental, ...).
+
+    Warmed from the device listing at startup and kept current from resource change events,
+    so message handlers can resolve the child to write to without a GET per message. Devices
+    that could not be resolved are negatively cached for DEVICE_RESOLVER_NEGATIVE_TTL_S.
+    Known devices are reloaded after DEVICE_RESOLVER_TTL_S, so changes and deletions made
+    directly on the server are picked up too.
+    """
+
+    def __init__(
+        self,
+        resource_handler,
+        ttl_s=DEVICE_RESOLVER_TTL_S,
+        negative_ttl_s=DEVICE_RESOLVER_NEGATIVE_TTL_S,
+    ):
+        self.resource_handler = resource_handler
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self.devices = {}  # device UUID -> {capability: child UUID}
+        self.expires_at = {}  # device UUID -> time after which it is reloaded
+        self.locations = {}  # device UUID -> location UUID
+        self.unknown = {}  # device UUID -> time after which lookup is retried
+        resource_handler.add_change_listener(self.handle_resource_change)
+
+    def learn(self, device):
+        """Records the capability children present on a device resource."""
+        device_id = device.get("uuid")
+        if not device_id:
+            return
+        self.devices[device_id] = {
+            capability: device[capability]
+            for capability in CAPABILITIES
+            if device.get(capability)
+        }
+        self.expires_at[device_id] = time.monotonic() + self.ttl_s
+        if device.get("location"):
+            self.locations[device_id] = device["location"]
+        self.unknown.pop(device_id, None)
+
+    def invalidate(self, device_id=None):
+        if device_id:
+            self.devices.pop(device_id, None)
+            self.expires_at.pop(device_id, None)
+            self.locations.pop(device_id, None)
+            self.unknown.pop(device_id, None)
+        else:
+            self.devices.clear()
+            self.expires_at.clear()
+            self.locations.clear()
+            self.unknown.clear()
+
+    def get_location(self, device_id):
+        """Location UUID of a known device, or None; never fetches."""
+        return self.locations.get(device_id)
+
+    async def warm(self):
+        """Loads the full device inventory; falls back to the local cache while offline."""
+        try:
+            devices = await self.resource_handler.fetch("devices")
+            for device in devices or []:
+                self.learn(device)
+            logging.info(f"Device resolver warmed with {len(self.devices)} devices")
+        except Exception as e:
+            logging.error(f"Error warming device resolver: {e}")
+
+    async def resolve(self, device_id, capability):
+        """Returns the UUID of the device's `capability` child, or None."""
+        if not device_id:
+            return None
+
+        children = self.devices.get(device_id)
+        if children is not None and self.expires_at[device_id] <= time.monotonic():
+            children = await self.load(device_id)
+        elif children is None:
+            retry_at = self.unknown.get(device_id)
+            if retry_at and retry_at > time.monotonic():
+                return None
+            children = await self.load(device_id)
+        return children.get(capability) if children is not None else None
+
+    async def load(self, device_id):
+        device = await self.resource_handler.fetch("devices", device_id)
+        if device and isinstance(device, dict):
+            self.learn(device)
+            return self.devices.get(device_id)
+        logging.error(f"Failed to retrieve device resource for {device_id}")
+        # Gone (or unreachable with nothing cached): forget it, then back off
+        self.invalidate(device_id)
+        self.unknown[device_id] = time.monotonic() + self.negative_ttl_s
+        return None
+
+    def handle_resource_change(self, method, resource_type, resource_id, resource):
+        """Keeps the map in sync with device and capability child create/update/delete."""
+        if resource_type == "devices":
+            if method == "DELETE" or not isinstance(resource, dict):
+                self.invalidate(resource_id)
+            elif resource.get("uuid"):
+                self.learn(resource)
+            else:
+                self.invalidate(resource_id)
+        elif resource_type in CAPABILITY_RESOURCE_TYPES:
+            capability = CAPABILITY_RESOURCE_TYPES[resource_type]
+            if method == "DELETE":
+                for children in self.devices.values():
+                    if children.get(capability) == resource_id:
+                        del children[capability]
+            elif isinstance(resource, dict) and resource.get("device"):
+                device_id = resource["device"]
+                child_id = resource.get("uuid") or resource_id
+                if device_id in self.devices and child_id:
+                    self.devices[device_id][capability] = child_id
+                else:
+                    # Let the next lookup load the device with its new child
+                    self.unknown.pop(device_id, None)
@@ -0,0 +1,75 @@
+import json
+
+
+class Envelope:
+    """
+    Immutable wrapper around one message flowing through the controller.
+
+    Holds the parsed dict and the raw JSON text, so every consumer of a fanned-out message
+    shares a single `json.loads`, and encodes lazily (at most once per output format).
+    `data` is None if the raw text was not valid JSON. Treat `data` as read-only.
+    """
+
+    __slots__ = ("_data", "_text", "_bytes", "_valid")
+
+    def __init__(self, data=None, text=None, valid=True):
+        object.__setattr__(self, "_data", data)
+        object.__setattr__(self, "_text", text)
+        object.__setattr__(self, "_bytes", None)
+        object.__setattr__(self, "_valid", valid)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Envelope is immutable")
+
+    @classmethod
+    def from_text(cls, text):
+        """Parses raw JSON text once."""
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode("utf-8")
+        try:
+            return cls(json.loads(text), text)
+        except (TypeError, ValueError):
+            return cls(None, text, valid=False)
+
+    @classmethod
+    def from_data(cls, data):
+        """Wraps an already-built message; the text is only produced if someone needs it."""
+        return cls(data)
+
+    @classmethod
+    def wrap(cls, message):
+        """Accepts an Envelope, raw JSON text or a dict."""
+        if isinstance(message, cls):
+            return message
+        if isinstance(message, (str, bytes, bytearray)):
+            return cls.from_text(message)
+        return cls.from_data(message)
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def valid(self):
+        return self._valid
+
+    @property
+    def text(self):
+        if self._text is None:
+            object.__setattr__(self, "_text", json.dumps(self._data))
+        return self._text
+
+    @property
+    def bytes(self):
+        if self._bytes is None:
+            object.__setattr__(self, "_bytes", self.text.encode("utf-8"))
+        return self._bytes
+
+    def get(self, key, default=None):
+        """Top-level field of the message, if it is a JSON object."""
+        if isinstance(self._data, dict):
+            return self._data.get(key, default)
+        return default
+
+    def __repr__(self):
+        return f"Envelope({self.text})"
@@ -0,0 +1,154 @@
+import json
+from urllib.parse import parse_qsl
+
+"""
+Event trigger syntax (one entry of a routine's comma-separated `triggers`):
+
+    <action>[?<filter>&<filter>...]
+
+Filters:
+    src=<device UUID>       message `src` equals the value
+    dest=<prefix>           message `dest` starts with the prefix
+    body.<path>=<value>     field of `body` (dotted path) equals the value; values are
+                            parsed as JSON where possible (`true`, `3`, `"on"`), else strings
+
+e.g. `plug__status?src=6f1c...&body.output=true`
+"""
+
+FILTER_SRC = "src"
+FILTER_DEST = "dest"
+BODY_PREFIX = "body."
+
+MISSING = object()
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def get_path(data, path):
+    for part in path:
+        if not isinstance(data, dict) or part not in data:
+            return MISSING
+        data = data[part]
+    return data
+
+
+class EventTrigger:
+    __slots__ = ("action", "src", "dest_prefix", "body")
+
+    def __init__(self, action, src=None, dest_prefix="", body=()):
+        self.action = action
+        self.src = src
+        self.dest_prefix = dest_prefix
+        self.body = tuple(body)  # ((path tuple, value), ...)
+
+    @classmethod
+    def parse(cls, trigger):
+        action, _, query = trigger.strip().partition("?")
+        if not action:
+            raise ValueError(f"Event trigger without an action: {trigger}")
+        src, dest_prefix, body = None, "", []
+        filters = parse_qsl(query, keep_blank_values=True, strict_parsing=bool(query))
+        for name, value in filters:
+            if name == FILTER_SRC:
+                src = value
+            elif name == FILTER_DEST:
+                dest_prefix = value
+            elif name.startswith(BODY_PREFIX) and len(name) > len(BODY_PREFIX):
+                path = tuple(name[len(BODY_PREFIX) :].split("."))
+                body.append((path, parse_value(value)))
+            else:
+                raise ValueError(f"Unknown event trigger filter '{name}': {trigger}")
+        return cls(action, src, dest_prefix, body)
+
+    def matches_body(self, message):
+        if not self.body:
+            return True
+        body = message.get("body")
+        return all(get_path(body, path) == value for path, value in self.body)
+
+
+class SourceNode:
+    """Triggers for one (action, src) pair, bucketed by `dest` prefix."""
+
+    __slots__ = ("by_prefix", "prefix_lengths")
+
+    def __init__(self):
+        self.by_prefix = {}  # dest prefix -> {key: (routine UUID, trigger)}
+        self.prefix_lengths = {}  # prefix length -> number of prefixes with that length
+
+
+class EventTriggerIndex:
+    """
+    Multi-level index of event triggers: action -> src (or any) -> dest prefix, with body
+    field equality checked last, only for triggers that survived the first three levels.
+    """
+
+    def __init__(self):
+        self.actions = {}  # action -> {src or None: SourceNode}
+        self.triggers = {}  # key -> EventTrigger
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def add(self, key, routine_id, trigger):
+        self.remove(key)
+        self.triggers[key] = trigger
+        node = self.actions.setdefault(trigger.action, {}).setdefault(
+            trigger.src, SourceNode()
+        )
+        entries = node.by_prefix.get(trigger.dest_prefix)
+        if entries is None:
+            entries = node.by_prefix[trigger.dest_prefix] = {}
+            length = len(trigger.dest_prefix)
+            node.prefix_lengths[length] = node.prefix_lengths.get(length, 0) + 1
+        entries[key] = (routine_id, trigger)
+
+    def remove(self, key):
+        trigger = self.triggers.pop(key, None)
+        if trigger is None:
+            return
+        sources = self.actions[trigger.action]
+        node = sources[trigger.src]
+        entries = node.by_prefix[trigger.dest_prefix]
+        del entries[key]
+        if entries:
+            return
+        del node.by_prefix[trigger.dest_prefix]
+        length = len(trigger.dest_prefix)
+        node.prefix_lengths[length] -= 1
+        if not node.prefix_lengths[length]:
+            del node.prefix_lengths[length]
+        if not node.by_prefix:
+            del sources[trigger.src]
+            if not sources:
+                del self.actions[trigger.action]
+
+    def has_action(self, action):
+        return action in self.actions
+
+    def match(self, message):
+        """Returns the UUIDs of routines with at least one trigger matching the message."""
+        sources = self.actions.get(message.get("action"))
+        if not sources:
+            return []
+
+        src = message.get("src")
+        dest = message.get("dest")
+        dest = dest if isinstance(dest, str) else ""
+        matched = {}  # routine UUID -> None, keeping registration order
+        for node in (sources.get(src) if src is not None else None, sources.get(None)):
+            if node is None:
+                continue
+            for length in node.prefix_lengths:
+                if length > len(dest):
+                    continue
+                entries = node.by_prefix.get(dest[:length], {})
+                for routine_id, trigger in entries.values():
+                    if routine_id not in matched and trigger.matches_body(message):
+                        matched[routine_id] = None
+        return list(matched)
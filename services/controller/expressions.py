@@ -0,0 +1,229 @@
+import ast
+import datetime
+import logging
+import os
+import types
+
+EXPRESSION_MAX_LENGTH = int(os.getenv("EXPRESSION_MAX_LENGTH", 2000))
+
+# Functions callable by name from an expression
+SAFE_BUILTINS = {
+    "abs": abs,
+    "all": all,
+    "any": any,
+    "bool": bool,
+    "dict": dict,
+    "float": float,
+    "int": int,
+    "len": len,
+    "list": list,
+    "max": max,
+    "min": min,
+    "round": round,
+    "sorted": sorted,
+    "str": str,
+    "sum": sum,
+    "True": True,
+    "False": False,
+    "None": None,
+}
+
+# Kept for expressions written against the old eval() (e.g. `datetime.datetime.now()`);
+# a namespace rather than the module itself, which would expose `datetime.sys`
+SAFE_MODULES = {
+    "datetime": types.SimpleNamespace(
+        date=datetime.date,
+        datetime=datetime.datetime,
+        time=datetime.time,
+        timedelta=datetime.timedelta,
+        timezone=datetime.timezone,
+    )
+}
+
+ALLOWED_NODES = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.BinOp,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.UAdd,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.In,
+    ast.NotIn,
+    ast.Is,
+    ast.IsNot,
+    ast.IfExp,
+    ast.Dict,
+    ast.List,
+    ast.Tuple,
+    ast.Set,
+    ast.Constant,
+    ast.Name,
+    ast.Load,
+    ast.Subscript,
+    ast.Slice,
+    ast.Attribute,
+    ast.Call,
+    ast.keyword,
+    ast.JoinedStr,
+    ast.FormattedValue,
+)
+
+# Attribute calls that can reach arbitrary attributes through a format string
+BLOCKED_ATTRIBUTES = {"format", "format_map", "mro"}
+
+# Largest constant exponent allowed, so `9 ** 9 ** 9` cannot stall the event loop
+MAX_EXPONENT = 100
+
+# Largest sequence `*` may build, nested items included, so `[0] * 10 ** 9` cannot
+# exhaust memory
+MAX_REPEAT_LENGTH = 10000
+
+# Name `*` is rewritten to; user names cannot start with an underscore
+SAFE_MULT = "__mult__"
+
+
+class UnsafeExpressionError(ValueError):
+    pass
+
+
+class Validator(ast.NodeVisitor):
+    def __init__(self, names):
+        self.names = names
+
+    def generic_visit(self, node):
+        if not isinstance(node, ALLOWED_NODES):
+            raise UnsafeExpressionError(f"'{type(node).__name__}' is not allowed")
+        super().generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id.startswith("_") or node.id not in self.names:
+            raise UnsafeExpressionError(f"Unknown name '{node.id}'")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if node.attr.startswith("_") or node.attr in BLOCKED_ATTRIBUTES:
+            raise UnsafeExpressionError(f"Attribute '{node.attr}' is not allowed")
+        self.generic_visit(node)
+
+    def visit_BinOp(self, node):
+        if isinstance(node.op, ast.Pow) and not (
+            isinstance(node.right, ast.Constant)
+            and isinstance(node.right.value, (int, float))
+            and abs(node.right.value) <= MAX_EXPONENT
+        ):
+            raise UnsafeExpressionError("Only small constant exponents are allowed")
+        self.generic_visit(node)
+
+
+def sequence_size(value):
+    """Items in a possibly nested sequence, counting strings by length."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return len(value) + sum(sequence_size(item) for item in value)
+    return 0
+
+
+def safe_mult(left, right):
+    """`left * right`, refusing to repeat a sequence past MAX_REPEAT_LENGTH items."""
+    for sequence, count in ((left, right), (right, left)):
+        if (
+            isinstance(sequence, (str, bytes, list, tuple))
+            and isinstance(count, int)
+            and sequence_size(sequence) * count > MAX_REPEAT_LENGTH
+        ):
+            raise UnsafeExpressionError(
+                f"Sequence repeat longer than {MAX_REPEAT_LENGTH} items"
+            )
+    return left * right
+
+
+class MultRewriter(ast.NodeTransformer):
+    """Routes `*` through safe_mult, since operand types are only known when evaluated."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Mult):
+            return node
+        call = ast.Call(
+            func=ast.Name(id=SAFE_MULT, ctx=ast.Load()),
+            args=[node.left, node.right],
+            keywords=[],
+        )
+        return ast.copy_location(call, node)
+
+
+class ExpressionEngine:
+    """
+    Compiles routine expressions (`eval_condition`, `eval_params`) once and evaluates them
+    in a restricted namespace.
+
+    Expressions are single Python expressions over a whitelisted subset of the grammar:
+    no lambdas, comprehensions, assignments, imports or underscore names/attributes, and
+    only SAFE_BUILTINS, SAFE_MODULES and the per-call variables (`variables`) are visible.
+    Compiled code is cached by owner UUID and recompiled only when the source changes.
+    """
+
+    def __init__(self, variables=("message", "routine", "state", "now")):
+        self.names = set(SAFE_BUILTINS) | set(SAFE_MODULES) | set(variables)
+        self.compiled = {}  # owner UUID -> (source, code)
+
+    def compile(self, source):
+        """Parses, validates and compiles one expression; raises UnsafeExpressionError or SyntaxError."""
+        if len(source) > EXPRESSION_MAX_LENGTH:
+            raise UnsafeExpressionError(
+                f"Expression longer than {EXPRESSION_MAX_LENGTH} characters"
+            )
+        tree = ast.parse(source.strip(), mode="eval")
+        Validator(self.names).visit(tree)
+        tree = ast.fix_missing_locations(MultRewriter().visit(tree))
+        return compile(tree, "<expression>", "eval")
+
+    def register(self, owner_id, source):
+        """Compiles and caches the expression for `owner_id`; returns False if it was rejected."""
+        cached = self.compiled.get(owner_id)
+        if cached and cached[0] == source:
+            return True
+        try:
+            self.compiled[owner_id] = (source, self.compile(source))
+            return True
+        except (SyntaxError, UnsafeExpressionError) as e:
+            logging.error(f"Rejected expression for {owner_id}: {source!r}; error: {e}")
+            self.compiled.pop(owner_id, None)
+            return False
+
+    def unregister(self, owner_id):
+        self.compiled.pop(owner_id, None)
+
+    def is_registered(self, owner_id):
+        return owner_id in self.compiled
+
+    def evaluate(self, owner_id, **variables):
+        """Evaluates the cached expression; raises KeyError if it was never (validly) registered."""
+        _, code = self.compiled[owner_id]
+        namespace = {
+            "__builtins__": SAFE_BUILTINS,
+            SAFE_MULT: safe_mult,
+            **SAFE_MODULES,
+            **variables,
+        }
+        return eval(code, namespace)
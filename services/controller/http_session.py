@@ -0,0 +1,24 @@
+import os
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_DNS_CACHE_TTL_S = int(os.getenv("HTTP_DNS_CACHE_TTL_S", 300))
+HTTP_KEEPALIVE_TIMEOUT_S = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT_S", 30))
+HTTP_TIMEOUT_S = float(os.getenv("HTTP_TIMEOUT_S", 10))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", 3))
+
+
+def create_session():
+    """
+    Creates the controller's long-lived, connection-pooled HTTP session.
+    Must be called from within a running event loop; close it on shutdown.
+    """
+    connector = TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL_S,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT_S,
+    )
+    timeout = ClientTimeout(total=HTTP_TIMEOUT_S, connect=HTTP_CONNECT_TIMEOUT_S)
+    return ClientSession(connector=connector, timeout=timeout)
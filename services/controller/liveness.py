@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+
+# Probe cadence: fast while the state is in doubt, backing off to the max once it is settled
+LIVENESS_PROBE_MIN_INTERVAL_S = float(os.getenv("LIVENESS_PROBE_MIN_INTERVAL_S", 0.25))
+LIVENESS_PROBE_MAX_INTERVAL_S = float(os.getenv("LIVENESS_PROBE_MAX_INTERVAL_S", 30))
+LIVENESS_PROBE_TIMEOUT_S = float(os.getenv("LIVENESS_PROBE_TIMEOUT_S", 1))
+# Consecutive failed requests that make the monitor doubt it is online
+LIVENESS_FAILURE_THRESHOLD = int(os.getenv("LIVENESS_FAILURE_THRESHOLD", 2))
+
+
+class LivenessMonitor:
+    """
+    Tracks whether the Django server is reachable from several signals instead of a slow poll.
+
+    Real request outcomes and WebSocket connection changes are reported as they happen; a
+    signal that contradicts the current state wakes an active probe immediately, and the
+    probe backs off exponentially while its answers agree with the state. Transitions
+    call `on_change(online)` one at a time, in order.
+    """
+
+    def __init__(
+        self,
+        probe,
+        on_change,
+        min_interval_s=LIVENESS_PROBE_MIN_INTERVAL_S,
+        max_interval_s=LIVENESS_PROBE_MAX_INTERVAL_S,
+        failure_threshold=LIVENESS_FAILURE_THRESHOLD,
+    ):
+        self.probe = probe  # async () -> bool
+        self.on_change = on_change  # async (online) -> None
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.failure_threshold = failure_threshold
+        self.online = False
+        self.failures = 0  # Consecutive failures reported since the last success
+        self.interval_s = min_interval_s
+        self.wake = asyncio.Event()
+        self.transition_lock = asyncio.Lock()
+        self.transitions = set()
+        self.stats = {"probes": 0, "transitions": 0, "suspicions": 0}
+
+    def report_success(self, source):
+        self.failures = 0
+        if not self.online:
+            logging.info(f"Liveness: success from {source} while offline")
+            self.suspect()
+
+    def report_failure(self, source):
+        self.failures += 1
+        if self.online and self.failures >= self.failure_threshold:
+            logging.warning(f"Liveness: {self.failures} failures, latest from {source}")
+            self.suspect()
+
+    def report_connection(self, source, connected):
+        """Connection state changes (e.g. the Django WebSocket) are strong signals."""
+        if connected:
+            self.report_success(source)
+        elif self.online:
+            logging.warning(f"Liveness: {source} disconnected")
+            self.suspect()
+
+    def suspect(self):
+        """Probes right away and keeps probing quickly until the state settles."""
+        self.stats["suspicions"] += 1
+        self.interval_s = self.min_interval_s
+        self.wake.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+            self.stats["probes"] += 1
+            try:
+                online = await self.probe()
+            except Exception as e:
+                logging.error(f"Liveness probe failed: {e}")
+                online = False
+
+            if online != self.online:
+                self.set_online(online)
+                self.interval_s = self.min_interval_s
+            else:
+                self.interval_s = min(self.max_interval_s, self.interval_s * 2)
+
+    def set_online(self, online):
+        """Flips the flag immediately; the transition handler runs in the background."""
+        logging.info(f"Liveness: server is {'online' if online else 'offline'}")
+        self.online = online
+        self.failures = 0
+        self.stats["transitions"] += 1
+        task = asyncio.create_task(self.run_transition(online))
+        self.transitions.add(task)
+        task.add_done_callback(self.transitions.discard)
+
+    async def run_transition(self, online):
+        async with self.transition_lock:
+            # A later transition may have superseded this one while it waited
+            if online != self.online:
+                return
+            try:
+                await self.on_change(online)
+            except Exception as e:
+                logging.error(f"Error handling liveness transition: {e}")
@@ -1,21 +1,137 @@
 # local_server.py
 
+import asyncio
 import logging
+from collections import deque
 from aiohttp import web, WSCloseCode
 from aiohttp_cors import setup, ResourceOptions
 import os
 import ssl
+import time
+from envelope import Envelope
+from metrics import REGISTRY, CONTENT_TYPE, MESSAGES_OUT, SLOW_CLIENT_DISCONNECTS
+from subscriptions import SubscriptionIndex, parse_filters
 
 LOCAL_SERVER_PORT = os.getenv("LOCAL_SERVER_PORT")
 SSL_ENABLED = os.getenv("SSL_ENABLED")
 
+# Per-client outbound queue bound and the lag after which a client is disconnected
+LOCAL_WS_CLIENT_QUEUE_SIZE = int(os.getenv("LOCAL_WS_CLIENT_QUEUE_SIZE", 256))
+LOCAL_WS_MAX_LAG_S = float(os.getenv("LOCAL_WS_MAX_LAG_S", 5))
+
+# Control frames a client sends to filter what it receives; they are not forwarded
+ACTION_SUBSCRIBE = "subscribe"
+ACTION_UNSUBSCRIBE = "unsubscribe"
+
+
+class ClientConnection:
+    """
+    A connected WebSocket with its own bounded outbound queue and writer task, so a slow
+    client only delays itself. Clients that fall too far behind are disconnected.
+    """
+
+    def __init__(self, ws, remote):
+        self.ws = ws
+        self.remote = remote
+        self.queue = deque()  # (message, enqueued at)
+        self.has_items = asyncio.Event()
+        self.closing = False
+        self.writer = None
+        self.closer = None  # Task closing a slow client, awaited in `stop`
+        self.stats = {"sent": 0, "errors": 0, "lag_s": 0.0, "max_lag_s": 0.0}
+
+    def start(self):
+        self.writer = asyncio.create_task(self.write())
+
+    async def stop(self):
+        if self.writer:
+            self.writer.cancel()
+        if self.closer:
+            await self.closer
+
+    def get_lag(self):
+        """Age of the oldest message still waiting to be sent."""
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - self.queue[0][1]
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "remote": self.remote,
+            "depth": len(self.queue),
+            "lag_s": self.get_lag(),
+        }
+
+    def enqueue(self, message):
+        if self.closing:
+            return
+        if len(self.queue) >= LOCAL_WS_CLIENT_QUEUE_SIZE:
+            self.disconnect_slow(
+                "queue_full", f"outbound queue full ({len(self.queue)} messages)"
+            )
+            return
+        self.queue.append((message, time.monotonic()))
+        self.has_items.set()
+
+    def disconnect_slow(self, cause, reason):
+        if self.closing:
+            return
+        SLOW_CLIENT_DISCONNECTS.inc(cause)
+        self.closing = True
+        self.queue.clear()
+        logging.warning(f"Disconnecting slow WebSocket client {self.remote}: {reason}")
+        # Not from the writer, which may be stuck in a send to this very client
+        self.closer = asyncio.create_task(self.close_slow())
+
+    async def close_slow(self):
+        try:
+            await self.ws.close(
+                code=WSCloseCode.TRY_AGAIN_LATER, message=b"Client too slow"
+            )
+        except Exception as e:
+            logging.error(f"Error closing slow WebSocket client {self.remote}: {e}")
+
+    async def write(self):
+        while not self.closing:
+            while not self.queue:
+                self.has_items.clear()
+                await self.has_items.wait()
+
+            message, enqueued_at = self.queue.popleft()
+            lag = time.monotonic() - enqueued_at
+            self.stats["lag_s"] = lag
+            self.stats["max_lag_s"] = max(self.stats["max_lag_s"], lag)
+            if lag > LOCAL_WS_MAX_LAG_S:
+                self.disconnect_slow("lag", f"lagging {lag:.1f}s behind")
+                return
+
+            try:
+                await self.ws.send_str(message)
+                self.stats["sent"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(
+                    f"Error sending message to client; message: {message}; client: {self.remote}; error: {e}"
+                )
+
 
 class LocalServer:
-    def __init__(self, handle_api_request, handle_ws_message, handle_auth_request):
+    def __init__(
+        self,
+        handle_api_request,
+        handle_ws_message,
+        handle_auth_request,
+        device_location_getter=None,
+        metrics_registry=REGISTRY,
+    ):
         self.handle_api_request = handle_api_request
         self.handle_ws_message = handle_ws_message
         self.handle_auth_request = handle_auth_request
-        self.clients = set()  # Keep track of WebSocket clients
+        self.clients = {}  # WebSocket -> ClientConnection
+        # Clients that sent a subscribe frame; everyone else receives every message
+        self.subscriptions = SubscriptionIndex(device_location_getter)
+        self.metrics_registry = metrics_registry  # Rendered on /metrics
 
     # HTTP and WebSocket setup and route handling
     def setup_routes(self, app):
@@ -28,6 +144,9 @@ class LocalServer:
         # Status
         app.router.add_get("/status/", self.status_handler)
 
+        # Prometheus scrape endpoint
+        app.router.add_get("/metrics", self.metrics_handler)
+
         # WebSocket route
         app.router.add_get("/ws/controllers", self.websocket_handler)
 
@@ -41,37 +160,77 @@ class LocalServer:
             text='{"status": "ok", "message": "Controller is up and running"}',
         )
 
+    async def metrics_handler(self, request):
+        return web.Response(
+            status=200,
+            body=self.metrics_registry.render().encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
     async def websocket_handler(self, request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
 
-        self.clients.add(ws)
+        client = ClientConnection(ws, request.remote)
+        client.start()
+        self.clients[ws] = client
         logging.info("New WebSocket client connected")
 
         try:
             async for message in ws:
                 if message.type == web.WSMsgType.TEXT:
-                    self.handle_ws_message(message.data)
-                    await self.broadcast_ws(message.data)
+                    envelope = Envelope.from_text(message.data)
+                    if await self.handle_control_frame(client, envelope):
+                        continue
+                    await self.handle_ws_message(envelope)
+                    await self.broadcast_ws(envelope)
                 elif message.type == web.WSMsgType.ERROR:
                     logging.error(
                         f"WebSocket connection closed with exception {ws.exception()}"
                     )
         finally:
-            self.clients.remove(ws)
+            self.clients.pop(ws, None)
+            self.subscriptions.unsubscribe(client)
+            await client.stop()
             await ws.close(code=WSCloseCode.GOING_AWAY)
             logging.info("WebSocket client disconnected")
 
         return ws
 
-    async def broadcast_ws(self, message):
-        for client in self.clients:
+    async def handle_control_frame(self, client, envelope):
+        """Applies subscribe/unsubscribe frames; returns True if the frame was one."""
+        action = envelope.get("action")
+        if action == ACTION_SUBSCRIBE:
             try:
-                await client.send_str(message)
-            except Exception as e:
-                logging.error(
-                    f"Error sending message to client; message: {message}; client: {client}; error: {e}"
+                self.subscriptions.subscribe(
+                    client, parse_filters(envelope.get("body"))
                 )
+                logging.info(f"WebSocket client {client.remote} subscribed")
+            except ValueError as e:
+                logging.warning(f"Invalid subscribe frame from {client.remote}: {e}")
+            return True
+        if action == ACTION_UNSUBSCRIBE:
+            self.subscriptions.unsubscribe(client)
+            logging.info(f"WebSocket client {client.remote} unsubscribed")
+            return True
+        return False
+
+    async def broadcast_ws(self, message):
+        """
+        Queues the message (JSON text or an Envelope) for every interested client at once;
+        each client's writer sends it at its own pace. Clients without a subscription
+        receive everything.
+        """
+        envelope = Envelope.wrap(message)
+        matched = self.subscriptions.match(envelope) if self.subscriptions else ()
+        for client in list(self.clients.values()):
+            if client in matched or client not in self.subscriptions:
+                client.enqueue(envelope.text)
+                MESSAGES_OUT.inc("local_ws")
+
+    def get_client_stats(self):
+        """Per-client queue depth, lag and send counters."""
+        return [client.get_stats() for client in self.clients.values()]
 
     async def start(self):
         app = web.Application()
@@ -1,7 +1,9 @@
 # message_handler.py
 
-import json
 import logging
+import time
+from envelope import Envelope
+from metrics import HANDLER_LATENCY
 
 
 """
@@ -44,8 +46,11 @@ def filter_none_values(data):
 class MessageHandler:
     handlers = {}
 
-    def __init__(self, resource_handler):
+    def __init__(self, resource_handler, device_resolver, write_coalescer):
         self.resource_handler = resource_handler
+        self.device_resolver = device_resolver
+        # Status writes are debounced per resource; commands (`*__set`) are sent immediately
+        self.write_coalescer = write_coalescer
 
     @classmethod
     def register(cls, action, func):
@@ -53,12 +58,15 @@ class MessageHandler:
         cls.handlers[action] = func
 
     async def handle(self, message):
-        """Attempts to parse the message and dispatch to the appropriate handler based on action."""
+        """Dispatches the message (an Envelope or raw JSON text) to the appropriate handler based on action."""
         try:
-            # Parse JSON data and extract action
-            data = json.loads(message)
+            envelope = Envelope.wrap(message)
+            if not envelope.valid:
+                logging.warning("Received an invalid JSON message; ignoring.")
+                return
 
             # Check if data is a dictionary with an "action" key
+            data = envelope.data
             if not isinstance(data, dict) or "action" not in data:
                 logging.warning("Received a message without an 'action'; ignoring.")
                 return
@@ -67,24 +75,17 @@ class MessageHandler:
             if action in self.handlers:
                 # Dispatch to the appropriate handler
                 handler = self.handlers[action]
-                await handler(self, data)
+                started = time.perf_counter()
+                try:
+                    await handler(self, data)
+                finally:
+                    HANDLER_LATENCY.observe(time.perf_counter() - started, action)
             else:
                 logging.warning(f"No handler found for action: {action}")
-        except json.JSONDecodeError:
-            logging.warning("Received an invalid JSON message; ignoring.")
         except Exception as e:
             logging.error(f"An error occurred while handling the message: {e}")
 
 
-async def get_device_resource(resource_handler, device_id):
-    """Fetches the full device resource, returning a dictionary with relevant UUIDs."""
-    response = await resource_handler.handle_request("GET", f"devices/{device_id}")
-    if response and isinstance(response, dict):
-        return response
-    logging.error(f"Failed to retrieve device resource for {device_id}")
-    return {}
-
-
 """
 body: {
     "device_id": string, // UUID
@@ -101,9 +102,8 @@ async def handle_light_set(self, message):
     body = message.get("body")
     device_id = body.get("device_id")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, device_id)
-    light_id = device.get("light")
+    # Resolve the associated UUID from the device resolver
+    light_id = await self.device_resolver.resolve(device_id, "light")
 
     if light_id:
         # Prepare the data for the PUT request, excluding None values
@@ -139,9 +139,8 @@ async def handle_plug_set(self, message):
     device_id = body.get("device_id")
     is_on = body.get("is_on")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, device_id)
-    plug_id = device.get("plug")
+    # Resolve the associated UUID from the device resolver
+    plug_id = await self.device_resolver.resolve(device_id, "plug")
 
     if plug_id:
         # Prepare data for the PUT request
@@ -161,9 +160,8 @@ async def handle_environmental_status(self, message):
     body = message.get("body")
     src = message.get("src")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, src)
-    environmental_id = device.get("environmental")
+    # Resolve the associated UUID from the device resolver
+    environmental_id = await self.device_resolver.resolve(src, "environmental")
 
     if environmental_id:
         environmental_data = filter_none_values(
@@ -172,9 +170,12 @@ async def handle_environmental_status(self, message):
                 "humidity": body.get("humidity"),
             }
         )
-        # Make a PUT request to update environmental sensor settings
-        await self.resource_handler.handle_request(
-            "PUT", f"environmentals/{environmental_id}", environmental_data
+        # Queue a (coalesced) PUT request to update environmental sensor settings
+        await self.write_coalescer.put(
+            HANDLER_ENVIRONMENTAL_STATUS,
+            "environmentals",
+            environmental_id,
+            environmental_data,
         )
         logging.info(f"Updated environmental sensor for device {src}")
     else:
@@ -187,16 +188,15 @@ async def handle_dial_status(self, message):
     """Handles updating the dial device status."""
     src = message.get("src")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, src)
-    dial_id = device.get("dial")
+    # Resolve the associated UUID from the device resolver
+    dial_id = await self.device_resolver.resolve(src, "dial")
 
     if dial_id:
         # If future data updates are needed, add to this dictionary
         dial_data = {}
-        # Make a PUT request to update dial device status (currently a placeholder)
-        await self.resource_handler.handle_request(
-            "PUT", f"devices/{dial_id}", dial_data
+        # Queue a (coalesced) PUT to update dial device status (currently a placeholder)
+        await self.write_coalescer.put(
+            HANDLER_DIAL_STATUS, "devices", dial_id, dial_data
         )
         logging.info(f"Updated dial status for device {src}")
     else:
@@ -210,9 +210,8 @@ async def handle_system_status(self, message):
     body = message.get("body")
     src = message.get("src")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, src)
-    system_id = device.get("system")
+    # Resolve the associated UUID from the device resolver
+    system_id = await self.device_resolver.resolve(src, "system")
 
     if system_id:
         system_data = filter_none_values(
@@ -225,9 +224,9 @@ async def handle_system_status(self, message):
                 "network_received": body.get("network_received"),
             }
         )
-        # Make a PUT request to update system metrics
-        await self.resource_handler.handle_request(
-            "PUT", f"systems/{system_id}", system_data
+        # Queue a (coalesced) PUT request to update system metrics
+        await self.write_coalescer.put(
+            HANDLER_SYSTEM_STATUS, "systems", system_id, system_data
         )
         logging.info(f"Updated system metrics for device {src}")
     else:
@@ -241,14 +240,13 @@ async def handle_plug_status(self, message):
     body = message.get("body")
     src = message.get("src")
 
-    # Fetch the full device resource to get the associated UUID
-    device = await get_device_resource(self.resource_handler, src)
-    plug_id = device.get("plug")
+    # Resolve the associated UUID from the device resolver
+    plug_id = await self.device_resolver.resolve(src, "plug")
 
     if plug_id:
         plug_data = filter_none_values({"is_on": body.get("is_on")})
-        # Make a PUT request to update plug status
-        await self.resource_handler.handle_request("PUT", f"plugs/{plug_id}", plug_data)
+        # Queue a (coalesced) PUT request to update plug status
+        await self.write_coalescer.put(HANDLER_PLUG_STATUS, "plugs", plug_id, plug_data)
         logging.info(f"Updated plug status for device {src}")
     else:
         logging.error(f"No plug found for device {src}")
@@ -0,0 +1,236 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+METRICS_LOOP_LAG_INTERVAL_S = float(os.getenv("METRICS_LOOP_LAG_INTERVAL_S", 0.5))
+
+# Seconds; suits both in-process handlers (sub-ms) and requests to Django (seconds)
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        escaped = escaped.replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> count
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+        # Counts are stored per bucket and accumulated when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = format_labels(names, label_values + (format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(names, label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    A value read when scraped. `collect()` returns a number, or a dict of
+    label values tuple -> number for labelled gauges.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            logging.error(f"Error collecting metric {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if value is None:
+                continue
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {format_value(value)}")
+        return lines
+
+
+class CollectedCounter(Gauge):
+    """Like Gauge, for running totals kept elsewhere (e.g. a component's stats dict)."""
+
+    type = "counter"
+
+
+class Registry:
+    """
+    Named metrics rendered together. Module-level metrics live in REGISTRY; metrics
+    tied to an object (e.g. gauges reading a Controller's state) go in a registry of
+    its own with REGISTRY as `parent`, so two instances do not clash.
+    """
+
+    def __init__(self, parent=None):
+        self.metrics = {}
+        self.parent = parent  # Rendered first
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self.metrics.pop(name, None)
+
+    def render_lines(self):
+        lines = self.parent.render_lines() if self.parent else []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return lines
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(self.render_lines()) + "\n"
+
+
+REGISTRY = Registry()
+
+MESSAGES_IN = REGISTRY.register(
+    Counter(
+        "controller_messages_in_total",
+        "Messages received, by source.",
+        ["source"],
+    )
+)
+MESSAGES_OUT = REGISTRY.register(
+    Counter(
+        "controller_messages_out_total",
+        "Messages sent, by destination.",
+        ["destination"],
+    )
+)
+HANDLER_LATENCY = REGISTRY.register(
+    Histogram(
+        "controller_handler_duration_seconds",
+        "MessageHandler processing time, by action.",
+        ["action"],
+    )
+)
+TRANSFORMER_LATENCY = REGISTRY.register(
+    Histogram(
+        "controller_transformer_duration_seconds",
+        "Transformer processing time, by registry and pattern.",
+        ["registry", "pattern"],
+    )
+)
+REQUEST_LATENCY = REGISTRY.register(
+    Histogram(
+        "controller_server_request_duration_seconds",
+        "Time to response headers for requests to the Django server, by method.",
+        ["method"],
+    )
+)
+REQUEST_STATUS = REGISTRY.register(
+    Counter(
+        "controller_server_requests_total",
+        "Requests to the Django server, by method and status (or error kind).",
+        ["method", "status"],
+    )
+)
+
+SLOW_CLIENT_DISCONNECTS = REGISTRY.register(
+    Counter(
+        "controller_local_ws_slow_disconnects_total",
+        "Local WebSocket clients disconnected for falling behind, by cause.",
+        ["cause"],
+    )
+)
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task; a busy loop shows up as lag."""
+
+    def __init__(self, interval_s=METRICS_LOOP_LAG_INTERVAL_S):
+        self.interval_s = interval_s
+        self.lag_s = 0.0
+        self.max_lag_s = 0.0
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval_s)
+            self.lag_s = max(0.0, time.monotonic() - started - self.interval_s)
+            self.max_lag_s = max(self.max_lag_s, self.lag_s)
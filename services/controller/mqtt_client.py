@@ -3,17 +3,29 @@ import asyncio
 from paho.mqtt.subscribeoptions import SubscribeOptions
 from aiomqtt import Client, MqttError, ProtocolVersion
 import logging
+from metrics import MESSAGES_OUT
 
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
 MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 DEVICE_ID = os.getenv("DEVICE_ID", "controller")
 
+# Mosquitto's running count of PUBLISH packets it received, used to measure broker-side filtering
+BROKER_RECEIVED_TOPIC = "$SYS/broker/publish/messages/received"
+MQTT_BROKER_STATS = os.getenv("MQTT_BROKER_STATS", "true").lower() == "true"
+
 url = f"{MQTT_BROKER_HOST}/{MQTT_BROKER_PORT}"
 
 
 class AsyncMqttClient:
     def __init__(self, on_message):
         self.on_message = on_message
+        self.topics = set()  # Desired subscriptions
+        self.subscribed = set()  # Subscriptions active on the current connection
+        self.connected = None  # Client while connected
+        self.stats = {"received": 0, "published": 0}
+        # (broker received, received, published) at the first sample
+        self.broker_baseline = None
+        self.broker_received = None
         self.connect()
 
     def connect(self):
@@ -28,33 +40,90 @@ class AsyncMqttClient:
         logging.info(f"Received message on topic {message.topic}")
         try:
             decoded_payload = message.payload.decode("utf-8")
-            self.on_message(message.topic, decoded_payload)
+            if str(message.topic) == BROKER_RECEIVED_TOPIC:
+                self.handle_broker_received(int(decoded_payload))
+                return
+            self.stats["received"] += 1
+            await self.on_message(message.topic, decoded_payload)
         except Exception as e:
             logging.error(f"Failed to handle message: {e}")
 
+    def handle_broker_received(self, count):
+        if self.broker_baseline is None:
+            self.broker_baseline = (
+                count,
+                self.stats["received"],
+                self.stats["published"],
+            )
+        self.broker_received = count
+
+    def get_stats(self):
+        """
+        Message counters. `filtered_at_broker` estimates how many publishes the broker
+        received but did not deliver to us (i.e. dropped by our subscriptions rather than
+        in Python) since the first broker sample.
+        """
+        stats = {**self.stats, "subscriptions": len(self.subscribed)}
+        if self.broker_baseline is not None:
+            broker_base, received_base, published_base = self.broker_baseline
+            stats["filtered_at_broker"] = max(
+                0,
+                (self.broker_received - broker_base)
+                - (self.stats["received"] - received_base)
+                - (self.stats["published"] - published_base),
+            )
+        return stats
+
     async def publish(self, topic, message):
         logging.info(f"Publishing message to topic {topic}: {message}")
 
         try:
             await self.client.publish(topic, message)
+            self.stats["published"] += 1
+            MESSAGES_OUT.inc("mqtt")
         except Exception as e:
             logging.error(f"Unable to publish; error: {e}")
 
-    async def subscribe(self, topic):
+    async def subscribe(self, *topics):
+        """Connects and keeps the given subscriptions (see `update_subscriptions`) until cancelled."""
+        self.topics = set(topics)
         while 1:
             try:
-                await self._subscribe(topic)
+                await self._subscribe()
             except Exception as e:
                 logging.error(f"Subscribe error: {e}")
+                self.connected = None
+                self.subscribed = set()
                 await asyncio.sleep(1)
                 logging.warn("Attempting to reconnect to MQTT broker")
                 self.connect()
 
-    async def _subscribe(self, topic):
-        logging.info(f"Subscribing to topic: {topic}")
-
+    async def _subscribe(self):
         async with self.client as client:
-            options = SubscribeOptions(noLocal=True)
-            await client.subscribe(topic, options=options)
+            self.connected = client
+            if MQTT_BROKER_STATS:
+                await client.subscribe(BROKER_RECEIVED_TOPIC)
+            await self.sync_subscriptions()
             async for message in client.messages:
                 await self.handle_message(message)
+
+    async def update_subscriptions(self, topics):
+        """Replaces the subscription set, subscribing/unsubscribing only the difference."""
+        self.topics = set(topics)
+        if self.connected:
+            try:
+                await self.sync_subscriptions()
+            except MqttError as e:
+                logging.error(f"Unable to update subscriptions; error: {e}")
+
+    async def sync_subscriptions(self):
+        client = self.connected
+        options = SubscribeOptions(noLocal=True)
+        for topic in self.topics - self.subscribed:
+            logging.info(f"Subscribing to topic: {topic}")
+            await client.subscribe(topic, options=options)
+            self.subscribed.add(topic)
+        for topic in self.subscribed - self.topics:
+            logging.info(f"Unsubscribing from topic: {topic}")
+            await client.unsubscribe(topic)
+            self.subscribed.discard(topic)
@@ -1,6 +1,8 @@
-import re
 import logging
-import json
+import time
+from envelope import Envelope
+from metrics import TRANSFORMER_LATENCY
+from topic_router import TopicRouter
 
 ACTION_PLUG_STATUS = "plug__status"
 
@@ -10,11 +12,26 @@ SHELLY_METHOD_NOTIFY_FULL_STATUS = "NotifyFullStatus"
 class MqttTransformerRegistry:
     def __init__(self, resource_handler):
         self.transformers = {}
+        self.router = TopicRouter()
         self.resource_handler = resource_handler
+        self.change_listeners = []
+
+    def add_change_listener(self, listener):
+        """Registers `listener()`, called whenever a transformer is registered."""
+        self.change_listeners.append(listener)
+
+    def subscription_patterns(self):
+        """MQTT subscriptions covering every registered transformer."""
+        return set(self.router.patterns())
 
     def register(self, pattern):
+        """Registers a transformer for an MQTT topic pattern (see TopicRouter)."""
+
         def decorator(transformer_callback):
             self.transformers[pattern] = transformer_callback
+            self.router.register(pattern, (pattern, transformer_callback))
+            for listener in self.change_listeners:
+                listener()
             return transformer_callback  # Return the callback unmodified
 
         return decorator
@@ -24,31 +41,47 @@ class MqttTransformerRegistry:
         try:
             dest = str(topic)  # Be careful; in aiomqtt, this is a Topic obj
 
-            # Check if a transformer exists by matching regex patterns against 'dest'
-            for pattern, transformer in self.transformers.items():
-                if re.match(pattern, dest):
-                    logging.info(f"Applying transformer for pattern: {pattern}")
-                    # Apply the transformer and return the transformed message
-                    return await transformer(message, dest, cb)
+            # Parse the payload once; transformers and consumers share the Envelope
+            envelope = Envelope.wrap(message)
 
-            # If no transformer is found, use the original message
-            logging.info("No transformer found; consuming as-is")
-            cb(message)
+            # Check if a transformer exists for the topic
+            match = self.router.resolve(dest)
+            if match:
+                (pattern, transformer), params = match
+                logging.info(f"Applying transformer for pattern: {pattern}")
+                # Apply the transformer with the captured topic segments
+                started = time.perf_counter()
+                try:
+                    return await transformer(envelope, dest, cb, params)
+                finally:
+                    TRANSFORMER_LATENCY.observe(
+                        time.perf_counter() - started, "mqtt", pattern
+                    )
+
+            # Subscriptions are wildcards over the registered patterns; anything else
+            # they let through (e.g. `shellies/announce/status`) is filtered out here
+            logging.info(f"No transformer found for topic {dest}; ignoring")
         except Exception as e:
             logging.error(f"Transformation error: {e}")
 
 
 def register_mqtt_transformers(registry):
+    # Devices publish status already in message format (e.g. dial__status) under
+    # `<group>/<uuid>/status`; `+` keeps every device type, known to the controller or not
+    @registry.register("+/{device_id:uuid}/status")
+    async def forward_device_status_message(envelope, topic, cb, params):
+        cb(envelope)
+
     # Example: {"id":0, "source":"init", "output":false, "apower":0.0, "voltage":122.9, "current":0.000, "aenergy":{"total":0.000,"by_minute":[0.000,0.000,0.000],"minute_ts":1726942679},"temperature":{"tC":45.9, "tF":114.7}}
-    @registry.register(r"^plugs/[0-9a-fA-F-]{36}/status/switch:0$")
-    async def transform_plug_status_message(message, topic, cb):
-        logging.info(f"Transforming plug status message {message}")
-        device_id = topic.split("/")[1]
-        obj = json.loads(message)
+    @registry.register("plugs/{device_id:uuid}/status/switch:0")
+    async def transform_plug_status_message(envelope, topic, cb, params):
+        logging.info(f"Transforming plug status message {envelope}")
+        device_id = params["device_id"]
+        obj = envelope.data
         transformed = {
             "src": device_id,
             "dest": f"plugs/{device_id}/status",
             "action": ACTION_PLUG_STATUS,
             "body": {"is_on": obj["output"]},
         }
-        cb(json.dumps(transformed))
+        cb(Envelope.from_data(transformed))
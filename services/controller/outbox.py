@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+OUTBOX_FILE_PATH = os.getenv("OUTBOX_FILE_PATH", "outbox.db")
+
+METHOD_POST = "POST"
+METHOD_PUT = "PUT"
+METHOD_DELETE = "DELETE"
+
+
+class Outbox:
+    """
+    Durable queue of writes made while the Django server is unreachable, backed by SQLite.
+
+    Successive PUTs to the same resource are coalesced into a single entry whose fields are
+    merged (last write wins per field), and a DELETE supersedes any pending PUTs for the same
+    resource, so a long outage replays as at most one write per resource.
+
+    Writes (and their commits) run on a single background thread, so they never block
+    the event loop and are applied in the order they were made. Reads use a separate
+    connection on the loop, which WAL mode lets see every committed write.
+
+    Every merge bumps an entry's version. `remove` only deletes an entry whose version
+    is unchanged since it was peeked, so fields merged into an entry while it was being
+    replayed are kept for the next replay instead of being lost.
+    """
+
+    def __init__(self, file_path=OUTBOX_FILE_PATH):
+        self.file_path = file_path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                method TEXT NOT NULL,
+                resource_type TEXT NOT NULL,
+                resource_id TEXT,
+                data TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+        if "version" not in columns:
+            # Outboxes created before entries were versioned
+            self.conn.execute(
+                "ALTER TABLE outbox ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_resource ON outbox (resource_type, resource_id)"
+        )
+        self.conn.commit()
+        self.reader = sqlite3.connect(file_path)
+
+    def __len__(self):
+        return self.reader.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    async def run_in_writer(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def add(self, method, resource_type, resource_id=None, data=None):
+        await self.run_in_writer(self._add, method, resource_type, resource_id, data)
+
+    def _add(self, method, resource_type, resource_id, data):
+        with self.conn:
+            if method == METHOD_PUT:
+                row = self.conn.execute(
+                    "SELECT seq, data FROM outbox WHERE method = ? AND resource_type = ? AND resource_id = ?",
+                    (METHOD_PUT, resource_type, resource_id),
+                ).fetchone()
+                if row:
+                    seq, existing = row
+                    merged = {**json.loads(existing or "{}"), **(data or {})}
+                    self.conn.execute(
+                        "UPDATE outbox SET data = ?, version = version + 1 WHERE seq = ?",
+                        (json.dumps(merged), seq),
+                    )
+                    logging.info(f"Coalesced queued PUT {resource_type}/{resource_id}")
+                    return
+            elif method == METHOD_DELETE:
+                # Pending updates to a resource that is about to be deleted are moot
+                self.conn.execute(
+                    "DELETE FROM outbox WHERE method = ? AND resource_type = ? AND resource_id = ?",
+                    (METHOD_PUT, resource_type, resource_id),
+                )
+
+            self.conn.execute(
+                "INSERT INTO outbox (method, resource_type, resource_id, data) VALUES (?, ?, ?, ?)",
+                (
+                    method,
+                    resource_type,
+                    resource_id,
+                    json.dumps(data) if data is not None else None,
+                ),
+            )
+        logging.info(f"Queued {method} {resource_type}/{resource_id or ''} for later")
+
+    def has_pending(self, resource_type, resource_id):
+        """Whether a queued write targets the resource (its cached copy is the only one)."""
+        row = self.reader.execute(
+            "SELECT 1 FROM outbox WHERE resource_type = ? AND resource_id = ? LIMIT 1",
+            (resource_type, resource_id),
+        ).fetchone()
+        return row is not None
+
+    def peek(self, limit, after=0):
+        """Returns up to `limit` of the oldest entries after sequence `after` as dicts, in order."""
+        rows = self.reader.execute(
+            "SELECT seq, method, resource_type, resource_id, data, attempts, version FROM outbox WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after, limit),
+        ).fetchall()
+        return [
+            {
+                "seq": seq,
+                "method": method,
+                "resource_type": resource_type,
+                "resource_id": resource_id,
+                "data": json.loads(data) if data is not None else None,
+                "attempts": attempts,
+                "version": version,
+            }
+            for seq, method, resource_type, resource_id, data, attempts, version in rows
+        ]
+
+    async def remove(self, entries):
+        """Deletes peeked entries, except those merged into since they were peeked."""
+        await self.run_in_writer(self._remove, entries)
+
+    def _remove(self, entries):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM outbox WHERE seq = ? AND version = ?",
+                [(entry["seq"], entry["version"]) for entry in entries],
+            )
+
+    async def mark_failed(self, seqs):
+        await self.run_in_writer(self._mark_failed, seqs)
+
+    def _mark_failed(self, seqs):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1 WHERE seq = ?",
+                [(seq,) for seq in seqs],
+            )
+
+    def close(self):
+        # Waits for queued writes to be committed
+        self.executor.shutdown(wait=True)
+        self.conn.close()
+        self.reader.close()
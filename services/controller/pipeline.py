@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import logging
+import os
+from collections import OrderedDict
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_COALESCE = "coalesce"
+
+OVERFLOW_POLICIES = (
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_COALESCE,
+)
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 1000))
+
+
+def parse_sink_overrides(value):
+    """Parses `sink=policy:size,sink=policy` into {sink: (policy, size or None)}."""
+    overrides = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, config = item.split("=", 1)
+        policy, _, size = config.partition(":")
+        overrides[name.strip()] = (policy.strip(), int(size) if size else None)
+    return overrides
+
+
+PIPELINE_SINKS = parse_sink_overrides(os.getenv("PIPELINE_SINKS"))
+
+
+class Sink:
+    """
+    A bounded queue drained by its own worker task(s).
+
+    When full, `overflow` decides what happens to a new item: `block` makes `put` wait for
+    space, `drop_oldest` evicts the oldest queued item, `drop_newest` discards the new one,
+    and `coalesce` replaces a queued item with the same `key(*args)` (falling back to
+    dropping the oldest when nothing matches).
+
+    With several workers, items with the same key are still handled one at a time and
+    in order: a worker skips an item whose key another worker is handling.
+    """
+
+    def __init__(
+        self,
+        name,
+        handler,
+        maxsize=PIPELINE_QUEUE_SIZE,
+        workers=1,
+        overflow=OVERFLOW_DROP_OLDEST,
+        key=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if overflow == OVERFLOW_COALESCE and key is None:
+            raise ValueError(f"Sink {name} coalesces but has no key function")
+
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow
+        self.key = key
+        self.pending = OrderedDict()  # key -> args, oldest first
+        self.active = set()  # Keys of items being handled
+        self.sequence = itertools.count()  # Keys for items that are never coalesced
+        self.has_items = asyncio.Event()
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "max_depth": 0,
+        }
+
+    def get_stats(self):
+        return {**self.stats, "depth": len(self.pending), "overflow": self.overflow}
+
+    def full(self):
+        return len(self.pending) >= self.maxsize
+
+    def submit(self, *args):
+        """Enqueues without waiting; returns False if the item was dropped."""
+        self.stats["submitted"] += 1
+
+        key = self.key(*args) if self.key else None
+        if self.overflow == OVERFLOW_COALESCE and key in self.pending:
+            self.pending[key] = args
+            self.stats["coalesced"] += 1
+            return True
+
+        if self.full():
+            if self.overflow in (OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK):
+                # `block` can only wait in `put`; a non-waiting submit has to drop
+                self.stats["dropped"] += 1
+                logging.warning(f"Sink {self.name} full; dropping newest item")
+                return False
+            self.pending.popitem(last=False)
+            self.stats["dropped"] += 1
+            logging.warning(f"Sink {self.name} full; dropping oldest item")
+
+        if self.overflow != OVERFLOW_COALESCE:
+            key = next(self.sequence)
+        self.pending[key] = args
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+        self.has_items.set()
+        if self.full():
+            self.has_space.clear()
+        return True
+
+    async def put(self, *args):
+        """Enqueues, waiting for space if the overflow policy is `block`."""
+        if self.overflow == OVERFLOW_BLOCK:
+            while self.full():
+                await self.has_space.wait()
+        return self.submit(*args)
+
+    def take(self):
+        """Removes and returns the oldest item whose key is not being handled, if any."""
+        # A queue holds at most one item per key, so at most one per worker is skipped
+        for key in self.pending:
+            if key not in self.active:
+                return key, self.pending.pop(key)
+        return None
+
+    async def work(self):
+        while True:
+            item = self.take()
+            while item is None:
+                self.has_items.clear()
+                await self.has_items.wait()
+                item = self.take()
+
+            key, args = item
+            if not self.full():
+                self.has_space.set()
+            self.active.add(key)
+            try:
+                await self.handler(*args)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(f"Error in sink {self.name}: {e}")
+            finally:
+                self.active.discard(key)
+                if self.pending:
+                    # An item skipped while this key was active can be taken now
+                    self.has_items.set()
+
+
+class Pipeline:
+    """Named sinks, each with its own bounded queue and workers, so one slow sink cannot stall the rest."""
+
+    def __init__(self, overrides=PIPELINE_SINKS):
+        self.sinks = {}
+        self.overrides = overrides
+        self.tasks = set()
+
+    def add_sink(self, name, handler, **kwargs):
+        if name in self.overrides:
+            overflow, maxsize = self.overrides[name]
+            kwargs["overflow"] = overflow
+            if maxsize:
+                kwargs["maxsize"] = maxsize
+        self.sinks[name] = Sink(name, handler, **kwargs)
+        return self.sinks[name]
+
+    def submit(self, name, *args):
+        return self.sinks[name].submit(*args)
+
+    async def put(self, name, *args):
+        return await self.sinks[name].put(*args)
+
+    async def run(self):
+        """Runs every sink's workers until cancelled."""
+        for sink in self.sinks.values():
+            for _ in range(sink.workers):
+                task = asyncio.create_task(sink.work())
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+
+    def get_stats(self):
+        return {name: sink.get_stats() for name, sink in self.sinks.items()}
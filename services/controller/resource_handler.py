@@ -1,21 +1,184 @@
-from aiohttp import ClientSession
+import asyncio
+import contextlib
 import logging
 import os
+import time
+from aiohttp import ClientTimeout
+from cache_policy import CachePolicy, FRESH, STALE
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import REQUEST_LATENCY, REQUEST_STATUS
+from outbox import METHOD_POST, METHOD_PUT, METHOD_DELETE
 
 API_PREFIX = os.getenv("API_PREFIX", "")
+OUTBOX_REPLAY_BATCH_SIZE = int(os.getenv("OUTBOX_REPLAY_BATCH_SIZE", 50))
+OUTBOX_REPLAY_CONCURRENCY = int(os.getenv("OUTBOX_REPLAY_CONCURRENCY", 8))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 3))
+# Writes diverted while the server was slow (not down) are drained this often while online
+OUTBOX_DRAIN_INTERVAL_S = float(os.getenv("OUTBOX_DRAIN_INTERVAL_S", 30))
+
+# Bulkheads: reads and writes get separate concurrency limits so one cannot starve the other
+OPERATION_READ = "read"
+OPERATION_WRITE = "write"
+RESOURCE_READ_CONCURRENCY = int(os.getenv("RESOURCE_READ_CONCURRENCY", 16))
+RESOURCE_WRITE_CONCURRENCY = int(os.getenv("RESOURCE_WRITE_CONCURRENCY", 8))
+# Per-request deadline, covering both the wait for a bulkhead slot and the request itself
+RESOURCE_READ_DEADLINE_S = float(os.getenv("RESOURCE_READ_DEADLINE_S", 5))
+RESOURCE_WRITE_DEADLINE_S = float(os.getenv("RESOURCE_WRITE_DEADLINE_S", 10))
+
+# Resource types that can be updated together through the bulk endpoint
+BULK_RESOURCE_TYPES = {"devices", "plugs", "lights", "environmentals", "systems"}
 
 
 class ResourceHandler:
     def __init__(
-        self, cache, server_url, is_online_getter, token_getter, message_queue=None
+        self,
+        cache,
+        server_url,
+        is_online_getter,
+        token_getter,
+        session,
+        outbox=None,
+        cache_policy=None,
+        circuit_breaker=None,
     ):
+        self.session = session  # Shared, pooled aiohttp session owned by the controller
+        self.bulkheads = {
+            OPERATION_READ: asyncio.Semaphore(RESOURCE_READ_CONCURRENCY),
+            OPERATION_WRITE: asyncio.Semaphore(RESOURCE_WRITE_CONCURRENCY),
+        }
+        self.bulkhead_stats = {
+            operation: {"in_use": 0, "waiting": 0} for operation in self.bulkheads
+        }
+        self.deadlines_s = {
+            OPERATION_READ: RESOURCE_READ_DEADLINE_S,
+            OPERATION_WRITE: RESOURCE_WRITE_DEADLINE_S,
+        }
+        # Sends calls down the offline path while the server is failing or too slow
+        self.circuit_breaker = circuit_breaker or CircuitBreaker("server")
+        self.circuit_breaker.add_close_listener(self.handle_circuit_closed)
         self.cache = cache
+        self.cache_policy = cache_policy or CachePolicy(on_evict=self.evict)
+        self.refresh_tasks = {}  # (resource_type, resource_id) -> background refresh
+        self.inflight_fetches = {}  # (resource_type, resource_id) -> shared GET task
+        self.fetch_stats = {"requests": 0, "coalesced": 0}
         self.server_url = server_url
         self.get_is_online = is_online_getter
         self.get_token = token_getter
-        self.message_queue = (
-            message_queue  # Stub for future message broker; TODO: probably remove this
-        )
+        self.outbox = outbox  # Durable queue of writes made while offline
+        self.change_listeners = []
+        self.outcome_listeners = []
+        self.replay_lock = asyncio.Lock()  # One outbox replay at a time
+        self.replay_task = None
+
+    def add_change_listener(self, listener):
+        """Registers `listener(method, resource_type, resource_id, resource)`, called after each local or remote write."""
+        self.change_listeners.append(listener)
+
+    def notify_change(self, method, resource_type, resource_id, resource=None):
+        for listener in self.change_listeners:
+            try:
+                listener(method, resource_type, resource_id, resource)
+            except Exception as e:
+                logging.error(f"Error notifying resource change listener: {e}")
+
+    def add_outcome_listener(self, listener):
+        """Registers `listener(ok)`, called with whether each request to the server got a non-5xx response."""
+        self.outcome_listeners.append(listener)
+
+    def notify_outcome(self, ok):
+        for listener in self.outcome_listeners:
+            try:
+                listener(ok)
+            except Exception as e:
+                logging.error(f"Error notifying request outcome listener: {e}")
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """
+        `session.request` behind the read/write bulkhead, the circuit breaker and a deadline.
+        Reports whether the server answered (see `add_outcome_listener`).
+        Raises CircuitOpenError while the circuit is open and asyncio.TimeoutError past the deadline.
+        """
+        operation = OPERATION_READ if method == "GET" else OPERATION_WRITE
+        deadline_s = self.deadlines_s[operation]
+        bulkhead = self.bulkheads[operation]
+        bulkhead_stats = self.bulkhead_stats[operation]
+        started = time.monotonic()
+
+        try:
+            self.circuit_breaker.before_call()
+        except CircuitOpenError:
+            REQUEST_STATUS.inc(method, "circuit_open")
+            raise
+        bulkhead_stats["waiting"] += 1
+        try:
+            await asyncio.wait_for(bulkhead.acquire(), deadline_s)
+        except asyncio.TimeoutError:
+            logging.error(f"No {operation} slot free within {deadline_s}s for {url}")
+            self.circuit_breaker.record(False, time.monotonic() - started)
+            REQUEST_STATUS.inc(method, "bulkhead_timeout")
+            raise
+        except BaseException:
+            self.circuit_breaker.release()
+            raise
+        finally:
+            bulkhead_stats["waiting"] -= 1
+        bulkhead_stats["in_use"] += 1
+
+        answered = False
+        try:
+            remaining_s = max(0.0, deadline_s - (time.monotonic() - started))
+            async with self.session.request(
+                method, url, timeout=ClientTimeout(total=remaining_s), **kwargs
+            ) as response:
+                answered = True
+                elapsed_s = time.monotonic() - started
+                ok = response.status < 500
+                self.circuit_breaker.record(ok, elapsed_s)
+                self.notify_outcome(ok)
+                REQUEST_LATENCY.observe(elapsed_s, method)
+                REQUEST_STATUS.inc(method, str(response.status))
+                yield response
+        except Exception as e:
+            if not answered:
+                elapsed_s = time.monotonic() - started
+                self.circuit_breaker.record(False, elapsed_s)
+                self.notify_outcome(False)
+                REQUEST_LATENCY.observe(elapsed_s, method)
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                REQUEST_STATUS.inc(method, "timeout" if timed_out else "error")
+            raise
+        except BaseException:
+            if not answered:
+                self.circuit_breaker.release()
+            raise
+        finally:
+            bulkhead_stats["in_use"] -= 1
+            bulkhead.release()
+
+    async def route(self, online_call, offline_call, retry_offline_on_timeout=True):
+        """
+        Runs `online_call` while online and the circuit allows it, else `offline_call`.
+        Also falls back when the circuit opens underneath the call, and after a deadline
+        unless the write is not safe to repeat (`retry_offline_on_timeout=False`).
+        """
+        if self.get_is_online() and self.circuit_breaker.available():
+            try:
+                return await online_call()
+            except CircuitOpenError as e:
+                logging.warning(f"{e}; using the offline path")
+            except asyncio.TimeoutError:
+                if not retry_offline_on_timeout:
+                    raise
+                logging.warning("Request timed out; using the offline path")
+        return await offline_call()
+
+    def get_circuit_stats(self):
+        return self.circuit_breaker.get_stats()
+
+    def get_bulkhead_stats(self):
+        """Requests holding or waiting for a slot, per operation (read/write)."""
+        return self.bulkhead_stats
 
     async def get_common_headers(self):
         token = await self.get_token()
@@ -25,6 +188,25 @@ class ResourceHandler:
         }
 
     async def fetch_online(self, resource_type, resource_id=None):
+        """Single-flight GET; concurrent identical reads share one in-flight request."""
+        key = (resource_type, resource_id)
+        task = self.inflight_fetches.get(key)
+        if task:
+            self.fetch_stats["coalesced"] += 1
+            logging.info(f"Coalescing GET {resource_type}: {resource_id or 'All'}")
+        else:
+            self.fetch_stats["requests"] += 1
+            task = asyncio.create_task(self._fetch_online(resource_type, resource_id))
+            self.inflight_fetches[key] = task
+            task.add_done_callback(lambda _: self.inflight_fetches.pop(key, None))
+        # Shield so one cancelled caller does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def get_fetch_stats(self):
+        """Number of GETs actually sent vs. calls that joined an in-flight GET."""
+        return self.fetch_stats
+
+    async def _fetch_online(self, resource_type, resource_id=None):
         logging.info(f"GET {resource_type}: {resource_id or 'All'}")
 
         # Proxy the GET request to the Django server
@@ -33,32 +215,100 @@ class ResourceHandler:
             url += f"/{resource_id}"
         common_headers = await self.get_common_headers()
 
-        async with ClientSession() as session:
-            async with session.get(url, headers=common_headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logging.info(f"Response data: {data}")
-                    if resource_id:
-                        self.cache.add(resource_type, data)
-                    else:
-                        for item in data:
-                            self.cache.add(resource_type, item)
-                    return data
+        async with self.request("GET", url, headers=common_headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                logging.info(f"Response data: {data}")
+                if resource_id:
+                    self.cache.add(resource_type, data)
                 else:
-                    logging.error(
-                        f"Failed to fetch {resource_type}. Status: {response.status}"
-                    )
-                    return self.cache.get(resource_type, resource_id)
+                    self.replace_collection(resource_type, data)
+                self.cache_policy.mark_fresh(resource_type, resource_id)
+                return data
+            else:
+                logging.error(
+                    f"Failed to fetch {resource_type}. Status: {response.status}"
+                )
+                return self.cache.get(resource_type, resource_id)
+
+    def replace_collection(self, resource_type, items):
+        """
+        Makes the cached collection match a server listing: resources the server no
+        longer returns are dropped, unless a queued write still targets them.
+        """
+        listed = set()
+        for item in items:
+            self.cache.add(resource_type, item)
+            self.cache_policy.mark_fresh(
+                resource_type, item.get("uuid") or item.get("id")
+            )
+            listed.add(item.get("id") or item.get("uuid"))
+        for resource in self.cache.get(resource_type):
+            resource_id = resource.get("id") or resource.get("uuid")
+            if resource_id not in listed:
+                logging.info(f"{resource_type}/{resource_id} removed on the server")
+                self.cache_policy.invalidate(resource_type, resource_id)
+                self.evict(resource_type, resource_id)
 
     async def fetch_offline(self, resource_type, resource_id=None):
         logging.info(f"GET offline {resource_type}: {resource_id or 'All'}")
 
         return self.cache.get(resource_type, resource_id)
 
-    async def fetch(self, resource_type, resource_id=None):
-        if self.get_is_online():
+    def find(self, resource_type, field, value):
+        """Looks up cached resources by a secondary index; never hits the network."""
+        return self.cache.find(resource_type, field, value)
+
+    async def fetch_cached(self, resource_type, resource_id=None):
+        """
+        Serves fresh entries locally, stale entries while revalidating in the
+        background, and blocks on the server only for misses. A listing fetched from
+        the server replaces the cached collection (see `replace_collection`).
+        """
+        state = self.cache_policy.lookup(resource_type, resource_id)
+        if state not in (FRESH, STALE):
             return await self.fetch_online(resource_type, resource_id)
-        return await self.fetch_offline(resource_type, resource_id)
+
+        cached = self.cache.get(resource_type, resource_id)
+        if cached is None:
+            # Policy and cache disagree (e.g. deleted locally); treat as a miss
+            return await self.fetch_online(resource_type, resource_id)
+        if state == STALE:
+            self.schedule_refresh(resource_type, resource_id)
+        return cached
+
+    def schedule_refresh(self, resource_type, resource_id=None):
+        """Starts a background refresh for the entry unless one is already running."""
+        key = (resource_type, resource_id)
+        if key in self.refresh_tasks:
+            return
+
+        async def refresh():
+            try:
+                await self.fetch_online(resource_type, resource_id)
+            except Exception as e:
+                logging.error(f"Error refreshing {resource_type}/{resource_id}: {e}")
+            finally:
+                self.refresh_tasks.pop(key, None)
+
+        self.cache_policy.mark_refresh(resource_type)
+        self.refresh_tasks[key] = asyncio.create_task(refresh())
+
+    def evict(self, resource_type, resource_id):
+        """Drops a resource evicted by the cache policy, unless a write is still pending for it."""
+        if self.outbox and self.outbox.has_pending(resource_type, resource_id):
+            return
+        self.cache.delete(resource_type, resource_id)
+
+    def get_cache_stats(self):
+        """Per resource type hit/miss/refresh counters."""
+        return self.cache_policy.stats
+
+    async def fetch(self, resource_type, resource_id=None):
+        return await self.route(
+            lambda: self.fetch_cached(resource_type, resource_id),
+            lambda: self.fetch_offline(resource_type, resource_id),
+        )
 
     async def post_online(self, resource_type, data):
         logging.info(f"POST {resource_type}: {data}")
@@ -67,29 +317,47 @@ class ResourceHandler:
         url = f"{self.server_url}{API_PREFIX}/{resource_type}"
         common_headers = await self.get_common_headers()
 
-        async with ClientSession() as session:
-            async with session.post(url, headers=common_headers, json=data) as response:
-                if response.status == 201:
-                    created_resource = await response.json()
-                    self.cache.add(resource_type, created_resource)
-                    return created_resource
-                else:
-                    logging.error(
-                        f"Failed to create {resource_type}. Status: {response.status}"
-                    )
-                    return None
+        async with self.request(
+            "POST", url, headers=common_headers, json=data
+        ) as response:
+            if response.status == 201:
+                created_resource = await response.json()
+                self.cache.add(resource_type, created_resource)
+                self.cache_policy.invalidate(resource_type)
+                self.cache_policy.mark_fresh(
+                    resource_type, created_resource.get("uuid")
+                )
+                self.notify_change(
+                    METHOD_POST,
+                    resource_type,
+                    created_resource.get("uuid"),
+                    created_resource,
+                )
+                return created_resource
+            else:
+                logging.error(
+                    f"Failed to create {resource_type}. Status: {response.status}"
+                )
+                return None
 
     async def post_offline(self, resource_type, data):
         # Handle POST request offline - add to cache and queue for later sync
         logging.info(f"Offline - saving {resource_type} locally and queueing for later")
         self.cache.add(resource_type, data)
-        if self.message_queue:
-            self.message_queue.add_to_queue("POST", resource_type, data)
+        self.notify_change(METHOD_POST, resource_type, data.get("uuid"), data)
+        if self.outbox is not None:
+            # Keyed by UUID so the resource is not dropped before the POST replays
+            await self.outbox.add(
+                METHOD_POST, resource_type, resource_id=data.get("uuid"), data=data
+            )
 
     async def post(self, resource_type, data):
-        if self.get_is_online():
-            return await self.post_online(resource_type, data)
-        return await self.post_offline(resource_type, data)
+        # A timed-out POST may have been applied; queueing it again could duplicate it
+        return await self.route(
+            lambda: self.post_online(resource_type, data),
+            lambda: self.post_offline(resource_type, data),
+            retry_offline_on_timeout=False,
+        )
 
     async def put_online(self, resource_type, resource_id, data):
         logging.info(f"PUT {resource_type}; id: {resource_id}; data: {data}")
@@ -98,17 +366,23 @@ class ResourceHandler:
         url = f"{self.server_url}{API_PREFIX}/{resource_type}/{resource_id}"
         common_headers = await self.get_common_headers()
 
-        async with ClientSession() as session:
-            async with session.put(url, headers=common_headers, json=data) as response:
-                if response.status == 200:
-                    updated_resource = await response.json()
-                    self.cache.update(resource_type, resource_id, updated_resource)
-                    return updated_resource
-                else:
-                    logging.error(
-                        f"Failed to update {resource_type}. Status: {response.status}"
-                    )
-                    return None
+        async with self.request(
+            "PUT", url, headers=common_headers, json=data
+        ) as response:
+            if response.status == 200:
+                updated_resource = await response.json()
+                self.cache.update(resource_type, resource_id, updated_resource)
+                self.cache_policy.invalidate(resource_type)
+                self.cache_policy.mark_fresh(resource_type, resource_id)
+                self.notify_change(
+                    METHOD_PUT, resource_type, resource_id, updated_resource
+                )
+                return updated_resource
+            else:
+                logging.error(
+                    f"Failed to update {resource_type}. Status: {response.status}"
+                )
+                return None
 
     async def put_offline(self, resource_type, resource_id, data):
         # Handle PUT request offline - update cache and queue for later sync
@@ -116,13 +390,20 @@ class ResourceHandler:
             f"Offline - updating {resource_type} locally and queueing for later"
         )
         self.cache.update(resource_type, resource_id, data)
-        if self.message_queue:
-            self.message_queue.add_to_queue("PUT", resource_type, resource_id, data)
+        self.notify_change(
+            METHOD_PUT,
+            resource_type,
+            resource_id,
+            self.cache.get(resource_type, resource_id),
+        )
+        if self.outbox is not None:
+            await self.outbox.add(METHOD_PUT, resource_type, resource_id, data)
 
     async def put(self, resource_type, resource_id, data):
-        if self.get_is_online():
-            return await self.put_online(resource_type, resource_id, data)
-        return await self.put_offline(resource_type, resource_id, data)
+        return await self.route(
+            lambda: self.put_online(resource_type, resource_id, data),
+            lambda: self.put_offline(resource_type, resource_id, data),
+        )
 
     async def delete_online(self, resource_type, resource_id):
         logging.info(f"DELETE {resource_type}; id: {resource_id}")
@@ -131,14 +412,16 @@ class ResourceHandler:
         url = f"{self.server_url}{API_PREFIX}/{resource_type}/{resource_id}"
         common_headers = await self.get_common_headers()
 
-        async with ClientSession() as session:
-            async with session.delete(url, headers=common_headers) as response:
-                if response.status == 204:
-                    self.cache.delete(resource_type, resource_id)
-                else:
-                    logging.error(
-                        f"Failed to delete {resource_type}. Status: {response.status}"
-                    )
+        async with self.request("DELETE", url, headers=common_headers) as response:
+            if response.status == 204:
+                self.cache.delete(resource_type, resource_id)
+                self.cache_policy.invalidate(resource_type, resource_id)
+                self.notify_change(METHOD_DELETE, resource_type, resource_id)
+                return True
+            else:
+                logging.error(
+                    f"Failed to delete {resource_type}. Status: {response.status}"
+                )
 
     async def delete_offline(self, resource_type, resource_id):
         # Handle DELETE request offline - remove from cache and queue for later sync
@@ -146,13 +429,185 @@ class ResourceHandler:
             f"Offline - deleting {resource_type} locally and queueing for later"
         )
         self.cache.delete(resource_type, resource_id)
-        if self.message_queue:
-            self.message_queue.add_to_queue("DELETE", resource_type, resource_id)
+        self.notify_change(METHOD_DELETE, resource_type, resource_id)
+        if self.outbox is not None:
+            await self.outbox.add(METHOD_DELETE, resource_type, resource_id)
+
+    async def delete(self, resource_type, resource_id):
+        return await self.route(
+            lambda: self.delete_online(resource_type, resource_id),
+            lambda: self.delete_offline(resource_type, resource_id),
+        )
+
+    async def bulk_update_online(self, operations):
+        """
+        Sends many partial updates in one request.
+        :param operations: List of `{"type", "uuid", "fields"}` dicts.
+        :return: Per-operation results (`{"type", "uuid", "status", "data"?}`), or None on failure.
+        """
+        logging.info(f"PATCH bulk; {len(operations)} operations")
+
+        url = f"{self.server_url}{API_PREFIX}/bulk"
+        common_headers = await self.get_common_headers()
+
+        async with self.request(
+            "PATCH", url, headers=common_headers, json=operations
+        ) as response:
+            if response.status == 200:
+                results = await response.json()
+                for result in results:
+                    if result.get("status") != 200:
+                        logging.error(f"Bulk update item failed: {result}")
+                        continue
+                    resource_type = result["type"]
+                    resource_id = result["uuid"]
+                    updated_resource = result.get("data") or {}
+                    self.cache.update(resource_type, resource_id, updated_resource)
+                    self.cache_policy.invalidate(resource_type)
+                    self.cache_policy.mark_fresh(resource_type, resource_id)
+                    self.notify_change(
+                        METHOD_PUT, resource_type, resource_id, updated_resource
+                    )
+                return results
+            else:
+                logging.error(f"Failed to bulk update. Status: {response.status}")
+                return None
+
+    async def bulk_update_offline(self, operations):
+        for operation in operations:
+            await self.put_offline(
+                operation["type"], operation["uuid"], operation["fields"]
+            )
+
+    async def bulk_update(self, operations):
+        return await self.route(
+            lambda: self.bulk_update_online(operations),
+            lambda: self.bulk_update_offline(operations),
+        )
+
+    async def replay_bulk(self, entries, semaphore):
+        """Sends queued PUTs as one bulk update; returns whether each was accepted."""
+        async with semaphore:
+            results = await self.bulk_update_online(
+                [
+                    {
+                        "type": entry["resource_type"],
+                        "uuid": entry["resource_id"],
+                        "fields": entry["data"] or {},
+                    }
+                    for entry in entries
+                ]
+            )
+        if results is None:
+            return [False] * len(entries)
+        return [result.get("status") == 200 for result in results]
+
+    async def replay_entry(self, entry, semaphore):
+        """Sends one queued write; returns True if the server accepted it."""
+        async with semaphore:
+            method = entry["method"]
+            resource_type = entry["resource_type"]
+            if method == METHOD_POST:
+                result = await self.post_online(resource_type, entry["data"])
+            elif method == METHOD_PUT:
+                result = await self.put_online(
+                    resource_type, entry["resource_id"], entry["data"]
+                )
+            elif method == METHOD_DELETE:
+                result = await self.delete_online(resource_type, entry["resource_id"])
+            else:
+                logging.error(f"Dropping queued write with unknown method: {method}")
+                return True
+            return result is not None
+
+    def handle_circuit_closed(self):
+        """Replays writes diverted to the outbox while the circuit was open."""
+        if self.replay_task is None or self.replay_task.done():
+            self.replay_task = asyncio.create_task(self.replay_outbox())
+
+    async def run_outbox_drain(self):
+        """
+        Replays the outbox periodically while online. Writes diverted by a timeout or an
+        open circuit are queued without liveness ever going offline, so the offline->online
+        replay alone would leave them queued.
+        """
+        while True:
+            await asyncio.sleep(OUTBOX_DRAIN_INTERVAL_S)
+            if self.get_is_online() and self.circuit_breaker.available():
+                try:
+                    await self.replay_outbox()
+                except Exception as e:
+                    logging.error(f"Error draining outbox: {e}")
+
+    async def replay_outbox(self):
+        """Replays writes queued while offline, in order, in bounded-concurrency batches."""
+        if self.outbox is None or not len(self.outbox) or self.replay_lock.locked():
+            return
+        async with self.replay_lock:
+            await self.replay_pending()
+
+    async def replay_pending(self):
+        logging.info(f"Replaying {len(self.outbox)} queued writes")
+        semaphore = asyncio.Semaphore(OUTBOX_REPLAY_CONCURRENCY)
+        cursor = 0  # Entries up to this sequence were tried in this pass
+        while True:
+            # Writes to the same resource must not race, so a batch ends at the first repeat
+            batch, keys = [], set()
+            for entry in self.outbox.peek(OUTBOX_REPLAY_BATCH_SIZE, after=cursor):
+                key = (entry["resource_type"], entry["resource_id"])
+                if entry["resource_id"] and key in keys:
+                    break
+                keys.add(key)
+                batch.append(entry)
+            if not batch:
+                break
+            cursor = batch[-1]["seq"]
+
+            # Updates go out together through the bulk endpoint; everything else one by one
+            bulk, single = [], []
+            for entry in batch:
+                if (
+                    entry["method"] == METHOD_PUT
+                    and entry["resource_type"] in BULK_RESOURCE_TYPES
+                ):
+                    bulk.append(entry)
+                else:
+                    single.append(entry)
+            bulk_result, *single_results = await asyncio.gather(
+                self.replay_bulk(bulk, semaphore) if bulk else asyncio.sleep(0, []),
+                *[self.replay_entry(entry, semaphore) for entry in single],
+                return_exceptions=True,
+            )
+            if isinstance(bulk_result, Exception):
+                bulk_results = [bulk_result] * len(bulk)
+            else:
+                bulk_results = bulk_result
+            outcomes = dict(zip([entry["seq"] for entry in bulk], bulk_results))
+            outcomes.update(zip([entry["seq"] for entry in single], single_results))
+
+            done, failed, unreachable = [], [], False
+            for entry in batch:
+                result = outcomes[entry["seq"]]
+                if result is True:
+                    done.append(entry)
+                elif isinstance(result, Exception):
+                    logging.error(f"Error replaying queued write: {result}")
+                    unreachable = True
+                elif entry["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                    logging.error(f"Dropping queued write after retries: {entry}")
+                    done.append(entry)
+                else:
+                    failed.append(entry["seq"])
+            await self.outbox.remove(done)
+            await self.outbox.mark_failed(failed)
 
-    async def delete(self, resource_type, resource_id, online=True):
-        if online:
-            return await self.delete_online(resource_type, resource_id)
-        return await self.delete_offline(resource_type, resource_id)
+            if failed:
+                # Rejected entries stay queued for the next replay; the rest carry on
+                logging.warning(f"{len(failed)} queued writes rejected; will retry")
+            if unreachable:
+                # Leave the rest for the next time the server comes back
+                logging.warning(f"Outbox replay paused; {len(self.outbox)} remaining")
+                break
 
     async def _handle_request(self, method, path, data=None):
         logging.info(
@@ -1,39 +1,248 @@
 import asyncio
 import datetime
+import functools
 import logging
 import os
-import json
+import time
+from envelope import Envelope
+from scheduler import Scheduler
+from expressions import ExpressionEngine
+from event_triggers import EventTrigger, EventTriggerIndex
+from cron import next_cron_fire, parse_duration, skip_missed
+from routine_snapshot import RoutineSnapshot
 
 HOME_HOST = os.getenv("HOME_HOST")
 HOME_PORT = os.getenv("HOME_PORT")
 
+# Routines triggered by one message run concurrently, at most this many at a time
+ROUTINE_EVENT_CONCURRENCY = int(os.getenv("ROUTINE_EVENT_CONCURRENCY", 8))
+
+# Expression cache keys are (kind, owner UUID)
+EXPRESSION_CONDITION = "condition"
+EXPRESSION_PARAMS = "params"
+
+# Structured trigger types (`trigger_specs`, parsed on the Django side)
+TRIGGER_AT = "at"
+TRIGGER_TIME = "time"
+TRIGGER_CRON = "cron"
+TRIGGER_EVENT = "event"
+
+# Per-routine `catch_up` policy for runs missed while the controller was down
+CATCH_UP_SKIP = "skip"
+CATCH_UP_ONCE = "once"
+CATCH_UP_ALL = "all"
+ROUTINE_CATCH_UP_DEFAULT = os.getenv("ROUTINE_CATCH_UP_DEFAULT", CATCH_UP_SKIP)
+# Upper bound on runs replayed by the `all` policy, however long the downtime
+ROUTINE_CATCH_UP_MAX_RUNS = int(os.getenv("ROUTINE_CATCH_UP_MAX_RUNS", 100))
+# Marks the one-off scheduler key replaying missed runs: (routine UUID, trigger, CATCH_UP)
+CATCH_UP = "catch_up"
+
+
+def routine_changed(previous, routine):
+    """Whether a routine differs from its registered version, ignoring local run state."""
+    return {k: v for k, v in previous.items() if k != "run_count"} != {
+        k: v for k, v in routine.items() if k != "run_count"
+    }
+
 
 class RoutineManager:
-    def __init__(self, routine_msg_handler):
-        self.action_type_map = {}
+    def __init__(self, routine_msg_handler, state_getter=None):
+        # Event triggers indexed by action, src and dest prefix
+        self.event_triggers = EventTriggerIndex()
+        self.event_semaphore = asyncio.Semaphore(ROUTINE_EVENT_CONCURRENCY)
         self.routine_msg_handler = routine_msg_handler
-        self.scheduled_tasks = set()  # Use set to track scheduled tasks
+        # Exposed to expressions as `state(resource_type, resource_id)`: cached resources
+        self.state_getter = state_getter
+        self.expressions = ExpressionEngine()
+        # One timer heap for every time-based trigger; keys are (routine UUID, trigger)
+        self.scheduler = Scheduler()
         self.routines = {}
         self.actions = {}
+        # Per routine UUID, what it registered, so it can be removed without a rebuild
+        self.routine_timers = {}  # routine UUID -> scheduler keys
+        self.routine_event_triggers = {}  # routine UUID -> event trigger keys
+        # Routines, actions, run counts and next-fire times, persisted across restarts
+        self.snapshot = RoutineSnapshot(self.build_snapshot)
 
-    async def cancel_scheduled_tasks(self):
-        """Cancel all currently scheduled routines."""
-        for task in self.scheduled_tasks:
-            if not task.cancelled():
-                task.cancel()
-        self.scheduled_tasks.clear()  # Clear the set after cancellation
+    async def run(self):
+        """Runs the trigger scheduler and the snapshot flusher until cancelled."""
+        await asyncio.gather(self.scheduler.run(), self.snapshot.run_flusher())
 
-    async def handle_action(self, routine):
-        logging.info(f"Handling action for routine {routine['name']}")
-        """Executes actions in the routine if the eval_condition evaluates to True."""
-        eval_condition = (
-            routine.get("eval_condition") or "True"
-        )  # Handle None and empty string
+    def build_snapshot(self):
+        timers = []
+        for routine_id, keys in self.routine_timers.items():
+            for key in keys:
+                fire_at = self.scheduler.get_fire_at(key)
+                if fire_at is not None and len(key) == 2:
+                    timers.append([routine_id, key[1], fire_at])
+        return {"routines": self.routines, "actions": self.actions, "timers": timers}
+
+    def restore(self):
+        """
+        Restores routines, actions, run counts and timers from the local snapshot, without
+        the network. Timers that came due while the controller was down are handled by the
+        routine's catch-up policy. Returns whether a snapshot was found.
+        """
+        snapshot = self.snapshot.load()
+        if snapshot is None:
+            logging.info("No routine snapshot to restore")
+            return False
+
+        routines = snapshot.get("routines", {})
+        self.actions = snapshot.get("actions", {})
+        self.compile_expressions(routines, self.actions)
+        saved_timers = {
+            (routine_id, trigger): fire_at
+            for routine_id, trigger, fire_at in snapshot.get("timers", [])
+        }
+
+        now = datetime.datetime.now()
+        for routine_id, routine in routines.items():
+            self.routines[routine_id] = routine
+            self.register_routine(routine_id, routine)
+            timers = self.routine_timers[routine_id]
+            for key in list(timers):
+                fire_at = saved_timers.get(key)
+                if fire_at is None:
+                    # Already fired (one-shot) before the snapshot was taken
+                    self.scheduler.remove(key)
+                    timers.discard(key)
+                    continue
+                trigger_time = datetime.datetime.fromtimestamp(fire_at)
+                self.restore_timer(routine_id, key, routine, trigger_time, now)
+
+        # Missed runs are now either scheduled for catch-up or skipped; record that at once
+        self.snapshot.mark_dirty()
+        self.save_snapshot()
+        logging.info(
+            f"Restored {len(routines)} routines and {len(self.scheduler)} timers "
+            f"from snapshot saved at {datetime.datetime.fromtimestamp(snapshot['saved_at'])}"
+        )
+        return True
+
+    def save_snapshot(self):
+        try:
+            self.snapshot.flush()
+        except Exception as e:
+            logging.error(f"Error saving routine snapshot: {e}")
+
+    def restore_timer(self, routine_id, key, routine, trigger_time, now):
+        spec = self.get_timer_spec(routine, key)
+        if trigger_time > now:
+            self.schedule_routine(key, routine, trigger_time, spec)
+            return
+
+        policy = routine.get("catch_up") or ROUTINE_CATCH_UP_DEFAULT
+        if policy not in (CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL):
+            logging.error(f"Unknown catch-up policy '{policy}' for '{routine['name']}'")
+            policy = CATCH_UP_SKIP
+
+        next_trigger_time = self.get_next_trigger_time(routine, trigger_time, spec)
+        if next_trigger_time:
+            self.schedule_routine(key, routine, next_trigger_time, spec)
+        else:
+            self.scheduler.remove(key)
+            self.routine_timers[routine_id].discard(key)
+
+        if policy == CATCH_UP_SKIP:
+            logging.info(f"Skipping missed runs of '{routine['name']}'")
+            return
+        runs = 1
+        if policy == CATCH_UP_ALL:
+            runs = self.count_missed_runs(routine, trigger_time, spec, now)
+        catch_up_key = (*key, CATCH_UP)
+        self.scheduler.schedule(
+            catch_up_key,
+            time.time(),
+            functools.partial(self.run_catch_up, routine, runs),
+        )
+        self.routine_timers[routine_id].add(catch_up_key)
+
+    def get_timer_spec(self, routine, key):
+        """The trigger spec behind a timer key; None for legacy and repeat-only timers."""
+        specs = routine.get("trigger_specs")
+        if specs and isinstance(key[1], int) and key[1] < len(specs):
+            return specs[key[1]]
+        return None
+
+    def count_missed_runs(self, routine, trigger_time, spec, now):
+        """Runs due from `trigger_time` up to `now`, capped at ROUTINE_CATCH_UP_MAX_RUNS."""
+        try:
+            if spec and spec.get("type") == TRIGGER_CRON:
+                runs, deadline = 1, now.timestamp()
+                while runs < ROUTINE_CATCH_UP_MAX_RUNS:
+                    trigger_time = next_cron_fire(spec, trigger_time)
+                    if trigger_time.timestamp() > deadline:
+                        break
+                    runs += 1
+                return runs
+            if routine.get("repeat_interval"):
+                interval = parse_duration(routine["repeat_interval"])
+                runs = 1 + (now - trigger_time) // interval
+                return min(runs, ROUTINE_CATCH_UP_MAX_RUNS)
+        except Exception as e:
+            logging.error(f"Error counting missed runs of '{routine['name']}': {e}")
+        return 1
+
+    async def run_catch_up(self, routine, runs):
+        logging.info(f"Catching up {runs} missed runs of '{routine['name']}'")
+        for _ in range(runs):
+            await self.handle_action(routine)
+
+    def compile_expressions(self, routines, actions):
+        """Compiles every condition and params expression once; unsafe ones are rejected here."""
+        for routine_id, routine in routines.items():
+            self.compile_routine_expression(routine_id, routine)
+        for action_id, action in actions.items():
+            self.compile_action_expression(action_id, action)
+        for kind, owner_id in list(self.expressions.compiled):
+            owners = routines if kind == EXPRESSION_CONDITION else actions
+            if owner_id not in owners:
+                self.expressions.unregister((kind, owner_id))
+
+    def compile_routine_expression(self, routine_id, routine):
+        key = (EXPRESSION_CONDITION, routine_id)
+        if routine.get("eval_condition"):
+            self.expressions.register(key, routine["eval_condition"])
+        else:
+            self.expressions.unregister(key)
+
+    def compile_action_expression(self, action_id, action):
+        key = (EXPRESSION_PARAMS, action_id)
+        if action.get("eval_params"):
+            self.expressions.register(key, action["eval_params"])
+        else:
+            self.expressions.unregister(key)
+
+    def evaluate(self, key, source, routine, message, default):
+        """Evaluates a compiled expression; `default` when there is none, False-y on failure."""
+        if not source:
+            return default
+        if not self.expressions.is_registered(key):
+            logging.error(f"Skipping rejected expression {source!r}")
+            return None
         try:
-            condition = eval(eval_condition)
+            return self.expressions.evaluate(
+                key,
+                message=message,
+                routine=routine,
+                state=self.state_getter,
+                now=datetime.datetime.now(),
+            )
         except Exception as e:
-            logging.error(f"Failed to evaluate condition {eval_condition}: {e}")
-            condition = False
+            logging.error(f"Failed to evaluate expression {source!r}: {e}")
+            return None
+
+    async def handle_action(self, routine, message=None):
+        logging.info(f"Handling action for routine {routine['name']}")
+        """Executes actions in the routine if the eval_condition evaluates to True."""
+        condition = self.evaluate(
+            (EXPRESSION_CONDITION, routine.get("uuid")),
+            routine.get("eval_condition"),
+            routine,
+            message,
+            True,
+        )
 
         if condition:
             # Do routine!
@@ -42,157 +251,312 @@ class RoutineManager:
                     action = self.actions[action_id]
                     action_type = action["type"]
                     try:
-                        params = eval(
-                            action.get("eval_params") or "{}"
-                        )  # Handle None and empty string
+                        params = self.evaluate(
+                            (EXPRESSION_PARAMS, action_id),
+                            action.get("eval_params"),
+                            routine,
+                            message,
+                            {},
+                        )
+                        if params is None:
+                            continue
 
                         logging.info(
                             f"Sending routine message for action {action_type} with params: {params}"
                         )
 
-                        self.routine_msg_handler(routine, action_type, params)
+                        await self.routine_msg_handler(routine, action_type, params)
                     except Exception as e:
                         logging.error(f"Error handling action: {e}")
                 else:
                     logging.error(f"Action UUID not found: {action_id}")
 
             routine["run_count"] += 1
+            self.snapshot.mark_dirty()
 
-    async def schedule_routine(self, routine, trigger_time):
+    def schedule_routine(self, key, routine, trigger_time, spec=None):
         """Schedules the routine at the specified trigger_time, respecting repeat_interval if provided."""
-        while True:
-            now = datetime.datetime.now()
-            if trigger_time <= now:
-                logging.info(f"Executing routine '{routine['name']} immediately")
-                await self.handle_action(routine)
-
-                # Calculate next trigger time based on repeat interval
-                repeat_interval = routine.get("repeat_interval")
-                if repeat_interval:
-                    try:
-                        interval_parts = list(map(int, repeat_interval.split(":")))
-                        interval_delta = datetime.timedelta(
-                            hours=interval_parts[0],
-                            minutes=interval_parts[1],
-                            seconds=interval_parts[2],
-                        )
-                        trigger_time += interval_delta
+        now = datetime.datetime.now(trigger_time.tzinfo)
+        delay = (trigger_time - now).total_seconds()
+        logging.info(
+            f"Scheduling next execution of '{routine['name']}' in {delay} seconds"
+        )
+        self.scheduler.schedule(
+            key,
+            trigger_time.timestamp(),
+            functools.partial(
+                self.run_scheduled_routine, key, routine, trigger_time, spec
+            ),
+        )
+        self.snapshot.mark_dirty()
 
-                        # Skip missed intervals if the system was offline for a long time
-                        while trigger_time < now:
-                            trigger_time += interval_delta
+    async def run_scheduled_routine(self, key, routine, trigger_time, spec=None):
+        logging.info(f"Executing routine '{routine['name']}'")
 
-                        logging.info(
-                            f"Next trigger for '{routine['name']}' at {trigger_time}"
-                        )
-                    except Exception as e:
-                        logging.error(
-                            f"Invalid repeat interval: {repeat_interval}, {e}"
-                        )
-                        break
-                else:
-                    break  # Exit loop if no repeat interval
+        # Reschedule before running so a slow routine does not delay its next trigger
+        next_trigger_time = self.get_next_trigger_time(routine, trigger_time, spec)
+        if next_trigger_time:
+            logging.info(f"Next trigger for '{routine['name']}' at {next_trigger_time}")
+            self.schedule_routine(key, routine, next_trigger_time, spec)
+        else:
+            self.snapshot.mark_dirty()
+        # Saved before running: after a crash the old fire time must not come back as missed
+        self.save_snapshot()
 
-            # Calculate delay for next execution
-            delay = (trigger_time - now).total_seconds()
-            logging.info(
-                f"Scheduling next execution of '{routine['name']}' in {delay} seconds"
-            )
-            await asyncio.sleep(delay)
+        await self.handle_action(routine)
+
+    def get_next_trigger_time(self, routine, trigger_time, spec=None):
+        """
+        Next trigger time from the cron spec or the repeat interval, or None if the routine
+        does not repeat. Missed runs (e.g. after downtime) are jumped over, not stepped through.
+        """
+        now = datetime.datetime.now(trigger_time.tzinfo)
+        if spec and spec.get("type") == TRIGGER_CRON:
+            try:
+                return next_cron_fire(spec, max(trigger_time, now))
+            except Exception as e:
+                logging.error(f"Invalid cron trigger: {spec}, {e}")
+                return None
+
+        repeat_interval = routine.get("repeat_interval")
+        if not repeat_interval:
+            return None
+        try:
+            interval_delta = parse_duration(repeat_interval)
+            if interval_delta <= datetime.timedelta(0):
+                raise ValueError("interval must be positive")
+            return skip_missed(trigger_time, interval_delta, now)
+        except Exception as e:
+            logging.error(f"Invalid repeat interval: {repeat_interval}, {e}")
+            return None
 
     async def register_routines(self, routines, actions):
+        """
+        Applies a full routine/action set as a diff by UUID: only added, removed or changed
+        routines are (re)registered, so unchanged routines keep their timers, index entries
+        and run_count.
+        """
         logging.info("Registering routines")
 
-        # Save for later
-        self.routines = routines
         self.actions = actions
+        self.compile_expressions(routines, actions)
 
-        # Clear the action_type_map and cancel all existing scheduled tasks
-        self.action_type_map.clear()
-        await self.cancel_scheduled_tasks()
+        previous_routines = self.routines
+        for routine_id in previous_routines.keys() - routines.keys():
+            self.unregister_routine(routine_id)
 
-        for routine in routines.values():
-            routine["run_count"] = 0
-            triggers = routine.get("triggers", "")
-            repeat_interval = routine.get("repeat_interval")
+        merged = {}
+        counts = {"added": 0, "changed": 0, "unchanged": 0}
+        for routine_id, routine in routines.items():
+            previous = previous_routines.get(routine_id)
+            if previous is not None and not routine_changed(previous, routine):
+                merged[routine_id] = previous
+                counts["unchanged"] += 1
+                continue
+            counts["changed" if previous is not None else "added"] += 1
+            merged[routine_id] = self.replace_routine(routine_id, routine, previous)
+        self.routines = merged
+        self.snapshot.mark_dirty()
+        logging.info(
+            f"Routines: {counts['added']} added, {counts['changed']} changed, "
+            f"{len(previous_routines.keys() - routines.keys())} removed, "
+            f"{counts['unchanged']} unchanged"
+        )
 
-            if not triggers and repeat_interval:
-                logging.info(
-                    f"Executing routine '{routine['name']}' immediately with repeat interval {repeat_interval}"
-                )
+    def update_routine(self, routine):
+        """Applies a single created or updated routine."""
+        routine_id = routine.get("uuid")
+        if not routine_id:
+            return
+        previous = self.routines.get(routine_id)
+        if previous is not None and not routine_changed(previous, routine):
+            return
+        self.compile_routine_expression(routine_id, routine)
+        self.routines[routine_id] = self.replace_routine(routine_id, routine, previous)
+        self.snapshot.mark_dirty()
 
-                trigger_time = datetime.datetime.now()
-                task = asyncio.create_task(self.schedule_routine(routine, trigger_time))
-                task.add_done_callback(
-                    self.scheduled_tasks.discard
-                )  # Discard task when done
-                self.scheduled_tasks.add(task)
-                continue
+    def remove_routine(self, routine_id):
+        if routine_id in self.routines:
+            self.unregister_routine(routine_id)
+            del self.routines[routine_id]
+            self.snapshot.mark_dirty()
+        self.expressions.unregister((EXPRESSION_CONDITION, routine_id))
 
-            trigger_list = triggers.split(",") if triggers else []
+    def update_action(self, action):
+        """Applies a single created or updated action; routines look actions up when they run."""
+        action_id = action.get("uuid")
+        if action_id:
+            self.actions[action_id] = action
+            self.compile_action_expression(action_id, action)
+            self.snapshot.mark_dirty()
 
-            for trigger in trigger_list:
-                try:
-                    trigger = trigger.strip()
-                    if "T" in trigger:  # ISO datetime
-                        trigger_time = datetime.datetime.fromisoformat(trigger)
-                    else:  # Time format HH:MM[:SS] (UTC)
-                        now = datetime.datetime.now()
-                        time_parts = list(map(float, trigger.split(":")))
-                        hours, minutes = time_parts[0], time_parts[1]
-                        seconds = time_parts[2] if len(time_parts) > 2 else 0
-                        trigger_time = now.replace(
-                            hour=int(hours),
-                            minute=int(minutes),
-                            second=int(seconds),
-                            microsecond=int((seconds % 1) * 1_000_000),
-                        )
+    def remove_action(self, action_id):
+        if self.actions.pop(action_id, None) is not None:
+            self.snapshot.mark_dirty()
+        self.expressions.unregister((EXPRESSION_PARAMS, action_id))
 
-                        if trigger_time <= now:
-                            trigger_time += datetime.timedelta(days=1)
+    def replace_routine(self, routine_id, routine, previous=None):
+        """Swaps out a routine's registrations, carrying over its run_count."""
+        if previous is not None:
+            self.unregister_routine(routine_id)
+        routine["run_count"] = previous.get("run_count", 0) if previous else 0
+        self.register_routine(routine_id, routine)
+        return routine
 
-                    logging.info(
-                        f"Scheduling routine '{routine['name']}' at {trigger_time}"
-                    )
-                    task = asyncio.create_task(
-                        self.schedule_routine(routine, trigger_time)
+    def unregister_routine(self, routine_id):
+        """Removes the routine's timers and event trigger index entries."""
+        for key in self.routine_timers.pop(routine_id, ()):
+            self.scheduler.remove(key)
+        for key in self.routine_event_triggers.pop(routine_id, ()):
+            self.event_triggers.remove(key)
+
+    def register_routine(self, routine_id, routine):
+        timers = self.routine_timers.setdefault(routine_id, set())
+        event_triggers = self.routine_event_triggers.setdefault(routine_id, set())
+        triggers = routine.get("triggers", "")
+        repeat_interval = routine.get("repeat_interval")
+
+        if not triggers and repeat_interval:
+            logging.info(
+                f"Executing routine '{routine['name']}' immediately with repeat interval {repeat_interval}"
+            )
+
+            trigger_time = datetime.datetime.now()
+            key = (routine_id, repeat_interval)
+            self.schedule_routine(key, routine, trigger_time)
+            timers.add(key)
+            return
+
+        specs = routine.get("trigger_specs")
+        if specs is None:
+            # Not parsed by the backend (e.g. invalid, or saved before trigger_specs existed)
+            self.register_legacy_triggers(routine_id, routine, triggers)
+            return
+
+        for index, spec in enumerate(specs):
+            key = (routine_id, index)
+            try:
+                if spec["type"] == TRIGGER_EVENT:
+                    self.event_triggers.add(
+                        key,
+                        routine_id,
+                        EventTrigger(
+                            spec["action"],
+                            spec.get("src"),
+                            spec.get("dest") or "",
+                            [(tuple(path), value) for path, value in spec["body"]],
+                        ),
                     )
-                    task.add_done_callback(
-                        self.scheduled_tasks.discard
-                    )  # Discard task when done
-                    self.scheduled_tasks.add(task)
-
-                except ValueError:
-                    action_type = trigger
-                    if action_type not in self.action_type_map:
-                        self.action_type_map[action_type] = []
-                    self.action_type_map[action_type].append(routine)
+                    event_triggers.add(key)
                     logging.info(
-                        f"Registered routine '{routine['name']}' for action type '{action_type}'"
+                        f"Registered routine '{routine['name']}' for event trigger {spec}"
                     )
+                    continue
+
+                if spec["type"] == TRIGGER_AT:
+                    trigger_time = datetime.datetime.fromisoformat(spec["at"])
+                elif spec["type"] == TRIGGER_TIME:
+                    trigger_time = self.get_time_of_day(spec["time"])
+                elif spec["type"] == TRIGGER_CRON:
+                    trigger_time = next_cron_fire(spec, datetime.datetime.now())
+                else:
+                    raise ValueError(f"unknown trigger type '{spec['type']}'")
+            except Exception as e:
+                logging.error(f"Invalid trigger for '{routine['name']}': {spec}, {e}")
+                continue
+
+            logging.info(f"Scheduling routine '{routine['name']}' at {trigger_time}")
+            self.schedule_routine(key, routine, trigger_time, spec)
+            timers.add(key)
+
+    def get_time_of_day(self, trigger):
+        """Next occurrence of a `HH:MM[:SS]` time of day."""
+        now = datetime.datetime.now()
+        time_parts = list(map(float, trigger.split(":")))
+        hours, minutes = time_parts[0], time_parts[1]
+        seconds = time_parts[2] if len(time_parts) > 2 else 0
+        trigger_time = now.replace(
+            hour=int(hours),
+            minute=int(minutes),
+            second=int(seconds),
+            microsecond=int((seconds % 1) * 1_000_000),
+        )
+
+        if trigger_time <= now:
+            trigger_time += datetime.timedelta(days=1)
+        return trigger_time
+
+    def register_legacy_triggers(self, routine_id, routine, triggers):
+        """Parses the raw comma-separated `triggers` string (ISO datetimes, times, actions)."""
+        timers = self.routine_timers[routine_id]
+        event_triggers = self.routine_event_triggers[routine_id]
+        trigger_list = triggers.split(",") if triggers else []
+
+        for trigger in trigger_list:
+            try:
+                trigger = trigger.strip()
+                if "T" in trigger:  # ISO datetime
+                    trigger_time = datetime.datetime.fromisoformat(trigger)
+                else:  # Time format HH:MM[:SS] (UTC)
+                    trigger_time = self.get_time_of_day(trigger)
+
+                logging.info(
+                    f"Scheduling routine '{routine['name']}' at {trigger_time}"
+                )
+                key = (routine_id, trigger)
+                self.schedule_routine(key, routine, trigger_time)
+                timers.add(key)
+
+            except ValueError:
+                try:
+                    event_trigger = EventTrigger.parse(trigger)
+                except ValueError as e:
+                    logging.error(f"Invalid trigger for '{routine['name']}': {e}")
+                    continue
+                key = (routine_id, trigger)
+                self.event_triggers.add(key, routine_id, event_trigger)
+                event_triggers.add(key)
+                logging.info(
+                    f"Registered routine '{routine['name']}' for event trigger '{trigger}'"
+                )
 
     async def handle_message(self, message):
-        """Handles incoming messages by looking up routines registered for the given action type."""
+        """Runs the routines whose event triggers match the message, concurrently up to ROUTINE_EVENT_CONCURRENCY."""
         try:
-            # Parse JSON data and extract action
-            data = json.loads(message)
+            envelope = Envelope.wrap(message)
+            if not envelope.valid:
+                logging.warning("Received an invalid JSON message; ignoring.")
+                return
 
             # Check if data is a dictionary with an "action" key
+            data = envelope.data
             if not isinstance(data, dict) or "action" not in data:
                 logging.warning("Received a message without an 'action'; ignoring.")
                 return
 
             action_type = data.get("action")
-            if action_type in self.action_type_map:
-                routines = self.action_type_map[action_type]
-                logging.info(
-                    f"Handling {len(routines)} routines for action {action_type}"
-                )
-                for routine in routines:
-                    await self.handle_action(routine)
-            else:
+            if not self.event_triggers.has_action(action_type):
                 logging.info(f"No routines registered for action type '{action_type}'")
-        except json.JSONDecodeError:
-            logging.warning("Received an invalid JSON message; ignoring.")
+                return
+
+            # Only routines whose trigger filters match this message are considered
+            routine_ids = self.event_triggers.match(data)
+            logging.info(
+                f"Handling {len(routine_ids)} routines for action {action_type}"
+            )
+            await asyncio.gather(
+                *[
+                    self.handle_triggered_action(self.routines[routine_id], data)
+                    for routine_id in routine_ids
+                    if routine_id in self.routines
+                ]
+            )
         except Exception as e:
             logging.error(f"Error handling message: {e}")
+
+    async def handle_triggered_action(self, routine, message):
+        async with self.event_semaphore:
+            try:
+                await self.handle_action(routine, message)
+            except Exception as e:
+                logging.error(f"Error handling routine '{routine['name']}': {e}")
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+ROUTINE_SNAPSHOT_FILE_PATH = os.getenv(
+    "ROUTINE_SNAPSHOT_FILE_PATH", "routine_snapshot.json"
+)
+ROUTINE_SNAPSHOT_INTERVAL_S = float(os.getenv("ROUTINE_SNAPSHOT_INTERVAL_S", 5))
+
+SNAPSHOT_VERSION = 1
+
+
+class RoutineSnapshot:
+    """
+    Local copy of the routine schedule, so a restart restores it without reaching Django:
+
+    {
+        "version": 1,
+        "saved_at": epoch seconds,
+        "routines": {UUID: routine},  // including run_count
+        "actions": {UUID: action},
+        "timers": [[routine UUID, trigger key, fire_at epoch seconds], ...]
+    }
+
+    Writes are deferred: `mark_dirty` flags a change and the flusher saves at most once
+    per interval, atomically (temp file, then rename), like the resource cache. Fired
+    timers are the exception: RoutineManager flushes as soon as one is rescheduled.
+    """
+
+    def __init__(
+        self,
+        build,
+        file_path=ROUTINE_SNAPSHOT_FILE_PATH,
+        flush_interval_s=ROUTINE_SNAPSHOT_INTERVAL_S,
+    ):
+        self.build = build  # Returns the current snapshot contents
+        self.file_path = file_path
+        self.flush_interval_s = flush_interval_s
+        self.dirty = False
+
+    def load(self):
+        """Returns the saved snapshot, or None if there is none or it cannot be read."""
+        if not os.path.exists(self.file_path):
+            return None
+        try:
+            with open(self.file_path, "r") as file:
+                snapshot = json.load(file)
+        except Exception as e:
+            logging.error(f"Error reading routine snapshot {self.file_path}: {e}")
+            return None
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SNAPSHOT_VERSION
+        ):
+            logging.warning("Ignoring routine snapshot with an unknown format")
+            return None
+        return snapshot
+
+    def save(self):
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            **self.build(),
+        }
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.file_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def flush(self):
+        """Saves pending changes immediately, if any (e.g. on shutdown)."""
+        if self.dirty:
+            self.save()
+
+    async def run_flusher(self):
+        """Background task saving the snapshot at most once per flush interval."""
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error saving routine snapshot: {e}")
@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 4))
+
+
+class Scheduler:
+    """
+    Runs callbacks at wall-clock times from a single min-heap of deadlines.
+
+    One dispatcher task sleeps until the earliest deadline and hands due callbacks to a
+    bounded pool of workers, so the number of sleeping tasks does not grow with the number
+    of timers. Add and reschedule cost O(log n); removal marks the heap entry dead
+    (O(1)) and it is discarded when it reaches the top.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.workers = workers
+        self.heap = []  # [fire_at, seq, key, callback]; callback None once removed
+        self.entries = {}  # key -> live heap entry
+        self.sequence = itertools.count()  # Tie-breaker so keys are never compared
+        self.changed = asyncio.Event()
+        self.due = asyncio.Queue()
+        self.stats = {"scheduled": 0, "fired": 0, "errors": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get_stats(self):
+        return {**self.stats, "timers": len(self.entries), "heap": len(self.heap)}
+
+    def get_fire_at(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def schedule(self, key, fire_at, callback):
+        """Schedules (or reschedules) `callback()` for epoch time `fire_at`."""
+        self.remove(key)
+        entry = [fire_at, next(self.sequence), key, callback]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        self.stats["scheduled"] += 1
+        # Wake the dispatcher only if the earliest deadline moved
+        if self.heap[0] is entry:
+            self.changed.set()
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            entry[-1] = None
+
+    def clear(self):
+        for entry in self.entries.values():
+            entry[-1] = None
+        self.entries.clear()
+        self.heap.clear()
+        self.changed.set()
+
+    def pop_due(self, now):
+        """Pops every live entry due at `now`, dropping dead entries on the way."""
+        due = []
+        while self.heap and (self.heap[0][-1] is None or self.heap[0][0] <= now):
+            fire_at, _, key, callback = heapq.heappop(self.heap)
+            if callback is None:
+                continue
+            del self.entries[key]
+            due.append((key, callback))
+        return due
+
+    async def run(self):
+        """Runs the dispatcher and workers until cancelled."""
+        workers = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        try:
+            await self.dispatch()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def dispatch(self):
+        while True:
+            self.changed.clear()
+            for item in self.pop_due(time.time()):
+                self.due.put_nowait(item)
+
+            timeout = None
+            if self.heap:
+                timeout = max(0.0, self.heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def work(self):
+        while True:
+            key, callback = await self.due.get()
+            self.stats["fired"] += 1
+            try:
+                await callback()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(f"Error running scheduled callback {key}: {e}")
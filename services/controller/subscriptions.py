@@ -0,0 +1,124 @@
+import re
+
+UUID_SEGMENT = re.compile(r"^[0-9a-fA-F-]{36}$")
+
+# Subscribe frame body keys
+FILTER_DEVICES = "devices"
+FILTER_LOCATIONS = "locations"
+FILTER_ACTIONS = "actions"
+FILTER_DEST_PREFIXES = "dest_prefixes"
+
+FILTER_KEYS = (FILTER_DEVICES, FILTER_LOCATIONS, FILTER_ACTIONS, FILTER_DEST_PREFIXES)
+
+
+def parse_filters(body):
+    """Validates a subscribe frame body into {filter key: set of strings}."""
+    if not isinstance(body, dict):
+        raise ValueError("Subscribe body must be an object")
+    filters = {}
+    for key in FILTER_KEYS:
+        values = body.get(key) or []
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, list) or not all(
+            isinstance(value, str) and value for value in values
+        ):
+            raise ValueError(f"'{key}' must be a list of non-empty strings")
+        filters[key] = set(values)
+    if not any(filters.values()):
+        raise ValueError(
+            f"Subscribe body needs at least one of {', '.join(FILTER_KEYS)}"
+        )
+    return filters
+
+
+def message_devices(envelope):
+    """Device UUIDs a message is about: its `src` and any UUID segments of its `dest`."""
+    devices = set()
+    src = envelope.get("src")
+    if isinstance(src, str) and src:
+        devices.add(src)
+    dest = envelope.get("dest")
+    if isinstance(dest, str):
+        devices.update(
+            segment for segment in dest.split("/") if UUID_SEGMENT.match(segment)
+        )
+    return devices
+
+
+class SubscriptionIndex:
+    """
+    Inverted index from filter values to subscribed clients.
+
+    A client receives a message if any of its filters match (device UUID, the device's
+    location, action type or `dest` prefix). Matching costs one dict lookup per message
+    field plus one per distinct prefix length, independent of the number of clients.
+    """
+
+    def __init__(self, location_getter=None):
+        self.location_getter = location_getter  # device UUID -> location UUID or None
+        self.filters = {}  # client -> filters
+        self.index = {key: {} for key in FILTER_KEYS}  # key -> value -> set of clients
+        self.prefix_lengths = {}  # dest prefix length -> number of prefixes
+
+    def __contains__(self, client):
+        return client in self.filters
+
+    def __len__(self):
+        return len(self.filters)
+
+    def subscribe(self, client, filters):
+        """Replaces the client's filters."""
+        self.unsubscribe(client)
+        self.filters[client] = filters
+        for key, values in filters.items():
+            for value in values:
+                self.index[key].setdefault(value, set()).add(client)
+                if key == FILTER_DEST_PREFIXES and len(self.index[key][value]) == 1:
+                    length = len(value)
+                    self.prefix_lengths[length] = self.prefix_lengths.get(length, 0) + 1
+
+    def unsubscribe(self, client):
+        filters = self.filters.pop(client, None)
+        if not filters:
+            return
+        for key, values in filters.items():
+            for value in values:
+                clients = self.index[key].get(value)
+                if clients is None:
+                    continue
+                clients.discard(client)
+                if clients:
+                    continue
+                del self.index[key][value]
+                if key == FILTER_DEST_PREFIXES:
+                    length = len(value)
+                    self.prefix_lengths[length] -= 1
+                    if not self.prefix_lengths[length]:
+                        del self.prefix_lengths[length]
+
+    def match(self, envelope):
+        """Returns the subscribed clients interested in the message."""
+        matched = set()
+        if not self.filters:
+            return matched
+
+        action = envelope.get("action")
+        if isinstance(action, str):
+            matched |= self.index[FILTER_ACTIONS].get(action, set())
+
+        by_location = self.index[FILTER_LOCATIONS]
+        for device_id in message_devices(envelope):
+            matched |= self.index[FILTER_DEVICES].get(device_id, set())
+            if by_location and self.location_getter:
+                location = self.location_getter(device_id)
+                if location:
+                    matched |= by_location.get(location, set())
+
+        dest = envelope.get("dest")
+        if isinstance(dest, str):
+            by_prefix = self.index[FILTER_DEST_PREFIXES]
+            for length in self.prefix_lengths:
+                if length <= len(dest):
+                    matched |= by_prefix.get(dest[:length], set())
+        return matched
@@ -0,0 +1,82 @@
+import unittest
+
+from expressions import ExpressionEngine, UnsafeExpressionError, MAX_REPEAT_LENGTH
+
+
+class ExpressionValidationTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = ExpressionEngine()
+
+    def assertRejected(self, source):
+        with self.assertRaises(UnsafeExpressionError):
+            self.engine.compile(source)
+
+    def test_rejects_dunder_attributes(self):
+        self.assertRejected("().__class__")
+        self.assertRejected("message.__class__.__mro__")
+        self.assertRejected("datetime.datetime.__subclasses__()")
+        self.assertRejected("message._private")
+
+    def test_rejects_dunder_and_unknown_names(self):
+        self.assertRejected("__import__('os')")
+        self.assertRejected("__builtins__")
+        self.assertRejected("open('/etc/passwd')")
+        self.assertRejected("eval('1')")
+        self.assertRejected("getattr(message, 'x')")
+
+    def test_rejects_calls_reaching_attributes_through_format_strings(self):
+        self.assertRejected("'{0.__class__}'.format(message)")
+        self.assertRejected("'{x}'.format_map(message)")
+
+    def test_rejects_constructs_outside_the_whitelist(self):
+        self.assertRejected("(lambda: 1)()")
+        self.assertRejected("[x for x in message]")
+        self.assertRejected("(x := 1)")
+
+    def test_rejects_large_exponents(self):
+        self.assertRejected("9 ** 9 ** 9")
+        self.assertRejected("2 ** message")
+
+    def test_register_reports_rejection(self):
+        self.assertFalse(self.engine.register("routine", "().__class__"))
+        self.assertFalse(self.engine.is_registered("routine"))
+
+
+class ExpressionEvaluationTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = ExpressionEngine()
+
+    def evaluate(self, source, **variables):
+        self.assertTrue(self.engine.register("routine", source))
+        return self.engine.evaluate("routine", **variables)
+
+    def test_evaluates_whitelisted_expressions(self):
+        message = {"body": {"is_on": True, "temperature_c": 21.5}}
+        self.assertTrue(self.evaluate("message['body']['is_on']", message=message))
+        self.assertEqual(
+            self.evaluate(
+                "round(message['body']['temperature_c'] * 2)", message=message
+            ),
+            43,
+        )
+        self.assertEqual(self.evaluate("'ab' * 3"), "ababab")
+        self.assertEqual(self.evaluate("[0] * 4"), [0, 0, 0, 0])
+
+    def test_bounds_sequence_repeats(self):
+        for source in (
+            "[0] * 10 ** 9",
+            "10 ** 9 * 'x'",
+            "(1, 2) * 10 ** 6",
+            f"[[0] * 100] * {MAX_REPEAT_LENGTH}",
+        ):
+            with self.subTest(source=source):
+                with self.assertRaises(UnsafeExpressionError):
+                    self.evaluate(source)
+
+    def test_bounds_repeats_of_variables(self):
+        with self.assertRaises(UnsafeExpressionError):
+            self.evaluate("message['items'] * 10 ** 6", message={"items": [1, 2]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+
+from pipeline import (
+    Pipeline,
+    Sink,
+    OVERFLOW_BLOCK,
+    OVERFLOW_COALESCE,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+)
+
+
+async def noop(*args):
+    pass
+
+
+class SinkOverflowTests(unittest.IsolatedAsyncioTestCase):
+    def queued(self, sink):
+        return list(sink.pending.values())
+
+    async def test_drop_oldest_evicts_the_oldest_item(self):
+        sink = Sink("test", noop, maxsize=2, overflow=OVERFLOW_DROP_OLDEST)
+        for item in ("a", "b", "c"):
+            self.assertTrue(sink.submit(item))
+        self.assertEqual(self.queued(sink), [("b",), ("c",)])
+        self.assertEqual(sink.get_stats()["dropped"], 1)
+
+    async def test_drop_newest_rejects_the_new_item(self):
+        sink = Sink("test", noop, maxsize=2, overflow=OVERFLOW_DROP_NEWEST)
+        results = [sink.submit(item) for item in ("a", "b", "c")]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(self.queued(sink), [("a",), ("b",)])
+        self.assertEqual(sink.get_stats()["dropped"], 1)
+
+    async def test_block_waits_for_space(self):
+        sink = Sink("test", noop, maxsize=1, overflow=OVERFLOW_BLOCK)
+        await sink.put("a")
+        blocked = asyncio.create_task(sink.put("b"))
+        await asyncio.sleep(0)
+        self.assertFalse(blocked.done())
+
+        worker = asyncio.create_task(sink.work())
+        self.assertTrue(await asyncio.wait_for(blocked, 1))
+        worker.cancel()
+        self.assertEqual(sink.get_stats()["dropped"], 0)
+
+    async def test_block_submit_drops_when_full(self):
+        sink = Sink("test", noop, maxsize=1, overflow=OVERFLOW_BLOCK)
+        self.assertTrue(sink.submit("a"))
+        self.assertFalse(sink.submit("b"))
+        self.assertEqual(sink.get_stats()["dropped"], 1)
+
+    async def test_coalesce_replaces_the_queued_item_with_the_same_key(self):
+        sink = Sink(
+            "test",
+            noop,
+            maxsize=2,
+            overflow=OVERFLOW_COALESCE,
+            key=lambda device, value: device,
+        )
+        sink.submit("plug", 1)
+        sink.submit("light", 1)
+        sink.submit("plug", 2)
+        self.assertEqual(self.queued(sink), [("plug", 2), ("light", 1)])
+        self.assertEqual(sink.get_stats()["coalesced"], 1)
+
+        # Nothing to replace, so the oldest item goes
+        sink.submit("dial", 1)
+        self.assertEqual(self.queued(sink), [("light", 1), ("dial", 1)])
+        self.assertEqual(sink.get_stats()["dropped"], 1)
+
+    def test_coalesce_requires_a_key(self):
+        with self.assertRaises(ValueError):
+            Sink("test", noop, overflow=OVERFLOW_COALESCE)
+
+
+class SinkWorkerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_items_with_the_same_key_are_handled_in_order(self):
+        handled, release = [], asyncio.Event()
+
+        async def handler(device, value):
+            if value == 1:
+                await release.wait()
+            handled.append((device, value))
+
+        pipeline = Pipeline(overrides={})
+        sink = pipeline.add_sink(
+            "test",
+            handler,
+            workers=4,
+            overflow=OVERFLOW_COALESCE,
+            key=lambda device, value: device,
+        )
+        runner = asyncio.create_task(pipeline.run())
+        sink.submit("plug", 1)
+        await asyncio.sleep(0.01)
+        # The first write is still in progress; the second must wait for it
+        sink.submit("plug", 2)
+        sink.submit("light", 1)
+        await asyncio.sleep(0.01)
+        self.assertEqual(handled, [])
+
+        release.set()
+        await asyncio.sleep(0.01)
+        runner.cancel()
+        self.assertLess(handled.index(("plug", 1)), handled.index(("plug", 2)))
+        self.assertEqual(len(handled), 3)
+        self.assertEqual(sink.get_stats()["processed"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
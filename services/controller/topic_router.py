@@ -0,0 +1,132 @@
+import re
+from collections import OrderedDict
+
+TOPIC_ROUTER_CACHE_SIZE = 1024
+
+# Typed capture segments, e.g. `{device_id:uuid}`
+SEGMENT_TYPES = {
+    "uuid": re.compile(r"^[0-9a-fA-F-]{36}$"),
+    "int": re.compile(r"^-?\d+$"),
+    "str": re.compile(r"^.+$"),
+}
+
+CAPTURE_PATTERN = re.compile(r"^\{(\w+)(?::(\w+))?\}$")
+
+
+class Node:
+    __slots__ = ("literals", "captures", "plus", "hash_value", "value")
+
+    def __init__(self):
+        self.literals = {}  # segment -> Node
+        self.captures = []  # [(name, compiled type, Node)]
+        self.plus = None  # Node for `+`
+        self.hash_value = None  # value registered with a trailing `#`
+        self.value = None  # value registered ending at this node
+
+
+class TopicRouter:
+    """
+    Routes MQTT-style topics (`a/b/c`) to registered values using a trie keyed on segments.
+
+    Pattern segments may be literals, `+` (any one segment), a trailing `#` (any remaining
+    segments) or typed captures such as `{device_id:uuid}` / `{name}`, whose values are
+    returned with the match. Resolution costs O(topic depth) and is memoized per exact topic.
+    More specific segments win: literal, then typed capture, then `+`, then `#`.
+    """
+
+    def __init__(self, cache_size=TOPIC_ROUTER_CACHE_SIZE):
+        self.root = Node()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # topic -> (value, captures) or None
+
+    def register(self, pattern, value):
+        node = self.root
+        segments = pattern.split("/")
+        for index, segment in enumerate(segments):
+            if segment == "#":
+                if index != len(segments) - 1:
+                    raise ValueError(f"'#' must be the last segment: {pattern}")
+                node.hash_value = value
+                self.cache.clear()
+                return
+            if segment == "+":
+                node.plus = node.plus or Node()
+                node = node.plus
+                continue
+            capture = CAPTURE_PATTERN.match(segment)
+            if capture:
+                name, segment_type = capture.group(1), capture.group(2) or "str"
+                if segment_type not in SEGMENT_TYPES:
+                    raise ValueError(
+                        f"Unknown segment type '{segment_type}': {pattern}"
+                    )
+                compiled = SEGMENT_TYPES[segment_type]
+                for existing_name, existing_type, child in node.captures:
+                    if existing_name == name and existing_type is compiled:
+                        node = child
+                        break
+                else:
+                    child = Node()
+                    node.captures.append((name, compiled, child))
+                    node = child
+                continue
+            node = node.literals.setdefault(segment, Node())
+        node.value = value
+        self.cache.clear()
+
+    def resolve(self, topic):
+        """Returns `(value, captures)` for the best match of `topic`, or None."""
+        if topic in self.cache:
+            self.cache.move_to_end(topic)
+            return self.cache[topic]
+
+        result = self._match(self.root, topic.split("/"), 0, {})
+        self.cache[topic] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def _match(self, node, segments, index, captures):
+        if index == len(segments):
+            if node.value is not None:
+                return node.value, captures
+            if node.hash_value is not None:
+                return node.hash_value, captures
+            return None
+
+        segment = segments[index]
+        child = node.literals.get(segment)
+        if child:
+            result = self._match(child, segments, index + 1, captures)
+            if result:
+                return result
+        for name, compiled, child in node.captures:
+            if compiled.match(segment):
+                result = self._match(
+                    child, segments, index + 1, {**captures, name: segment}
+                )
+                if result:
+                    return result
+        if node.plus:
+            result = self._match(node.plus, segments, index + 1, captures)
+            if result:
+                return result
+        if node.hash_value is not None:
+            return node.hash_value, captures
+        return None
+
+    def patterns(self):
+        """Yields every registered pattern as an MQTT subscription (captures become `+`)."""
+        stack = [(self.root, [])]
+        while stack:
+            node, path = stack.pop()
+            if node.value is not None:
+                yield "/".join(path)
+            if node.hash_value is not None:
+                yield "/".join(path + ["#"])
+            for segment, child in node.literals.items():
+                stack.append((child, path + [segment]))
+            for _, _, child in node.captures:
+                stack.append((child, path + ["+"]))
+            if node.plus:
+                stack.append((node.plus, path + ["+"]))
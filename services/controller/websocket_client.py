@@ -1,19 +1,55 @@
 import os
 import logging
 import asyncio
+import random
+from collections import deque
 import websockets
+from envelope import Envelope
+from metrics import MESSAGES_OUT
 
 HOME_HOST = os.getenv("HOME_HOST")
 HOME_PORT = os.getenv("HOME_PORT")
 
+# Messages kept while disconnected; the oldest are dropped beyond this
+WS_SEND_BUFFER_SIZE = int(os.getenv("WS_SEND_BUFFER_SIZE", 1000))
+# Batching packs messages sent within the window into one JSON array frame; 0 disables it
+WS_BATCH_WINDOW_S = float(os.getenv("WS_BATCH_WINDOW_S", 0))
+WS_BATCH_MAX_MESSAGES = int(os.getenv("WS_BATCH_MAX_MESSAGES", 50))
+# Reconnect backoff: a random delay up to min(max, base * 2^attempt)
+WS_RECONNECT_BASE_S = float(os.getenv("WS_RECONNECT_BASE_S", 0.5))
+WS_RECONNECT_MAX_S = float(os.getenv("WS_RECONNECT_MAX_S", 30))
+# Keepalive pings; a missing pong closes the connection, which feeds liveness detection
+WS_PING_INTERVAL_S = float(os.getenv("WS_PING_INTERVAL_S", 20))
+WS_PING_TIMEOUT_S = float(os.getenv("WS_PING_TIMEOUT_S", 20))
+
 logging.basicConfig(level=logging.INFO)
 
 
 class WebsocketClient:
-    def __init__(self, on_message, token_getter):
+    def __init__(self, on_message, token_getter, on_connection_change=None):
         self.get_token = token_getter
         self.on_message = on_message
+        self.on_connection_change = on_connection_change  # (connected) -> None
         self.websocket = None
+        self.buffer = deque()  # (text, is JSON) waiting to be sent, oldest first
+        self.has_items = asyncio.Event()
+        self.attempt = 0  # Consecutive failed connects
+        self.unbatched = 0  # Messages to send one per frame after a failed batch
+        self.stats = {
+            "sent": 0,
+            "frames": 0,
+            "dropped": 0,
+            "errors": 0,
+            "reconnects": 0,
+        }
+
+    def get_stats(self):
+        return {**self.stats, "buffered": len(self.buffer)}
+
+    def get_reconnect_delay(self):
+        """Exponential backoff with full jitter."""
+        ceiling = min(WS_RECONNECT_MAX_S, WS_RECONNECT_BASE_S * 2**self.attempt)
+        return random.uniform(0, ceiling)
 
     async def connect(self):
         while 1:
@@ -22,8 +58,15 @@ class WebsocketClient:
                 await self._connect(token)
             except Exception as e:
                 logging.error(f"Websocket connect error: {e}")
-                await asyncio.sleep(1)
-                logging.warn("Attempting to reconnect to WebSocket server...")
+            self.websocket = None
+            self.notify_connection_change(False)
+            delay = self.get_reconnect_delay()
+            self.attempt += 1
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(delay)
+            logging.warning(
+                f"Attempting to reconnect to WebSocket server after {delay:.2f}s..."
+            )
 
     async def _connect(self, token):
         uri = f"ws://{HOME_HOST}:{HOME_PORT}/ws/controllers?token={token}"
@@ -33,22 +76,101 @@ class WebsocketClient:
 
         logging.info(f"Connecting to uri: {uri}")
 
-        self.websocket = await websockets.connect(uri, additional_headers=headers)
+        self.websocket = await websockets.connect(
+            uri,
+            additional_headers=headers,
+            ping_interval=WS_PING_INTERVAL_S,
+            ping_timeout=WS_PING_TIMEOUT_S,
+        )
+        self.attempt = 0
+        self.notify_connection_change(True)
         logging.info(f"Connected to WebSocket server: {uri}")
-        await self.receive_messages()  # Start receiving messages
+
+        # Drain whatever was buffered while disconnected, then keep sending
+        sender = asyncio.create_task(self.send_buffered(self.websocket))
+        try:
+            await self.receive_messages()  # Start receiving messages
+        finally:
+            sender.cancel()
+
+    def notify_connection_change(self, connected):
+        if self.on_connection_change:
+            try:
+                self.on_connection_change(connected)
+            except Exception as e:
+                logging.error(f"Error notifying websocket connection change: {e}")
 
     async def receive_messages(self):
         try:
             async for message in self.websocket:
                 logging.info(f"Received message: {message}")
-                self.on_message(message)  # Call the provided callback
+                await self.on_message(message)  # Call the provided callback
         except Exception as e:
             logging.error(f"Error receiving message: {e}")
             raise e
 
     async def send(self, message):
-        logging.info(f"Sending websocket message: {message}")
-        try:
-            await self.websocket.send(message)
-        except Exception as e:
-            logging.error(f"Error sending websocket message: {e}")
+        """Buffers the message (an Envelope or text); it is sent as soon as a connection is available."""
+        logging.info(f"Queueing websocket message: {message}")
+        envelope = Envelope.wrap(message)
+        if len(self.buffer) >= WS_SEND_BUFFER_SIZE:
+            self.buffer.popleft()
+            self.stats["dropped"] += 1
+            logging.warning("Websocket send buffer full; dropping oldest message")
+        self.buffer.append((envelope.text, envelope.valid))
+        self.has_items.set()
+
+    def take_batch(self):
+        """Messages for the next frame: consecutive JSON texts, or one message on its own."""
+        batch = [self.buffer.popleft()]
+        if self.unbatched:
+            self.unbatched -= 1
+            return batch
+        if WS_BATCH_WINDOW_S <= 0 or not batch[0][1]:
+            return batch
+        # A non-JSON text would corrupt the array frame, so it ends the batch
+        while self.buffer and self.buffer[0][1] and len(batch) < WS_BATCH_MAX_MESSAGES:
+            batch.append(self.buffer.popleft())
+        return batch
+
+    async def send_buffered(self, websocket):
+        while 1:
+            while not self.buffer:
+                self.has_items.clear()
+                await self.has_items.wait()
+            if WS_BATCH_WINDOW_S > 0 and len(self.buffer) < WS_BATCH_MAX_MESSAGES:
+                await asyncio.sleep(WS_BATCH_WINDOW_S)  # Let the batch fill
+
+            batch = self.take_batch()
+            texts = [text for text, _ in batch]
+            # Messages are JSON texts already, so the array is built without re-encoding
+            frame = texts[0] if len(texts) == 1 else f"[{','.join(texts)}]"
+            try:
+                await websocket.send(frame)
+                self.stats["sent"] += len(batch)
+                self.stats["frames"] += 1
+                MESSAGES_OUT.inc("django_ws", amount=len(batch))
+            except asyncio.CancelledError:
+                self.requeue(batch)
+                raise
+            except websockets.ConnectionClosed as e:
+                # Nothing more can go out on this connection; the next one sends the batch
+                logging.error(f"Websocket closed while sending: {e}")
+                self.requeue(batch)
+                return
+            except Exception as e:
+                self.stats["errors"] += 1
+                if len(batch) > 1:
+                    logging.error(f"Error sending websocket batch, retrying: {e}")
+                    self.requeue(batch)
+                    self.unbatched = len(batch)
+                else:
+                    logging.error(f"Dropping unsendable websocket message: {e}")
+                    self.stats["dropped"] += 1
+
+    def requeue(self, batch):
+        """Puts an unsent batch back at the front, ahead of newer messages."""
+        self.buffer.extendleft(reversed(batch))
+        while len(self.buffer) > WS_SEND_BUFFER_SIZE:
+            self.buffer.pop()
+            self.stats["dropped"] += 1
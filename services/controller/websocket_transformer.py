@@ -1,25 +1,27 @@
-import json
-import re
 import logging
+import time
+from envelope import Envelope
+from metrics import TRANSFORMER_LATENCY
+from topic_router import TopicRouter
 
 ACTION_PLUG_SET = "plug__set"
 ACTION_LIGHT_SET = "light__set"
 
 LIGHT_PREFIX = "wled"
 
-import json
-import re
-import logging
-
 
 class WebsocketTransformerRegistry:
     def __init__(self, resource_handler):
         self.transformers = {}
+        self.router = TopicRouter()
         self.resource_handler = resource_handler
 
     def register(self, pattern):
+        """Registers a transformer for a 'dest' pattern (see TopicRouter)."""
+
         def decorator(transformer_callback):
             self.transformers[pattern] = transformer_callback
+            self.router.register(pattern, (pattern, transformer_callback))
             return transformer_callback
 
         return decorator
@@ -30,31 +32,38 @@ class WebsocketTransformerRegistry:
         Transforms the message if a matching transformer exists and returns the transformed
         message and its destination topic. If no transformer is found, the original message and
         'dest' field from the message are returned.
-        :param message: The message string to transform.
+        :param message: The Envelope (or raw message string) to transform.
         :return: (transformed_message, topic) as strings.
         """
         try:
-            # Convert the message string to JSON object for pattern matching on 'dest'
-            message_json = json.loads(message)
-            dest = message_json.get("dest", "")
-            # Check if a transformer exists by matching regex patterns against 'dest'
-            for pattern, transformer in self.transformers.items():
-                if re.match(pattern, dest):
-                    logging.info(f"Applying transformer for pattern: {pattern}")
-                    # Apply the transformer and get the transformed message and destination
-                    return await transformer(message_json, cb)
+            envelope = Envelope.wrap(message)
+            dest = envelope.get("dest", "")
+            # Check if a transformer exists for 'dest'
+            match = self.router.resolve(dest)
+            if match:
+                (pattern, transformer), params = match
+                logging.info(f"Applying transformer for pattern: {pattern}")
+                # Apply the transformer and get the transformed message and destination
+                started = time.perf_counter()
+                try:
+                    return await transformer(envelope, cb, params)
+                finally:
+                    TRANSFORMER_LATENCY.observe(
+                        time.perf_counter() - started, "websocket", pattern
+                    )
             # If no transformer is found, use the original message and topic
             logging.info("No transformer found; consuming as-is")
-            cb(message, dest)
+            cb(envelope.text, dest)
         except Exception as e:
             logging.error(f"Error transforming message: {e}")
 
 
 # Define transformers outside the class, using instance methods to register
 def register_websocket_transformers(registry):
-    @registry.register(r"^plugs/[0-9a-fA-F-]{36}/command$")
-    async def transform_plug_message(message, cb):
+    @registry.register("plugs/{device_id:uuid}/command")
+    async def transform_plug_message(envelope, cb, params):
         logging.info("Transform plug message")
+        message = envelope.data
         action = message["action"]
 
         if action == ACTION_PLUG_SET:
@@ -67,11 +76,12 @@ def register_websocket_transformers(registry):
             cb(transformed, topic)
         else:
             logging.info(f"Leaving plug message as-is for action: {action}")
-            cb(message, message["dest"])
+            cb(envelope.text, message["dest"])
 
-    @registry.register(r"^lights/[0-9a-fA-F-]{36}/command$")
-    async def transform_light_message(message, cb):
+    @registry.register("lights/{device_id:uuid}/command")
+    async def transform_light_message(envelope, cb, params):
         logging.info("Transforming light message")
+        message = envelope.data
         action = message["action"]
 
         if action == ACTION_LIGHT_SET:
@@ -99,4 +109,4 @@ def register_websocket_transformers(registry):
 
         else:
             logging.info(f"Leaving plug message as-is for action: {action}")
-            cb(message, message["dest"])
+            cb(envelope.text, message["dest"])
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+
+
+def parse_windows(value):
+    """Parses `action=seconds,action=seconds` into a dict."""
+    windows = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            action, seconds = item.split("=", 1)
+            windows[action.strip()] = float(seconds)
+    return windows
+
+
+# Per action type debounce windows; actions not listed are written immediately
+COALESCE_WINDOWS_S = parse_windows(
+    os.getenv(
+        "COALESCE_WINDOWS_S",
+        "system__status=5,environmental__status=5,plug__status=1,dial__status=5",
+    )
+)
+
+
+class WriteCoalescer:
+    """
+    Debounces status writes per resource. Within an action type's window only the latest
+    value of each field is kept, and when the window closes every pending resource for that
+    action is written at once (one bulk request, or a plain PUT for a single resource).
+    This caps backend write rate no matter how often devices report.
+    """
+
+    def __init__(self, resource_handler, windows=COALESCE_WINDOWS_S):
+        self.resource_handler = resource_handler
+        self.windows = windows
+        self.pending = {}  # action -> (resource_type, resource_id) -> merged body
+        self.timers = {}  # action -> flush task
+        self.stats = {"submitted": 0, "flushed": 0}
+
+    async def put(self, action, resource_type, resource_id, data):
+        """Queues a PUT, merging it into any pending write for the same resource."""
+        self.stats["submitted"] += 1
+        window = self.windows.get(action, 0)
+        if window <= 0:
+            self.stats["flushed"] += 1
+            return await self.resource_handler.handle_request(
+                "PUT", f"{resource_type}/{resource_id}", data
+            )
+
+        pending = self.pending.setdefault(action, {})
+        pending.setdefault((resource_type, resource_id), {}).update(data)
+        if action not in self.timers:
+            self.timers[action] = asyncio.create_task(self.flush_after(action, window))
+
+    async def flush_after(self, action, window):
+        try:
+            await asyncio.sleep(window)
+        finally:
+            self.timers.pop(action, None)
+        await self.flush(action)
+
+    async def flush(self, action):
+        pending = self.pending.pop(action, None)
+        if not pending:
+            return
+        self.stats["flushed"] += len(pending)
+        try:
+            if len(pending) == 1:
+                ((resource_type, resource_id), data) = next(iter(pending.items()))
+                await self.resource_handler.handle_request(
+                    "PUT", f"{resource_type}/{resource_id}", data
+                )
+            else:
+                await self.resource_handler.bulk_update(
+                    [
+                        {"type": resource_type, "uuid": resource_id, "fields": data}
+                        for (resource_type, resource_id), data in pending.items()
+                    ]
+                )
+        except Exception as e:
+            logging.error(f"Error flushing {len(pending)} writes for {action}: {e}")
+
+    async def flush_all(self):
+        """Writes everything pending immediately (e.g. on shutdown)."""
+        for task in list(self.timers.values()):
+            task.cancel()
+        self.timers.clear()
+        await asyncio.gather(*[self.flush(action) for action in list(self.pending)])
@@ -40,6 +40,13 @@ class ControllerConsumer(JsonWebsocketConsumer):
             content = json.loads(text_data)
             if isinstance(content, dict):
                 self.receive_json(content)
+            elif isinstance(content, list):
+                # Controllers may batch several messages into one JSON array frame
+                for item in content:
+                    if isinstance(item, dict):
+                        self.receive_json(item)
+                    else:
+                        logging.error(f"Batched JSON content is not a dict: {item}")
             else:
                 raise ValueError(f"JSON content is not a dict: {content}")
         except json.JSONDecodeError:
@@ -1,3 +1,109 @@
-from django.test import TestCase
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.db.models.query import QuerySet
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.models import Location
+from .models import Device, DeviceType, Light, Plug
+
+
+class BulkUpdateViewTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user("bulk"))
+        location = Location.objects.create(name="Home")
+        device_type = DeviceType.objects.create(name="Smart plug")
+        self.plug = Plug.objects.create(
+            device=Device.objects.create(
+                name="Lamp plug", device_type=device_type, location=location
+            ),
+            is_on=False,
+        )
+        self.light = Light.objects.create(
+            device=Device.objects.create(
+                name="Ceiling", device_type=device_type, location=location
+            ),
+            brightness=10,
+        )
+
+    def patch(self, operations):
+        return self.client.patch("/api/bulk", operations, format="json")
+
+    def test_mixed_batch_returns_per_item_results_in_order(self):
+        missing = str(uuid.uuid4())
+        response = self.patch(
+            [
+                {
+                    "type": "plugs",
+                    "uuid": str(self.plug.uuid),
+                    "fields": {"is_on": True},
+                },
+                {"type": "plugs", "uuid": "not-a-uuid", "fields": {"is_on": True}},
+                {"type": "plugs", "uuid": missing, "fields": {"is_on": True}},
+                {
+                    "type": "lights",
+                    "uuid": str(self.light.uuid),
+                    "fields": {"brightness": "bright"},
+                },
+                {"type": "widgets", "uuid": missing, "fields": {}},
+                {
+                    "type": "lights",
+                    "uuid": str(self.light.uuid).upper(),
+                    "fields": {"color": "#ffffff"},
+                },
+            ]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()
+        self.assertEqual(
+            [result["status"] for result in results],
+            [200, 400, 404, 400, 400, 200],
+        )
+        self.assertIs(results[0]["data"]["is_on"], True)
+        self.assertIn("uuid", results[1]["errors"])
+        self.assertEqual(results[2]["uuid"], missing)
+        self.assertIn("brightness", results[3]["errors"])
+        self.assertEqual(results[5]["uuid"], str(self.light.uuid))
+
+        self.plug.refresh_from_db()
+        self.light.refresh_from_db()
+        self.assertTrue(self.plug.is_on)
+        self.assertEqual(self.light.brightness, 10)
+        self.assertEqual(self.light.color, "#ffffff")
+
+    def test_rejects_a_body_that_is_not_a_list(self):
+        response = self.patch({"type": "plugs"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writes_all_resource_types_in_one_transaction(self):
+        bulk_update = QuerySet.bulk_update
+
+        def fail_for_lights(queryset, objs, fields, *args, **kwargs):
+            if queryset.model is Light:
+                raise DatabaseError("Write failed")
+            return bulk_update(queryset, objs, fields, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "bulk_update", fail_for_lights):
+            with self.assertRaises(DatabaseError), self.assertLogs("django.request"):
+                self.patch(
+                    [
+                        {
+                            "type": "plugs",
+                            "uuid": str(self.plug.uuid),
+                            "fields": {"is_on": True},
+                        },
+                        {
+                            "type": "lights",
+                            "uuid": str(self.light.uuid),
+                            "fields": {"brightness": 90},
+                        },
+                    ]
+                )
+
+        # The plug was written before the lights failed, and rolled back with them
+        self.plug.refresh_from_db()
+        self.assertFalse(self.plug.is_on)
@@ -1,4 +1,9 @@
-from rest_framework import viewsets
+import uuid
+
+from django.db import transaction
+from rest_framework import status, viewsets
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .models import Device, DeviceType, System, Plug, Environmental, Light
 from .serializers import (
     DeviceSerializer,
@@ -39,3 +44,112 @@ class EnvironmentalViewSet(BaseUUIDViewSet):
 class LightViewSet(BaseUUIDViewSet):
     queryset = Light.objects.all()
     serializer_class = LightSerializer
+
+
+# Resource types accepted by the bulk endpoint, keyed by their router prefix
+BULK_SERIALIZERS = {
+    "devices": DeviceSerializer,
+    "plugs": PlugSerializer,
+    "lights": LightSerializer,
+    "environmentals": EnvironmentalSerializer,
+    "systems": SystemSerializer,
+}
+
+
+class BulkUpdateView(APIView):
+    """
+    Applies partial updates to many resources in one request and one transaction.
+
+    Expects a list of `{"type": str, "uuid": str, "fields": {...}}` operations; each one is
+    validated with the resource's serializer and the valid ones are written with
+    `bulk_update`. Returns one result per operation, in request order.
+
+    `bulk_update` bypasses `Model.save()` and the pre/post save signals. None of the
+    models listed in BULK_SERIALIZERS override `save()` or have receivers; one that
+    gains either must be removed from BULK_SERIALIZERS.
+    """
+
+    def patch(self, request):
+        operations = request.data
+        if not isinstance(operations, list):
+            return Response(
+                {"detail": "Expected a list of operations"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(operations)
+
+        # Group operations by resource type so each type is loaded and written once
+        grouped = {}
+        for index, operation in enumerate(operations):
+            if (
+                not isinstance(operation, dict)
+                or operation.get("type") not in BULK_SERIALIZERS
+                or not operation.get("uuid")
+                or not isinstance(operation.get("fields"), dict)
+            ):
+                results[index] = {
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "errors": {"detail": "Invalid operation"},
+                }
+                continue
+            try:
+                # Canonical form, as instances are matched on str(instance.uuid)
+                resource_id = str(uuid.UUID(str(operation["uuid"])))
+            except ValueError:
+                results[index] = {
+                    "type": operation["type"],
+                    "uuid": operation["uuid"],
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "errors": {"uuid": ["Must be a valid UUID."]},
+                }
+                continue
+            grouped.setdefault(operation["type"], []).append(
+                (index, resource_id, operation)
+            )
+
+        with transaction.atomic():
+            for resource_type, items in grouped.items():
+                serializer_class = BULK_SERIALIZERS[resource_type]
+                model = serializer_class.Meta.model
+                instances = {
+                    str(instance.uuid): instance
+                    for instance in model.objects.select_for_update().filter(
+                        uuid__in=[resource_id for _, resource_id, _ in items]
+                    )
+                }
+
+                updated, updated_fields = {}, set()
+                for index, resource_id, operation in items:
+                    result = {"type": resource_type, "uuid": resource_id}
+                    instance = instances.get(resource_id)
+                    if instance is None:
+                        result["status"] = status.HTTP_404_NOT_FOUND
+                        results[index] = result
+                        continue
+
+                    serializer = serializer_class(
+                        instance, data=operation["fields"], partial=True
+                    )
+                    if not serializer.is_valid():
+                        result["status"] = status.HTTP_400_BAD_REQUEST
+                        result["errors"] = serializer.errors
+                        results[index] = result
+                        continue
+
+                    for field, value in serializer.validated_data.items():
+                        setattr(instance, field, value)
+                        updated_fields.add(field)
+                    updated[resource_id] = instance
+                    result["status"] = status.HTTP_200_OK
+                    results[index] = result
+
+                if updated and updated_fields:
+                    model.objects.bulk_update(updated.values(), list(updated_fields))
+
+                for index, _, _ in items:
+                    result = results[index]
+                    if result["status"] == status.HTTP_200_OK:
+                        result["data"] = serializer_class(updated[result["uuid"]]).data
+
+        return Response(results)
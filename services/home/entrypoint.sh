@@ -2,4 +2,6 @@
 
 python manage.py migrate
 #python manage.py loaddata seed/fixtures.yaml
+# loaddata skips Routine.save(), which keeps trigger_specs in sync
+python manage.py parse_trigger_specs
 python manage.py runserver 0.0.0.0:8000
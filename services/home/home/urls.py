@@ -34,6 +34,7 @@ from devices.views import (
     PlugViewSet,
     EnvironmentalViewSet,
     LightViewSet,
+    BulkUpdateView,
 )
 from routines.views import RoutineViewSet, ActionViewSet
 
@@ -52,6 +53,7 @@ router.register(r"routines", RoutineViewSet)
 router.register(r"actions", ActionViewSet)
 
 urlpatterns = [
+    path("api/bulk", BulkUpdateView.as_view(), name="bulk"),
     path("api/", include(router.urls)),
     path("api-auth/", include("rest_framework.urls", namespace="rest-framework")),
     path("api-token-auth/", TokenAuthWithProfile.as_view(), name="api-token-auth"),
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from routines.models import Routine
+from routines.triggers import parse_triggers
+
+
+class Command(BaseCommand):
+    help = (
+        "Parses every routine's triggers into trigger_specs, e.g. after loaddata, "
+        "which skips Routine.save()."
+    )
+
+    def handle(self, *args, **options):
+        updated = 0
+        for routine in Routine.objects.all():
+            try:
+                trigger_specs = parse_triggers(routine.triggers)
+            except ValueError as e:
+                # Left as is; the controller falls back to reading `triggers` itself
+                self.stderr.write(f"Skipping routine {routine.uuid}: {e}")
+                continue
+            if trigger_specs != routine.trigger_specs:
+                routine.trigger_specs = trigger_specs
+                routine.save(update_fields=["trigger_specs"])
+                updated += 1
+        self.stdout.write(f"Updated trigger_specs of {updated} routines")
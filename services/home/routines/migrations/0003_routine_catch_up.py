@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routines", "0002_routine_trigger_specs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="routine",
+            name="catch_up",
+            field=models.CharField(
+                choices=[
+                    ("skip", "Skip missed runs"),
+                    ("once", "Run once"),
+                    ("all", "Run every missed run"),
+                ],
+                default="skip",
+                max_length=8,
+            ),
+        ),
+    ]
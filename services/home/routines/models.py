@@ -1,16 +1,35 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from core.models import Location, BaseModel
+from .triggers import parse_triggers
 
 
 class Routine(BaseModel):
+    # What the controller does with runs it missed while it was down
+    CATCH_UP_SKIP = "skip"  # Resume at the next future run
+    CATCH_UP_ONCE = "once"  # Run once for all missed runs
+    CATCH_UP_ALL = "all"  # Run once per missed run
+    CATCH_UP_CHOICES = [
+        (CATCH_UP_SKIP, "Skip missed runs"),
+        (CATCH_UP_ONCE, "Run once"),
+        (CATCH_UP_ALL, "Run every missed run"),
+    ]
+
     name = models.CharField(max_length=100)
     active = models.BooleanField(default=True)
     triggers = models.TextField(
         null=True, blank=True
-    )  # A comma-separated list of times, timestamps, and/or action types
+    )  # A comma-separated list of triggers; see routines/triggers.py for the grammar
+    trigger_specs = models.JSONField(
+        null=True, blank=True, editable=False
+    )  # `triggers` parsed into structured form; kept in sync on save (fixtures loaded
+    # with loaddata skip save(); `manage.py parse_trigger_specs` fills them in)
     repeat_interval = models.DurationField(
         null=True, blank=True
     )  # Optional repeat interval
+    catch_up = models.CharField(
+        max_length=8, choices=CATCH_UP_CHOICES, default=CATCH_UP_SKIP
+    )
     eval_condition = models.TextField(
         null=True, blank=True
     )  # Optional condition to be eval()'d
@@ -22,6 +41,21 @@ class Routine(BaseModel):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        super().clean()
+        try:
+            parse_triggers(self.triggers)
+        except ValueError as e:
+            raise ValidationError({"triggers": str(e)})
+
+    def save(self, *args, **kwargs):
+        try:
+            self.trigger_specs = parse_triggers(self.triggers)
+        except ValueError as e:
+            # Normally caught earlier, by clean() or the serializer
+            raise ValidationError({"triggers": str(e)})
+        super().save(*args, **kwargs)
+
 
 class Action(BaseModel):
     name = models.CharField(max_length=100)
@@ -1,4 +1,6 @@
+from rest_framework import serializers
 from .models import Routine, Action
+from .triggers import parse_triggers
 from core.serializers import UUIDModelSerializer
 
 
@@ -21,8 +23,22 @@ class RoutineSerializer(UUIDModelSerializer):
             "name",
             "active",
             "triggers",
+            "trigger_specs",
             "repeat_interval",
+            "catch_up",
             "eval_condition",
             "location",
             "actions",
         ]
+
+    def validate(self, attrs):
+        # Checked even when `triggers` is not being changed, so a partial update of a
+        # routine with stale triggers is rejected here rather than failing in save()
+        triggers = attrs.get(
+            "triggers", self.instance.triggers if self.instance else None
+        )
+        try:
+            parse_triggers(triggers)
+        except ValueError as e:
+            raise serializers.ValidationError({"triggers": str(e)})
+        return attrs
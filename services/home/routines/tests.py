@@ -1,3 +1,142 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.models import Location
+from .models import Routine
+from .triggers import parse_triggers
+
+
+def parse_one(trigger):
+    [spec] = parse_triggers(trigger)
+    return spec
+
+
+class TriggerParserTests(SimpleTestCase):
+    def test_ranges_ending_on_sunday(self):
+        # Python numbering, Monday is 0
+        self.assertEqual(parse_one("cron(0 7 * * sat-sun)")["weekday"], [5, 6])
+        self.assertEqual(parse_one("cron(0 7 * * 5-0)")["weekday"], [4, 5, 6])
+        self.assertEqual(parse_one("weekly(fri-sun 07:30)")["weekday"], [4, 5, 6])
+
+        every_day = parse_one("cron(0 7 * * mon-sun)")
+        self.assertEqual(every_day["weekday"], list(range(7)))
+        self.assertFalse(every_day["weekday_restricted"])
+
+    def test_rejects_backwards_ranges(self):
+        with self.assertRaises(ValueError):
+            parse_triggers("cron(0 7 * * fri-mon)")
+
+    def test_rejects_specs_that_never_fire(self):
+        for trigger in ("cron(0 0 31 feb *)", "cron(0 0 30,31 2 *)"):
+            with self.subTest(trigger=trigger):
+                with self.assertRaisesRegex(ValueError, "Never fires"):
+                    parse_triggers(trigger)
+
+    def test_accepts_days_some_selected_month_has(self):
+        self.assertEqual(parse_one("cron(0 0 31 2,3 *)")["month"], [2, 3])
+        self.assertEqual(parse_one("cron(0 0 29 feb *)")["day"], [29])
+        # With a restricted weekday either may match, as in cron
+        self.assertEqual(parse_one("cron(0 0 31 feb mon)")["weekday"], [0])
+
+    def test_time_zones(self):
+        self.assertIsNone(parse_one("cron(0 7 * * *)")["tz"])
+        self.assertEqual(
+            parse_one("cron(0 7 * * * Europe/Berlin)")["tz"], "Europe/Berlin"
+        )
+        self.assertEqual(
+            parse_one("weekly(mon 07:30:15 America/New_York)"),
+            {
+                "type": "cron",
+                "second": 15,
+                "minute": [30],
+                "hour": [7],
+                "day": list(range(1, 32)),
+                "month": list(range(1, 13)),
+                "weekday": [0],
+                "day_restricted": False,
+                "weekday_restricted": True,
+                "tz": "America/New_York",
+            },
+        )
+        with self.assertRaisesRegex(ValueError, "Unknown time zone"):
+            parse_triggers("weekly(mon 07:30 Mars/Olympus_Mons)")
+
+    def test_splits_on_top_level_commas_only(self):
+        specs = parse_triggers("cron(0 7,19 * * *), 07:30, plug__status?src=abc")
+        self.assertEqual([spec["type"] for spec in specs], ["cron", "time", "event"])
+        self.assertEqual(specs[0]["hour"], [7, 19])
+        self.assertEqual(specs[2]["src"], "abc")
+
+
+class RoutineTriggerValidationTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user("routines"))
+        self.location = Location.objects.create(name="Home")
+
+    def test_save_parses_trigger_specs(self):
+        routine = Routine.objects.create(
+            name="Mornings", triggers="weekly(mon-fri 07:30)", location=self.location
+        )
+        self.assertEqual(routine.trigger_specs[0]["weekday"], [0, 1, 2, 3, 4])
+
+    def test_save_raises_a_validation_error_for_invalid_triggers(self):
+        with self.assertRaises(ValidationError) as raised:
+            Routine.objects.create(
+                name="Broken", triggers="cron(0 0 31 feb *)", location=self.location
+            )
+        self.assertIn("triggers", raised.exception.message_dict)
+
+    def test_clean_rejects_invalid_triggers(self):
+        routine = Routine(name="Broken", triggers="cron(1 2 3)", location=self.location)
+        with self.assertRaises(ValidationError):
+            routine.full_clean()
+
+    def test_api_rejects_invalid_triggers_with_a_400(self):
+        routine = Routine.objects.create(
+            name="Mornings", triggers="07:30", location=self.location
+        )
+        response = self.client.patch(
+            f"/api/routines/{routine.uuid}",
+            {"triggers": "weekly(mon 25:00)"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("triggers", response.json())
+
+    def test_api_rejects_partial_updates_of_routines_with_stale_triggers(self):
+        routine = Routine.objects.create(
+            name="Mornings", triggers="07:30", location=self.location
+        )
+        # Written before the grammar tightened, bypassing save()
+        Routine.objects.filter(pk=routine.pk).update(triggers="cron(0 0 31 feb *)")
+        response = self.client.patch(
+            f"/api/routines/{routine.uuid}", {"name": "Renamed"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("triggers", response.json())
+
+
+class ParseTriggerSpecsCommandTests(TestCase):
+    def test_fills_in_specs_of_routines_saved_without_save(self):
+        location = Location.objects.create(name="Home")
+        # As loaddata does, bypassing Routine.save()
+        Routine.objects.bulk_create(
+            [
+                Routine(name="Nightly", triggers="21:00", location=location),
+                Routine(name="Broken", triggers="cron(1 2 3)", location=location),
+            ]
+        )
+
+        call_command("parse_trigger_specs", stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(
+            Routine.objects.get(name="Nightly").trigger_specs,
+            [{"type": "time", "time": "21:00"}],
+        )
+        self.assertIsNone(Routine.objects.get(name="Broken").trigger_specs)
@@ -0,0 +1,255 @@
+import datetime
+import json
+import re
+from urllib.parse import parse_qsl
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+"""
+Routine trigger grammar. `Routine.triggers` is a comma-separated list of:
+
+    2024-10-10T07:30:00[+02:00]          once, at an ISO datetime
+    07:30[:00]                           once, at the next occurrence of a time of day
+    cron(<min> <hour> <day> <month> <weekday> [<time zone>])
+                                         recurring; standard 5-field cron (lists, ranges,
+                                         steps, month/weekday names; 0 and 7 are Sunday)
+    weekly(<weekdays> <HH:MM[:SS]> [<time zone>])
+                                         recurring; e.g. `weekly(mon-fri 07:30 Europe/Berlin)`
+    <action>[?src=<uuid>&dest=<prefix>&body.<path>=<value>]
+                                         when a message with that action (and filters) arrives
+
+Commas inside parentheses belong to the entry. Each entry is parsed into the structured
+form stored in `Routine.trigger_specs`, which is what the controller schedules from.
+"""
+
+TRIGGER_AT = "at"
+TRIGGER_TIME = "time"
+TRIGGER_CRON = "cron"
+TRIGGER_EVENT = "event"
+
+MONTH_NAMES = [
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "may",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "oct",
+    "nov",
+    "dec",
+]
+# Cron numbering: 0 (and 7) is Sunday
+WEEKDAY_NAMES = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+# Longest month lengths (leap February), to reject days no selected month has
+MONTH_DAYS = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# (name, min, max, names)
+CRON_FIELDS = [
+    ("minute", 0, 59, None),
+    ("hour", 0, 23, None),
+    ("day", 1, 31, None),
+    ("month", 1, 12, MONTH_NAMES),
+    ("weekday", 0, 7, WEEKDAY_NAMES),
+]
+
+TIME_PATTERN = re.compile(r"^(\d{1,2}):(\d{2})(?::(\d{2}))?$")
+CALL_PATTERN = re.compile(r"^(\w+)\((.*)\)$", re.DOTALL)
+
+
+def split_triggers(text):
+    """Splits on commas that are not inside parentheses."""
+    entries, depth, current = [], 0, []
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f"Unbalanced ')' in triggers: {text}")
+        if char == "," and depth == 0:
+            entries.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if depth:
+        raise ValueError(f"Unbalanced '(' in triggers: {text}")
+    entries.append("".join(current))
+    return [entry.strip() for entry in entries if entry.strip()]
+
+
+def parse_number(value, low, high, names):
+    value = value.lower()
+    if names and value in names:
+        number = names.index(value) + (1 if names is MONTH_NAMES else 0)
+    elif value.isdigit():
+        number = int(value)
+    else:
+        raise ValueError(f"Invalid value '{value}'")
+    if not low <= number <= high:
+        raise ValueError(f"Value {number} out of range {low}-{high}")
+    return number
+
+
+def parse_cron_field(field, low, high, names):
+    """Expands one cron field (`*`, `a-b`, `*/n`, `a-b/n`, `a,b,c`) into sorted values."""
+    values = set()
+    for part in field.split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError(f"Invalid step in '{field}'")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (
+                parse_number(value, low, high, names) for value in part.split("-", 1)
+            )
+            if names is WEEKDAY_NAMES and end == 0:
+                end = 7  # Sunday closing a range, e.g. `mon-sun`
+            if start > end:
+                raise ValueError(f"Invalid range '{part}'")
+        else:
+            start = parse_number(part, low, high, names)
+            end = high if step > 1 else start
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+def parse_time_zone(name):
+    if name is None:
+        return None
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone '{name}'")
+    return name
+
+
+def cron_spec(minute, hour, day, month, weekday, time_zone=None, second=0):
+    """
+    Structured cron trigger. Weekdays are converted to Python numbering (Monday is 0).
+    As in cron, when both day and weekday are restricted, either may match.
+    """
+    weekdays = sorted({(value - 1) % 7 for value in weekday})
+    # With an unrestricted weekday only the days count, and they must exist in some month
+    if len(weekdays) == 7 and not any(
+        value <= MONTH_DAYS[number - 1] for number in month for value in day
+    ):
+        raise ValueError("Never fires: no selected month has any of the selected days")
+    return {
+        "type": TRIGGER_CRON,
+        "second": second,
+        "minute": minute,
+        "hour": hour,
+        "day": day,
+        "month": month,
+        "weekday": weekdays,
+        "day_restricted": len(day) < 31,
+        "weekday_restricted": len(weekdays) < 7,
+        "tz": parse_time_zone(time_zone),
+    }
+
+
+def parse_cron(arguments):
+    fields = arguments.split()
+    if len(fields) not in (5, 6):
+        raise ValueError(
+            f"cron() takes 5 fields and an optional time zone: {arguments}"
+        )
+    values = [
+        parse_cron_field(field, low, high, names)
+        for field, (_, low, high, names) in zip(fields, CRON_FIELDS)
+    ]
+    return cron_spec(*values, time_zone=fields[5] if len(fields) == 6 else None)
+
+
+def parse_time(value):
+    match = TIME_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid time '{value}'")
+    hour, minute, second = (int(group or 0) for group in match.groups())
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f"Invalid time '{value}'")
+    return hour, minute, second
+
+
+def parse_weekly(arguments):
+    fields = arguments.split()
+    if len(fields) not in (2, 3):
+        raise ValueError("weekly() takes weekdays, a time and an optional time zone")
+    weekday = parse_cron_field(fields[0], 0, 7, WEEKDAY_NAMES)
+    hour, minute, second = parse_time(fields[1])
+    return cron_spec(
+        [minute],
+        [hour],
+        list(range(1, 32)),
+        list(range(1, 13)),
+        weekday,
+        time_zone=fields[2] if len(fields) == 3 else None,
+        second=second,
+    )
+
+
+def parse_event(trigger):
+    action, _, query = trigger.partition("?")
+    if not re.match(r"^[\w:.\-]+$", action):
+        raise ValueError(f"Invalid action type '{action}'")
+    spec = {
+        "type": TRIGGER_EVENT,
+        "action": action,
+        "src": None,
+        "dest": "",
+        "body": [],
+    }
+    filters = parse_qsl(query, keep_blank_values=True, strict_parsing=bool(query))
+    for name, value in filters:
+        if name == "src":
+            spec["src"] = value
+        elif name == "dest":
+            spec["dest"] = value
+        elif name.startswith("body.") and len(name) > len("body."):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            spec["body"].append([name[len("body.") :].split("."), value])
+        else:
+            raise ValueError(f"Unknown event filter '{name}'")
+    return spec
+
+
+def parse_trigger(trigger):
+    call = CALL_PATTERN.match(trigger)
+    if call:
+        name, arguments = call.groups()
+        if name == "cron":
+            return parse_cron(arguments)
+        if name == "weekly":
+            return parse_weekly(arguments)
+        raise ValueError(f"Unknown trigger function '{name}'")
+    if TIME_PATTERN.match(trigger):
+        parse_time(trigger)
+        return {"type": TRIGGER_TIME, "time": trigger}
+    if "T" in trigger and trigger[:1].isdigit():
+        try:
+            return {
+                "type": TRIGGER_AT,
+                "at": datetime.datetime.fromisoformat(trigger).isoformat(),
+            }
+        except ValueError:
+            raise ValueError(f"Invalid datetime '{trigger}'")
+    return parse_event(trigger)
+
+
+def parse_triggers(text):
+    """Parses `Routine.triggers` into a list of structured specs; raises ValueError naming the bad entry."""
+    specs = []
+    for trigger in split_triggers(text or ""):
+        try:
+            specs.append(parse_trigger(trigger))
+        except ValueError as e:
+            raise ValueError(f"Invalid trigger '{trigger}': {e}")
+    return specs